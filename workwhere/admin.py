@@ -1,9 +1,125 @@
-from django.contrib import admin
-
-from .models import Employee, Workplace, Location, Reservation, Floor, Infotext, Settings
-
-class ReservationAdmin(admin.ModelAdmin):
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.functional import cached_property
+
+from .booking import cancel_reservations, move_reservations
+from .forms import FloorMoveForm
+from .models import Employee, Workplace, Location, Reservation, Floor, Infotext, Settings, ArchivedReservation
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the row count estimate of PostgreSQL for unfiltered lists of
+    large tables, as counting all rows takes seconds there. Other
+    databases and filtered lists are counted exactly.
+    """
+    # Below this estimate the rows are counted.
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            connection = connections[self.object_list.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s",
+                                   [self.object_list.model._meta.db_table])
+                    row = cursor.fetchone()
+                if row and row[0] > self.estimate_threshold:
+                    return int(row[0])
+        return super().count
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """List pages of large tables without counting all rows twice."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class ReservationAdmin(ScalableAdmin):
     list_display = ('day', 'workplace', 'employee')
+    list_select_related = ('workplace', 'employee')
+    list_filter = ('isoffice',)
+    # Filters by day ranges, which use the index on (day, workplace).
+    date_hierarchy = 'day'
+    ordering = ('-day',)
+    autocomplete_fields = ('employee', 'workplace')
+    actions = ['cancel_days']
+
+    def delete_queryset(self, request, queryset):
+        cancel_reservations(queryset)
+
+    @admin.action(description="Cancel all reservations on the days of the selected reservations")
+    def cancel_days(self, request, queryset):
+        days = set(queryset.values_list('day', flat=True))
+        count = cancel_reservations(Reservation.objects.filter(day__in=days))
+        self.message_user(request, f"Cancelled {count} reservations on {len(days)} days.", messages.SUCCESS)
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if self.has_change_permission(request):
+            # One action per office floor, the admin has no parameters
+            # for actions.
+            for floor in Floor.objects.filter(location__isoffice=True).select_related('location'):
+                name = f'move_to_floor_{floor.pk}'
+                actions[name] = (self._move_to_floor(floor), name, f"Move the selected reservations to {floor}")
+        return actions
+
+    @staticmethod
+    def _move_to_floor(floor):
+        def move_to_floor(modeladmin, request, queryset):
+            modeladmin.move(request, queryset, floor)
+        return move_to_floor
+
+    def move(self, request, queryset, floor):
+        try:
+            moved, conflicts = move_reservations(queryset, floor)
+        except ValidationError as e:
+            self.message_user(request, e.messages[0], messages.ERROR)
+            return
+        self.message_user(request, f"Moved {moved} reservations to {floor}.", messages.SUCCESS)
+        for day, message in conflicts.items():
+            self.message_user(request, f"{day}: {message}", messages.WARNING)
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {'can_move_floor': self.has_change_permission(request), **(extra_context or {})}
+        return super().changelist_view(request, extra_context)
+
+    def get_urls(self):
+        return [
+            path('move-floor/', self.admin_site.admin_view(self.move_floor_view),
+                 name='workwhere_reservation_move_floor'),
+            *super().get_urls(),
+        ]
+
+    def move_floor_view(self, request):
+        """
+        Moves all reservations of a floor in a date range, unlike the
+        actions not limited to the selected reservations.
+        """
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        form = FloorMoveForm(request.POST or None)
+        if request.method == 'POST' and form.is_valid():
+            reservations = Reservation.objects.filter(
+                workplace__floor=form.cleaned_data['source'],
+                day__range=(form.cleaned_data['start'], form.cleaned_data['end']))
+            self.move(request, reservations, form.cleaned_data['target'])
+            return redirect('admin:workwhere_reservation_changelist')
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Move reservations to another floor",
+            'form': form,
+        }
+        return TemplateResponse(request, 'admin/workwhere/reservation/move_floor.html', context)
 
 admin.site.register(Reservation, ReservationAdmin)
 
@@ -17,14 +133,19 @@ class LocationAdmin(admin.ModelAdmin):
 
 admin.site.register(Location, LocationAdmin)
 
-class EmployeeAdmin(admin.ModelAdmin):
+class EmployeeAdmin(ScalableAdmin):
     list_display = ('last_name', 'first_name', 'id', 'isstudent', 'isactive')
+    list_filter = ('isactive', 'isstudent')
     search_fields = ['last_name', 'first_name', 'id']
 
 admin.site.register(Employee, EmployeeAdmin)
 
-class WorkplaceAdmin(admin.ModelAdmin):
-    list_display = ('name', 'floor')
+class WorkplaceAdmin(ScalableAdmin):
+    list_display = ('name', 'floor', 'x', 'y')
+    list_select_related = ('floor__location',)
+    list_filter = ('floor__location',)
+    search_fields = ['name']
+    autocomplete_fields = ('floor',)
 
 admin.site.register(Workplace, WorkplaceAdmin)
 
@@ -33,6 +154,8 @@ class WorkplaceInline(admin.TabularInline):
     extra = 3
 
 class FloorAdmin(admin.ModelAdmin):
+    list_select_related = ('location',)
+    search_fields = ['name', 'location__name']
     inlines = [WorkplaceInline]
 
 admin.site.register(Floor, FloorAdmin)
@@ -42,4 +165,18 @@ class InfotextAdmin(admin.ModelAdmin):
 
 admin.site.register(Infotext, InfotextAdmin)
 
-admin.site.register(Settings)
\ No newline at end of file
+admin.site.register(Settings)
+
+class ArchivedReservationAdmin(ScalableAdmin):
+    list_display = ('day', 'workplace', 'employee')
+    list_select_related = ('workplace', 'employee')
+    date_hierarchy = 'day'
+    ordering = ('-day',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+admin.site.register(ArchivedReservation, ArchivedReservationAdmin)
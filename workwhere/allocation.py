@@ -0,0 +1,135 @@
+"""
+Automatic assignment of office desks to a group of employees, e.g. a team
+meeting in the office on some days.
+
+allocate() reads the occupancy of the days with one query (see
+Availability) and assigns the desks in memory. Apart from the preferences
+all desks are equally good, so handing them out greedily finds a full
+assignment whenever there are enough free desks. Employees keep the desk
+of the previous day if it is free, the others get the preferred desks
+first, then the free desks ordered by location, floor and name, so the
+group sits close together. The plan is written with one bulk_create, or
+not at all.
+"""
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from .availability import Availability
+from .models import Reservation, Workplace, validate_reservation_day
+from .signals import reservations_changed
+
+
+# Values of the `together` option of allocate()
+GROUPS = ('floor', 'location')
+
+
+def _group(desk, together):
+    return desk.floor_id if together == 'floor' else desk.floor.location_id
+
+
+def _choose_group(desks, free, size, together, preferred):
+    """
+    The id of the floor or location with at least size free desks on
+    all days, preferring the one with most preferred desks, or None.
+    """
+    groups = {}
+    for desk in desks:
+        groups.setdefault(_group(desk, together), []).append(desk.pk)
+    feasible = [group for group, desk_ids in groups.items()
+                if all(len(free[day].intersection(desk_ids)) >= size for day in free)]
+    if not feasible:
+        return None
+    # max() keeps the first of equal groups, i.e. in the order of the desks.
+    return max(feasible, key=lambda group: sum(pk in preferred for pk in groups[group]))
+
+
+def allocate(employees, days, together=None, preferred=(), workplaces=None, commit=True):
+    """
+    Reserve an office desk for each of the employees (instances or ids)
+    on each of the days.
+
+    together: None, 'floor' or 'location' to seat all employees on the
+    same floor or location, the same one on all days.
+    preferred: desks (instances or ids) assigned first, in this order.
+    workplaces: queryset of the desks to choose from, e.g. of one floor.
+
+    Returns a tuple (plan, conflicts). conflicts is {day: [messages]}
+    of the days without a full assignment, plan the list of the new
+    reservations ordered by day, empty if there are conflicts. With
+    commit, a plan without conflicts is saved.
+    """
+    if together not in (None, *GROUPS):
+        raise ValueError(f"together must be one of {', '.join(GROUPS)}")
+    employee_ids = list(dict.fromkeys(getattr(employee, 'pk', employee) for employee in employees))
+    # Ordered and fast to look up
+    preferred = dict.fromkeys(getattr(desk, 'pk', desk) for desk in preferred)
+
+    conflicts = {}
+    candidates = []
+    for day in sorted(set(days)):
+        try:
+            validate_reservation_day(day)
+        except ValidationError as e:
+            conflicts[day] = e.messages
+        else:
+            candidates.append(day)
+
+    availability = Availability(candidates)
+    for day in candidates:
+        for employee_id in employee_ids:
+            if availability.reserved_workplace(day, employee_id) is not None:
+                conflicts.setdefault(day, []).append(f'{employee_id}: Only one reservation per day and user.')
+
+    desks = list((Workplace.objects if workplaces is None else workplaces)
+        .filter(floor__location__isoffice=True)
+        .select_related('floor__location')
+        .order_by('floor__location__name', 'floor__name', 'name'))
+    desk_ids = {desk.pk for desk in desks}
+    free = {day: desk_ids - availability.occupied[day].keys() for day in candidates}
+
+    if together and candidates:
+        group = _choose_group(desks, free, len(employee_ids), together, preferred)
+        if group is None:
+            for day in candidates:
+                conflicts.setdefault(day, []).append(
+                    f'No {together} with {len(employee_ids)} free desks on all days.')
+            return [], dict(sorted(conflicts.items()))
+        desks = [desk for desk in desks if _group(desk, together) == group]
+
+    by_pk = {desk.pk: desk for desk in desks}
+    order = [*(pk for pk in preferred if pk in by_pk), *(pk for pk in by_pk if pk not in preferred)]
+    plan = []
+    previous = {}
+    for day in candidates:
+        available = [pk for pk in order if pk in free[day]]
+        if len(available) < len(employee_ids):
+            conflicts.setdefault(day, []).append(
+                f'Not enough free desks: {len(available)} for {len(employee_ids)} employees.')
+            continue
+        assigned = {}
+        # Keep the desks of the previous day where possible.
+        for employee_id in employee_ids:
+            if previous.get(employee_id) in free[day]:
+                assigned[employee_id] = previous[employee_id]
+        used = set(assigned.values())
+        remaining = iter(pk for pk in available if pk not in used)
+        for employee_id in employee_ids:
+            if employee_id not in assigned:
+                assigned[employee_id] = next(remaining)
+        previous = assigned
+        plan.extend(Reservation(day=day, employee_id=employee_id, workplace=by_pk[pk], isoffice=True)
+                    for employee_id, pk in assigned.items())
+
+    if conflicts:
+        return [], dict(sorted(conflicts.items()))
+    if not commit or not plan:
+        return plan, {}
+
+    try:
+        with transaction.atomic():
+            Reservation.objects.bulk_create(plan)
+            reservations_changed.send(sender=Reservation, days=set(candidates), employees=set(employee_ids))
+    except IntegrityError:
+        message = 'Reservation failed due to a concurrent change, please try again.'
+        return [], {day: [message] for day in candidates}
+    return plan, {}
@@ -0,0 +1,234 @@
+"""
+Read-only JSON API for availability and occupancy, e.g. for kiosk
+displays or chat bots.
+
+The payloads are built from values() queries without instantiating
+models. Lists of workplaces are paginated with the GET parameters
+`page` and `limit`.
+"""
+import datetime
+import functools
+
+from django.core.paginator import Paginator
+from django.http import Http404, JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import condition
+
+from .models import Reservation, Workplace, Floor, DataVersion
+from .occupancy import build_floor_occupancy, build_floors_occupancy
+from .availability import Availability
+
+
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 1000
+MAX_DAYS = 31
+
+WORKPLACE_FIELDS = ('id', 'name', 'floor__name', 'floor__location__name')
+EMPLOYEE_FIELDS = ('employee_id', 'employee__first_name', 'employee__last_name')
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params={'separators': (',', ':')})
+
+
+def _parse_date(value):
+    """
+    The date of a YYYY-MM-DD string, or None if it is not in this format.
+    Raises BadRequest for invalid dates like 2023-02-30.
+    """
+    try:
+        return parse_date(value)
+    except ValueError:
+        raise BadRequest(f'{value} is not a valid date.')
+
+
+def _get_day(request):
+    """The GET parameter `day`, default today."""
+    day = _parse_date(request.GET['day']) if request.GET.get('day') else timezone.now().date()
+    if day is None:
+        raise BadRequest('day must be given as YYYY-MM-DD.')
+    return day
+
+
+def _paginate(request, queryset):
+    """Returns the requested page of the queryset and its metadata."""
+    try:
+        limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        page_number = int(request.GET.get('page', 1))
+        if limit < 1 or page_number < 1:
+            raise ValueError
+    except ValueError:
+        raise BadRequest('page and limit must be positive numbers.')
+
+    paginator = Paginator(queryset, limit)
+    page = paginator.get_page(page_number)
+    return list(page), {
+        'count': paginator.count,
+        'page': page.number,
+        'num_pages': paginator.num_pages,
+    }
+
+
+def _workplace(values):
+    return {
+        'id': values['id'],
+        'name': values['name'],
+        'floor': values['floor__name'],
+        'location': values['floor__location__name'],
+    }
+
+
+def _employee(values):
+    return {
+        'id': values['employee_id'],
+        'first_name': values['employee__first_name'],
+        'last_name': values['employee__last_name'],
+    }
+
+
+def _office_workplaces():
+    return Workplace.objects \
+        .filter(floor__location__isoffice=True) \
+        .order_by('floor__location__name', 'floor__name', 'name') \
+        .values(*WORKPLACE_FIELDS)
+
+
+def _handle_bad_request(view):
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as e:
+            return _json({'error': str(e)}, status=400)
+    return wrapper
+
+
+@_handle_bad_request
+def free_workplaces(request):
+    """
+    Workplaces which can be reserved on the given `day`, or on all days
+    from `day` to `end` (at most MAX_DAYS). If `employee` is given, the
+    workplaces of its own reservations count as free.
+    """
+    day = _parse_date(request.GET.get('day', ''))
+    end = _parse_date(request.GET['end']) if request.GET.get('end') else day
+    if day is None or end is None:
+        raise BadRequest('day and end must be given as YYYY-MM-DD.')
+    if not 0 <= (end - day).days < MAX_DAYS:
+        raise BadRequest(f'end must be after day, at most {MAX_DAYS} days.')
+
+    availability = Availability(day + datetime.timedelta(days=i) for i in range((end - day).days + 1))
+    workplaces = availability \
+        .free_workplaces(request.GET.get('employee')) \
+        .values('floor__location__isoffice', *WORKPLACE_FIELDS)
+
+    page, meta = _paginate(request, workplaces)
+    return _json({
+        'day': day,
+        'end': end,
+        **meta,
+        'results': [{**_workplace(values), 'isoffice': values['floor__location__isoffice']}
+                    for values in page],
+    })
+
+
+@_handle_bad_request
+def today(request):
+    """Office workplaces with the employee who reserved it today."""
+    day = timezone.now().date()
+    page, meta = _paginate(request, _office_workplaces())
+
+    occupancy = {values['workplace_id']: _employee(values) for values in Reservation.objects
+                 .filter(day=day, workplace__in=[values['id'] for values in page])
+                 .values('workplace_id', *EMPLOYEE_FIELDS)}
+
+    return _json({
+        'day': day,
+        **meta,
+        'results': [{**_workplace(values), 'employee': occupancy.get(values['id'])}
+                    for values in page],
+    })
+
+
+@_handle_bad_request
+def week(request, year, week):
+    """
+    Office workplaces with the employees who reserved it on the days
+    of the given ISO week, in the order of `days`.
+    """
+    try:
+        monday = datetime.date.fromisocalendar(year, week, 1)
+    except ValueError:
+        raise Http404('Year or week not valid.')
+    days = [monday + datetime.timedelta(days=i) for i in range(5)]
+    page, meta = _paginate(request, _office_workplaces())
+
+    occupancy = {(values['workplace_id'], values['day']): _employee(values) for values in Reservation.objects
+                 .filter(day__range=(days[0], days[-1]), workplace__in=[values['id'] for values in page])
+                 .values('workplace_id', 'day', *EMPLOYEE_FIELDS)}
+
+    return _json({
+        'days': days,
+        **meta,
+        'results': [{**_workplace(values), 'employees': [occupancy.get((values['id'], day)) for day in days]}
+                    for values in page],
+    })
+
+
+@_handle_bad_request
+def floor_occupancy(request, floor_id):
+    """
+    All workplaces of a floor with their position on the floor map (x
+    and y in percent, or null) and the employee who reserved it on the
+    given `day` (default: today). Not paginated, floors are small.
+    """
+    day = _get_day(request)
+    desks = build_floor_occupancy(floor_id, day)
+    if not desks and not Floor.objects.filter(pk=floor_id).exists():
+        raise Http404('Floor not found.')
+
+    return _json({
+        'floor': floor_id,
+        'day': day,
+        'results': desks,
+    })
+
+
+def _floors_occupancy_etag(request):
+    """Changes with the floors, the layout, the employees and the reservations of the day."""
+    try:
+        day = _get_day(request)
+    except BadRequest:
+        return None
+    keys = [DataVersion.LAYOUT, DataVersion.EMPLOYEES, DataVersion.day_key(day)]
+    versions = DataVersion.get_many(*keys)
+    # The change times are included, as versions can repeat after rollbacks.
+    # No commas, they separate the ETags of If-None-Match.
+    return '-'.join([request.GET.get('floors', '').replace(',', '_'),
+                     *(f"{key}.{versions[key][0]}.{versions[key][1].timestamp()}" if key in versions else key
+                       for key in keys)])
+
+
+@_handle_bad_request
+@condition(etag_func=_floors_occupancy_etag)
+def floors_occupancy(request):
+    """
+    Like floor_occupancy for several floors (GET parameter `floors`,
+    comma separated ids) in one request, as {floor id: workplaces}.
+    Supports ETags, so unchanged occupancy is answered with 304.
+    """
+    try:
+        floor_ids = [int(floor_id) for floor_id in request.GET.get('floors', '').split(',') if floor_id]
+    except ValueError:
+        raise BadRequest('floors must be comma separated ids.')
+    day = _get_day(request)
+
+    return _json({
+        'day': day,
+        'results': build_floors_occupancy(floor_ids, day),
+    })
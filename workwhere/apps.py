@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class WorkwhereConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'workwhere'
+
+    def ready(self):
+        from . import signals, events, rollups, floormaps # noqa: F401
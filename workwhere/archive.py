@@ -0,0 +1,85 @@
+"""
+Archival of old reservations.
+
+The pages only show reservations a few weeks around today, but every
+query on Reservation pays for the size of the table and its indexes.
+Reservations older than the retention horizon are therefore moved to
+ArchivedReservation in batches, optionally also written to a gzip
+compressed JSON-lines file. The occupancy rollups and the reports
+include the archived reservations.
+
+The horizon is set with WORKWHERE_ARCHIVE_AFTER_DAYS (default: no
+archival). Run the management command workwhere_archive, or call
+archive_scheduled() from a scheduler, e.g. once per night.
+"""
+import datetime
+import gzip
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .booking import delete_reservations
+from .models import Reservation, ArchivedReservation
+
+
+BATCH_SIZE = 1000
+
+
+def get_horizon():
+    """First day not archived according to the settings, or None."""
+    days = getattr(settings, 'WORKWHERE_ARCHIVE_AFTER_DAYS', None)
+    if days is None:
+        return None
+    return timezone.now().date() - datetime.timedelta(days=days)
+
+
+def archive_reservations(before, batch_size=BATCH_SIZE, export=None):
+    """
+    Move the reservations before the given day to the archive, in
+    batches of one transaction each. If export (a binary file) is given,
+    the reservations are also written to it as gzip compressed JSON
+    lines. Returns the number of archived reservations.
+    """
+    archived = 0
+    writer = gzip.GzipFile(fileobj=export, mode='wb') if export is not None else None
+    try:
+        while True:
+            with transaction.atomic():
+                batch = list(Reservation.objects
+                             .filter(day__lt=before)
+                             .order_by('day', 'pk')
+                             .values('pk', 'day', 'employee_id', 'workplace_id', 'isoffice')
+                             [:batch_size])
+                if not batch:
+                    break
+                ArchivedReservation.objects.bulk_create(
+                    [ArchivedReservation(day=values['day'], employee_id=values['employee_id'],
+                                         workplace_id=values['workplace_id'], isoffice=values['isoffice'])
+                     for values in batch])
+                delete_reservations([(values['pk'], values['day'], values['employee_id']) for values in batch])
+            if writer is not None:
+                for values in batch:
+                    writer.write(json.dumps({
+                        'day': str(values['day']),
+                        'employee': values['employee_id'],
+                        'workplace': values['workplace_id'],
+                        'isoffice': values['isoffice'],
+                    }).encode() + b'\n')
+            archived += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return archived
+
+
+def archive_scheduled():
+    """
+    Archive the reservations older than WORKWHERE_ARCHIVE_AFTER_DAYS, if
+    the setting is given. Meant to be called regularly by a scheduler.
+    """
+    horizon = get_horizon()
+    if horizon is None:
+        return 0
+    return archive_reservations(horizon)
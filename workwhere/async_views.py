@@ -0,0 +1,96 @@
+"""
+Async variants of the views polled most often: the workplace dropdown of
+the reservation form, the today page, its list fragment and its event
+stream.
+
+With the setting WORKWHERE_ASYNC_VIEWS = True their URLs are routed here
+instead of to the sync views, which pays off under ASGI: waiting polls
+don't hold a worker each. Under WSGI they still work, Django runs each
+of them in its own event loop.
+"""
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views import generic
+
+from .availability import Availability
+from .events import astream_events
+from .models import DataVersion
+from .occupancy import abuild_today_status, aget_overlay_floors
+from .views import render, _event_stream_response, _today_context, _version_keys, _versions_result
+
+
+async def _resolve_user(request):
+    """
+    Loads the user of the session in a thread, as the lazy request.user
+    can't query the database in async code.
+    """
+    await sync_to_async(lambda: request.user.pk)()
+
+
+async def load_workplaces(request):
+    """
+    Async version of views.load_workplaces().
+    """
+    await _resolve_user(request)
+    day = request.GET.get('day')
+    employee = request.GET.get('employee')
+    reserved_pk = None
+    choice_workplaces = []
+    if day and employee:
+        try:
+            availability = await Availability.acreate([day])
+        except ValueError:
+            pass  # invalid day, no options
+        else:
+            choice_workplaces = [workplace async for workplace in availability.free_workplaces(employee)]
+            reserved_pk = availability.reserved_workplace(day, employee)
+
+    context = {
+        'workplaces': choice_workplaces,
+        'reserved_pk': reserved_pk,
+        }
+
+    return render(request, 'workwhere/workplace_dropdown_list_options.html', context)
+
+
+class Today(generic.View):
+    """
+    Async version of views.Today, with the same ETag and Last-Modified
+    headers. The condition() decorator doesn't support async views, so
+    the conditional response is built here.
+    """
+    template_name = 'workwhere/today.html'
+
+    async def get(self, request):
+        await _resolve_user(request)
+        day = timezone.now().date()
+        keys = _version_keys([day])
+        etag, last_modified, _ = _versions_result(request, keys, await DataVersion.aget_many(*keys), [day])
+        etag = quote_etag(etag)
+        last_modified = int(last_modified.timestamp())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            status = await abuild_today_status(day)
+
+            context = _today_context(status)
+            if self.template_name == Today.template_name:
+                # The overlay is updated by the page itself.
+                context['overlay_floors'] = await aget_overlay_floors(status)
+
+            response = render(request, self.template_name, context)
+
+        if not response.has_header('Last-Modified'):
+            response.headers['Last-Modified'] = http_date(last_modified)
+        response.headers.setdefault('ETag', etag)
+        return response
+
+
+async def today_events(request):
+    """
+    Async version of views.today_events(), which keeps no thread busy
+    while waiting for events.
+    """
+    return _event_stream_response(astream_events)
@@ -0,0 +1,76 @@
+"""
+Which workplaces can be reserved on which days.
+
+Availability reads the reservations of the requested days with one flat
+query and answers the questions of the reservation form, the workplace
+dropdown and the API from memory. Office workplaces are taken by a
+reservation of another employee, other workplaces are always free.
+"""
+import datetime
+
+from .models import Reservation, Workplace
+
+
+def _as_date(day):
+    if isinstance(day, datetime.date):
+        return day
+    return datetime.date.fromisoformat(str(day))
+
+
+def _employee_id(employee):
+    return getattr(employee, 'pk', employee)
+
+
+class Availability:
+    """
+    The reservations of the given days (dates or ISO strings). Raises
+    ValueError for invalid days.
+    """
+
+    def __init__(self, days, reservations=None):
+        self.days = sorted({_as_date(day) for day in days})
+        # {day: {office workplace id: employee id}}
+        self.occupied = {day: {} for day in self.days}
+        # {(day, employee id): workplace id}
+        self.reserved = {}
+
+        if reservations is None:
+            reservations = self._reservations(self.days)
+        for day, workplace_id, employee_id, isoffice in reservations:
+            if isoffice:
+                self.occupied[day][workplace_id] = employee_id
+            self.reserved[day, employee_id] = workplace_id
+
+    @staticmethod
+    def _reservations(days):
+        return Reservation.objects \
+            .filter(day__in=days) \
+            .values_list('day', 'workplace_id', 'employee_id', 'isoffice')
+
+    @classmethod
+    async def acreate(cls, days):
+        """Async constructor, for the async views."""
+        days = {_as_date(day) for day in days}
+        return cls(days, [row async for row in cls._reservations(days)])
+
+    def taken(self, employee=None):
+        """
+        Ids of the office workplaces reserved by others on any of the
+        days. Reservations of the given employee don't count.
+        """
+        employee_id = _employee_id(employee)
+        return {workplace_id for occupied in self.occupied.values()
+                for workplace_id, reserved_by in occupied.items() if reserved_by != employee_id}
+
+    def free_workplaces(self, employee=None):
+        """
+        Workplaces which can be reserved on all of the days by the given
+        employee, non-office workplaces first.
+        """
+        return Workplace.objects \
+            .exclude(pk__in=self.taken(employee)) \
+            .order_by('floor__location__isoffice', 'name')
+
+    def reserved_workplace(self, day, employee):
+        """Id of the workplace the employee reserved on the day, or None."""
+        return self.reserved.get((_as_date(day), _employee_id(employee)))
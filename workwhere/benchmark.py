@@ -0,0 +1,251 @@
+"""
+Benchmarks of the main pages with generated data.
+
+generate() fills the database with a synthetic office of the given size
+and reservations for the given number of months. run() requests the
+pages and measures the number of queries, the wall time and the peak
+memory (allocated by Python) of each. run_polling() compares the
+throughput of the polled views in the sync and the async variant. The
+management command workwhere_benchmark does these inside a transaction
+which is rolled back, and prints the results as JSON for comparisons
+across versions.
+"""
+import asyncio
+import datetime
+import gc
+import random
+import statistics
+import time
+import tracemalloc
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from .models import Employee, Location, Floor, Workplace, Reservation, Settings, DataVersion
+from .rollups import rebuild
+from . import views, async_views
+
+
+def generate(locations=2, floors=5, desks=40, employees=500, months=3, occupancy=0.6, seed=0):
+    """
+    Create `locations` office locations with `floors` floors of `desks`
+    workplaces each, a home office workplace and `employees` employees.
+    Each employee reserves on a share `occupancy` of the working days
+    (Monday to Friday) of the last `months` months up to two weeks
+    ahead, an office desk if one is left, otherwise home office.
+    Returns a dict with the numbers of the created objects.
+    """
+    rng = random.Random(seed)
+
+    office_locations = Location.objects.bulk_create(
+        [Location(name=f'benchmark_office_{i}', isoffice=True) for i in range(locations)])
+    new_floors = Floor.objects.bulk_create(
+        [Floor(name=f'floor_{j}', location=location) for location in office_locations for j in range(floors)])
+    office_desks = Workplace.objects.bulk_create(
+        [Workplace(name=f'b{i}_{j}', floor=floor) for i, floor in enumerate(new_floors) for j in range(desks)])
+    other = Location.objects.create(name='benchmark_other', isoffice=False)
+    home_office = Workplace.objects.create(name='benchmark_home',
+                                           floor=Floor.objects.create(name='other', location=other))
+    new_employees = Employee.objects.bulk_create(
+        [Employee(id=f'bench_{i}', first_name=f'First{i}', last_name=f'Last{i}', isstudent=rng.random() < 0.2)
+         for i in range(employees)])
+
+    today = timezone.now().date()
+    start = today.replace(day=1)
+    for _ in range(months - 1):
+        start = (start - datetime.timedelta(days=1)).replace(day=1)
+    end = today + datetime.timedelta(weeks=2)
+
+    desk_ids = [desk.pk for desk in office_desks]
+    day = start
+    days = []
+    reservations = 0
+    while day <= end:
+        if day.isoweekday() <= 5:
+            free = desk_ids[:]
+            rng.shuffle(free)
+            batch = []
+            for employee in new_employees:
+                if rng.random() >= occupancy:
+                    continue
+                if free:
+                    batch.append(Reservation(day=day, employee=employee, workplace_id=free.pop(), isoffice=True))
+                else:
+                    batch.append(Reservation(day=day, employee=employee, workplace=home_office, isoffice=False))
+            # Without the signals, the rollups are built at the end.
+            Reservation.objects.bulk_create(batch)
+            reservations += len(batch)
+            days.append(day)
+        day += datetime.timedelta(days=1)
+    rebuild(start, end)
+    # Bulk inserts don't send signals, the versions are needed for the
+    # cached fragments.
+    DataVersion.bump(DataVersion.LAYOUT, DataVersion.EMPLOYEES, *(DataVersion.day_key(day) for day in days))
+
+    return {
+        'locations': locations,
+        'floors': len(new_floors),
+        'desks': len(office_desks),
+        'employees': employees,
+        'months': months,
+        'reservations': reservations,
+    }
+
+
+def _time(view, get_request, args, kwargs, repeat, before=None):
+    """Runs the view repeat times, returns the minimum and median time."""
+    times = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        request = get_request()
+        start = time.perf_counter()
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        times.append(time.perf_counter() - start)
+    return {
+        'min': round(1000*min(times), 2),
+        'median': round(1000*statistics.median(times), 2),
+    }
+
+
+def _invalidate():
+    """Makes the next requests miss the cached fragments, like a change of the layout."""
+    DataVersion.bump(DataVersion.LAYOUT)
+
+
+def _measure(view, get_request, args, kwargs, repeat):
+    """
+    Runs the view repeat times with the cached fragments and repeat
+    times without, returns the measurements.
+    """
+    times = _time(view, get_request, args, kwargs, repeat)
+    uncached_times = _time(view, get_request, args, kwargs, repeat, before=_invalidate)
+
+    # Memory and queries in a separate run, tracemalloc slows down.
+    request = get_request()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'queries': len(queries),
+        'time_ms': times,
+        'uncached_time_ms': uncached_times,
+        'peak_memory_kb': round(peak/1024, 1),
+        'response_kb': round(len(response.content)/1024, 1),
+    }
+
+
+def get_cases():
+    """The benchmarked pages: {name: (url, GET parameters)}."""
+    today = timezone.now().date()
+    year, week, _ = today.isocalendar()
+    last_month = today.replace(day=1) - datetime.timedelta(days=1)
+    employee = Employee.objects.filter(isactive=True).values_list('pk', flat=True).first()
+    return {
+        'index': (reverse('workwhere:index'), {}),
+        'load_workplaces': (reverse('workwhere:ajax_load_workplaces'), {'day': str(today), 'employee': employee}),
+        'today': (reverse('workwhere:today'), {}),
+        'week': (reverse('workwhere:week', args=[year, week]), {}),
+        'summary': (reverse('workwhere:summary', args=[last_month.year, last_month.month]), {}),
+    }
+
+
+def run(repeat=5, cases=None):
+    """
+    Request the pages (see get_cases()) and return the measurements per
+    page. The first request of each page is not counted, so caches are
+    filled as in a running server. time_ms is measured with the cached
+    fragments of the week and summary tables, uncached_time_ms after
+    changes of the data. Queries and memory are those of a cached
+    request.
+    """
+    factory = RequestFactory()
+    # Any authenticated user, the summary requires a login.
+    user = User(username='benchmark', is_staff=True)
+    Settings.clear_cache()
+
+    def get_request():
+        request = factory.get(url, params)
+        request.user = user
+        return request
+
+    results = {}
+    for name, (url, params) in (cases or get_cases()).items():
+        match = resolve(url)
+        match.func(get_request(), *match.args, **match.kwargs)  # Warm up
+        results[name] = _measure(match.func, get_request, match.args, match.kwargs, repeat)
+    return results
+
+
+def get_polling_cases():
+    """The polled views: {name: (url, GET parameters, sync view, async view)}."""
+    today = timezone.now().date()
+    employee = Employee.objects.filter(isactive=True).values_list('pk', flat=True).first()
+    template_name = 'workwhere/today_list.html'
+    return {
+        'update_today': (reverse('workwhere:ajax_update_today'), {},
+                         views.Today.as_view(template_name=template_name),
+                         async_views.Today.as_view(template_name=template_name)),
+        'load_workplaces': (reverse('workwhere:ajax_load_workplaces'), {'day': str(today), 'employee': employee},
+                            views.load_workplaces, async_views.load_workplaces),
+    }
+
+
+def run_polling(clients=50, rounds=3, cases=None):
+    """
+    Poll each view (see get_polling_cases()) rounds times by clients
+    clients and return the requests per second: the sync view serving
+    them one after another like a sync worker, the async view serving
+    each round concurrently on one event loop.
+    """
+    factory = RequestFactory()
+    async_factory = AsyncRequestFactory()
+    user = User(username='benchmark', is_staff=True)
+    requests = clients * rounds
+
+    results = {}
+    for name, (url, params, sync_view, async_view) in (cases or get_polling_cases()).items():
+        def get_request(factory):
+            request = factory.get(url, params)
+            request.user = user
+            return request
+
+        async def poll():
+            for _ in range(rounds):
+                await asyncio.gather(*(async_view(get_request(async_factory)) for _ in range(clients)))
+
+        sync_view(get_request(factory))  # Warm up
+        start = time.perf_counter()
+        for _ in range(requests):
+            sync_view(get_request(factory))
+        sync_time = time.perf_counter() - start
+
+        # The ORM queries of the tasks run in the thread of the caller,
+        # so they see the same transaction.
+        async_to_sync(async_view)(get_request(async_factory))  # Warm up
+        start = time.perf_counter()
+        async_to_sync(poll)()
+        async_time = time.perf_counter() - start
+
+        results[name] = {
+            'requests': requests,
+            'sync_per_second': round(requests/sync_time, 1),
+            'async_per_second': round(requests/async_time, 1),
+        }
+    return results
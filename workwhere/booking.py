@@ -0,0 +1,190 @@
+"""
+Write paths for reservations made through the reservation forms.
+
+The uniqueness rules are enforced by the database constraints
+unique_employee_per_day and unique_office_workplace_per_day, so a
+booking needs no checks before writing and concurrent bookings can't
+reserve the same office workplace twice.
+"""
+import datetime
+import itertools
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Q
+
+from .models import Reservation, Workplace, validate_reservation_day
+from .signals import reservations_changed
+
+
+def book(employee, day, workplace):
+    """
+    Reserve the workplace for the employee on the given day. An existing
+    reservation of the employee on that day is changed.
+
+    Raises a ValidationError with the messages of
+    Reservation.validate_unique_office_place if the workplace or the
+    employee is already taken.
+    """
+    reservation = Reservation(day=day, employee=employee, workplace=workplace)
+    try:
+        with transaction.atomic():
+            isoffice = reservation.get_workplace_isoffice()
+            updated = Reservation.objects \
+                .filter(day=day, employee=employee) \
+                .update(workplace=workplace, isoffice=isoffice)
+            if updated:
+                reservations_changed.send(sender=Reservation, days={day}, employees={employee.pk})
+            else:
+                reservation.save(validate=False)
+    except IntegrityError:
+        # Find out which rule was violated to report it like before.
+        reservation.pk = None
+        reservation.validate_unique_office_place()
+        raise ValidationError('Reservation failed due to a concurrent change, please try again.')
+
+    return reservation
+
+
+def get_days(start, end, weekdays=None):
+    """
+    Returns the days from start to end (both included), optionally only
+    those with the given ISO weekdays (1 = Monday).
+    """
+    days = (start + datetime.timedelta(days=i) for i in range((end - start).days + 1))
+    return [day for day in days if not weekdays or day.isoweekday() in weekdays]
+
+
+def book_many(employee, workplace, days):
+    """
+    Reserve the workplace for the employee on all given days at once.
+
+    Days which are not valid for reservations or on which the employee
+    or the office workplace already has a reservation are skipped.
+    Returns a tuple (reserved days, {skipped day: message}).
+    """
+    conflicts = {}
+    candidates = []
+    for day in sorted(set(days)):
+        try:
+            validate_reservation_day(day)
+        except ValidationError as e:
+            conflicts[day] = e.messages[0]
+        else:
+            candidates.append(day)
+
+    reservation = Reservation(employee=employee, workplace=workplace)
+    isoffice = reservation.get_workplace_isoffice()
+
+    taken = Q(employee=employee)
+    if isoffice:
+        taken |= Q(workplace=workplace, isoffice=True)
+    for day, other_employee, other_workplace in Reservation.objects \
+            .filter(taken, day__in=candidates) \
+            .values_list('day', 'employee_id', 'workplace_id'):
+        if other_employee != employee.pk:
+            conflicts[day] = 'Only one reservation per day and office workplace.'
+        elif other_workplace != workplace.pk:
+            conflicts[day] = 'Only one reservation per day and user.'
+    candidates = [day for day in candidates if day not in conflicts]
+
+    with transaction.atomic():
+        # Reservations created concurrently are ignored here and 
+        # reported as conflicts below.
+        Reservation.objects.bulk_create(
+            [Reservation(day=day, employee=employee, workplace=workplace, isoffice=isoffice) 
+             for day in candidates],
+            ignore_conflicts=True)
+        reserved = set(Reservation.objects
+            .filter(day__in=candidates, employee=employee, workplace=workplace)
+            .values_list('day', flat=True))
+        if reserved:
+            reservations_changed.send(sender=Reservation, days=reserved, employees={employee.pk})
+
+    for day in candidates:
+        if day not in reserved:
+            conflicts[day] = 'Reservation failed due to a concurrent change, please try again.'
+
+    return sorted(reserved), dict(sorted(conflicts.items()))
+
+
+def delete_reservations(rows):
+    """
+    Delete the reservations given as (pk, day, employee id) tuples with
+    one DELETE ... WHERE id IN (...) per batch, and announce them with one
+    reservations_changed signal. QuerySet.delete() would load every
+    reservation and send a post_delete signal for each of them. Nothing
+    refers to reservations, so there is nothing to delete in cascade.
+    Meant to be called in a transaction.
+    """
+    if not rows:
+        return
+    connection = connections[router.db_for_write(Reservation)]
+    quote_name = connection.ops.quote_name
+    sql = f"DELETE FROM {quote_name(Reservation._meta.db_table)} WHERE {quote_name(Reservation._meta.pk.column)} IN "
+    pks = [pk for pk, _, _ in rows]
+    # Databases limit the number of query parameters, e.g. SQLite.
+    batch_size = max(connection.ops.bulk_batch_size(['pk'], pks), 1)
+    with connection.cursor() as cursor:
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start + batch_size]
+            cursor.execute(sql + f"({', '.join(['%s'] * len(batch))})", batch)
+    reservations_changed.send(sender=Reservation,
+                              days={day for _, day, _ in rows},
+                              employees={employee_id for _, _, employee_id in rows})
+
+
+def cancel_reservations(reservations):
+    """
+    Delete the reservations of the queryset with one query instead of
+    one per reservation. Returns the number of deleted reservations.
+    """
+    with transaction.atomic():
+        rows = list(reservations.values_list('pk', 'day', 'employee_id'))
+        delete_reservations(rows)
+    return len(rows)
+
+
+def move_reservations(reservations, floor):
+    """
+    Move the office reservations of the queryset to the free workplaces
+    of the given office floor, keeping the order of the workplace names,
+    so neighbours stay neighbours. Reservations already on the floor and
+    of non-office workplaces are not changed, nor are days without enough
+    free workplaces.
+
+    The changed reservations are written with one UPDATE per 1000.
+    Returns a tuple (number of moved reservations, {skipped day: message}).
+    Raises a ValidationError if a workplace was reserved concurrently.
+    """
+    moving = reservations \
+        .filter(isoffice=True) \
+        .exclude(workplace__floor=floor) \
+        .order_by('day', 'workplace__name')
+    desks = list(Workplace.objects.filter(floor=floor, floor__location__isoffice=True).order_by('name'))
+    taken = set(Reservation.objects
+        .filter(day__in=moving.values('day'), workplace__in=desks)
+        .values_list('day', 'workplace_id'))
+
+    conflicts = {}
+    moved = []
+    for day, on_day in itertools.groupby(moving, key=lambda reservation: reservation.day):
+        on_day = list(on_day)
+        free = [desk for desk in desks if (day, desk.pk) not in taken]
+        if len(free) < len(on_day):
+            conflicts[day] = f'Not enough free desks on {floor}: {len(free)} for {len(on_day)} reservations.'
+            continue
+        for reservation, desk in zip(on_day, free):
+            reservation.workplace = desk
+        moved.extend(on_day)
+
+    try:
+        with transaction.atomic():
+            Reservation.objects.bulk_update(moved, ['workplace'], batch_size=1000)
+            if moved:
+                reservations_changed.send(sender=Reservation,
+                                          days={reservation.day for reservation in moved},
+                                          employees={reservation.employee_id for reservation in moved})
+    except IntegrityError:
+        raise ValidationError('Reservation failed due to a concurrent change, please try again.')
+    return len(moved), conflicts
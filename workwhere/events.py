@@ -0,0 +1,213 @@
+"""
+Broadcasting of reservation changes to open pages, e.g. via the Server-
+Sent Events stream of the today page.
+
+The backend is chosen with the setting WORKWHERE_EVENTS_BACKEND (dotted
+path, default LocalBroadcaster). LocalBroadcaster only reaches clients
+connected to the same process. With several worker processes use
+DataVersionBroadcaster, which additionally watches the DataVersion
+counters with one query per process and interval, independent of the
+number of connected clients.
+
+stream_events() waits for the events in a thread, astream_events() in
+the event loop of an ASGI server. As each open stream keeps a worker
+(WSGI) or a thread busy, the streams are only offered with the setting
+WORKWHERE_EVENTS = True, otherwise the today page polls.
+"""
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import DataVersion
+from .signals import reservations_changed
+
+
+logger = logging.getLogger(__name__)
+
+class LocalBroadcaster:
+    """Delivers events to the subscribers in the current process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def publish(self, event):
+        """Send the event (dict with a list of 'days') to all subscribers."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def subscribe(self, subscriber=None):
+        """
+        Returns a queue receiving the events until unsubscribed, or adds
+        the given subscriber, an object with a put(event) method.
+        """
+        if subscriber is None:
+            subscriber = queue.SimpleQueue()
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def has_subscribers(self):
+        with self._lock:
+            return bool(self._subscribers)
+
+
+class DataVersionBroadcaster(LocalBroadcaster):
+    """
+    Also publishes changes of the current day made by other processes.
+    A watcher thread polls the DataVersion of today while there are
+    subscribers. Changes published by this process are remembered, so
+    the watcher doesn't publish them a second time.
+    """
+    interval = 2 # seconds
+
+    def __init__(self):
+        super().__init__()
+        self._watcher = None
+        self._published = None
+
+    def publish(self, event):
+        day = timezone.now().date()
+        if str(day) in event['days'] and self.has_subscribers():
+            key = DataVersion.day_key(day)
+            published = (day, DataVersion.get_many(key).get(key))
+            with self._lock:
+                self._published = published
+        super().publish(event)
+
+    def subscribe(self, subscriber=None):
+        subscriber = super().subscribe(subscriber)
+        with self._lock:
+            # Also restarts a watcher which stopped after an error.
+            if self._watcher is None or not self._watcher.is_alive():
+                self._watcher = threading.Thread(target=self._watch, daemon=True)
+                self._watcher.start()
+        return subscriber
+
+    def _watch(self):
+        last = None
+        try:
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        self._watcher = None
+                        return
+                    published = self._published
+                day = timezone.now().date()
+                key = DataVersion.day_key(day)
+                current = (day, DataVersion.get_many(key).get(key))
+                if last is not None and current != last and current != published:
+                    super().publish({'days': [str(day)]})
+                last = current
+                time.sleep(self.interval)
+        except Exception:
+            # Restarted by the next subscribe()
+            logger.exception("Watching the data versions failed.")
+        finally:
+            connection.close()
+
+
+def events_enabled():
+    return getattr(settings, 'WORKWHERE_EVENTS', False)
+
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster():
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            backend = getattr(settings, 'WORKWHERE_EVENTS_BACKEND', 'workwhere.events.LocalBroadcaster')
+            _broadcaster = import_string(backend)()
+        return _broadcaster
+
+
+class AsyncSubscriber:
+    """
+    Subscriber for async code, passing the events to an asyncio queue in
+    the event loop it was created in, as they are published from other
+    threads.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def put(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            pass  # The loop is closed, unsubscribe() follows.
+
+
+def _format(event):
+    return f"event: reservations\ndata: {json.dumps(event)}\n\n"
+
+
+def stream_events(day, timeout=300, keepalive=15):
+    """
+    Generator of the Server-Sent Events for reservation changes on the
+    given day. It ends after timeout seconds, browsers then reconnect.
+    """
+    broadcaster = get_broadcaster()
+    subscriber = broadcaster.subscribe()
+    try:
+        yield "retry: 10000\n\n"
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                event = subscriber.get(timeout=min(keepalive, max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if str(day) in event['days']:
+                yield _format(event)
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+async def astream_events(day, timeout=300, keepalive=15):
+    """
+    Async version of stream_events(). Under ASGI, sync generators are
+    collected completely before sending, so the events would only
+    arrive after the timeout.
+    """
+    broadcaster = get_broadcaster()
+    subscriber = broadcaster.subscribe(AsyncSubscriber())
+    try:
+        yield "retry: 10000\n\n"
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(),
+                                               min(keepalive, max(deadline - time.monotonic(), 0)))
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if str(day) in event['days']:
+                yield _format(event)
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+@receiver(reservations_changed)
+def publish_reservations_changed(sender, days, **kwargs):
+    event = {'days': sorted(str(day) for day in days)}
+    transaction.on_commit(lambda: get_broadcaster().publish(event))
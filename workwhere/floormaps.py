@@ -0,0 +1,102 @@
+"""
+Smaller variants of the uploaded floor maps.
+
+Floor maps are often large scans, so the pages show a thumbnail and a
+WebP version instead of the original. The variants are created when a
+floor map is saved, or with the management command
+workwhere_floormap_variants for existing floors. Their file names
+contain a hash of the original, so they can be cached by browsers
+without expiry.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+import re
+
+from django.core.files.base import ContentFile
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Floor
+
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'floormaps/variants'
+
+# name: (maximum width and height in pixels, format)
+VARIANTS = {
+    'thumb': (480, None),  # Format of the original, JPEG or PNG
+    'thumb_webp': (480, 'WEBP'),
+    'webp': (2400, 'WEBP'),
+}
+
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+# File names of the variants, the storage may append a suffix to the hash
+# and variant name.
+NAME_PATTERN = re.compile(r'[0-9a-f]+-\w+\.(%s)' % '|'.join(EXTENSIONS.values()))
+
+
+def _encode(image, size, image_format):
+    variant = image.copy()
+    variant.thumbnail((size, size))
+    if image_format == 'JPEG' and variant.mode != 'RGB':
+        variant = variant.convert('RGB')
+    output = io.BytesIO()
+    variant.save(output, image_format, quality=80)
+    return output.getvalue()
+
+
+def create_variants(floor, force=False):
+    """
+    Create the variants of the floor map, if not yet done or if forced,
+    and store their file names in floor.floormap_variants. Returns
+    whether they were updated.
+    """
+    if not floor.floormap:
+        return False
+    if floor.floormap_variants.get('source') == floor.floormap.name and not force:
+        return False
+    storage = floor.floormap.storage
+
+    variants = {'source': floor.floormap.name}
+    try:
+        with floor.floormap.open('rb') as file:
+            content = file.read()
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(content)))
+        image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        # Not retried until a new floor map is uploaded, the pages link
+        # the original instead.
+        logger.warning("Can't create variants of floor map %s: %s", floor.floormap.name, e)
+    else:
+        digest = hashlib.sha256(content).hexdigest()[:16]
+        fallback_format = 'PNG' if image.mode in ('RGBA', 'LA', 'P') else 'JPEG'
+        for variant, (size, image_format) in VARIANTS.items():
+            image_format = image_format or fallback_format
+            path = posixpath.join(VARIANTS_DIR, f"{digest}-{variant}.{EXTENSIONS[image_format]}")
+            if not storage.exists(path):
+                path = storage.save(path, ContentFile(_encode(image, size, image_format)))
+            variants[variant] = posixpath.basename(path)
+
+    floor.floormap_variants = variants
+    Floor.objects.filter(pk=floor.pk).update(floormap_variants=variants)
+    return True
+
+
+def open_variant(name):
+    """
+    Opens the variant file with the given name (without directory).
+    Raises a ValueError for names not created by create_variants().
+    """
+    if not NAME_PATTERN.fullmatch(name):
+        raise ValueError(f"Invalid floor map variant name {name!r}.")
+    return Floor._meta.get_field('floormap').storage.open(posixpath.join(VARIANTS_DIR, name), 'rb')
+
+
+@receiver(post_save, sender=Floor)
+def floor_saved(sender, instance, **kwargs):
+    create_variants(instance)
@@ -2,14 +2,31 @@ import datetime
 
 from django.core.exceptions import ValidationError
 from django import forms
-from workalendar.registry import registry
+from django.urls import reverse
 
-from .models import Reservation, Workplace, Employee, Settings
+from .models import Reservation, Workplace, Employee, Floor, validate_reservation_day
+from .availability import Availability
 
 
 class SearchSelect(forms.Select):
+    """
+    Text input with suggestions, which are loaded while typing from the
+    URL in the attribute data-search-url. Only the selected choice is
+    rendered, so large querysets are not loaded.
+    """
     template_name = 'workwhere/search_select.html'
 
+    def optgroups(self, name, value, attrs=None):
+        choices = self.choices
+        if hasattr(choices, 'queryset'):
+            selected = [v for v in value if v]
+            self.choices = [choices.choice(obj) for obj in choices.queryset.filter(pk__in=selected)] \
+                if selected else []
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = choices
+
 class ReservationForm(forms.ModelForm):
     class Meta:
         model = Reservation
@@ -21,6 +38,8 @@ class ReservationForm(forms.ModelForm):
         self.fields['employee'].widget = SearchSelect(attrs={
             'class': 'form-control', 
             'placeholder': 'Type to search...',
+            'autocomplete': 'off',
+            'data-search-url': reverse('workwhere:ajax_search_employees'),
             })
         self.fields['employee'].queryset = Employee.objects.filter(isactive=True)
 
@@ -38,33 +57,105 @@ class ReservationForm(forms.ModelForm):
 
         if 'day' in self.data and 'employee' in self.data:
             try:
-                day = self.data['day']
-                employee = self.data['employee']
-
-                other_desk_reservations_today = Reservation.objects \
-                    .filter(day=day, workplace__floor__location__isoffice=True) \
-                    .exclude(employee=employee)
-                available_workplaces = Workplace.objects \
-                    .exclude(reservation__in=other_desk_reservations_today)
-                self.fields['workplace'].queryset = available_workplaces \
-                    .order_by('floor__location__isoffice')
+                availability = Availability([self.data['day']])
             except (ValueError, TypeError):
                 pass  # invalid input from the client; ignore and fallback to empty workplace queryset
+            else:
+                self.fields['workplace'].queryset = availability \
+                    .free_workplaces(self.data['employee']) \
+                    .select_related('floor__location')
 
         #elif self.instance.pk:
         #    self.fields['workplace'].queryset = Workplace.objects.all()
 
     def clean_day(self):
         data = self.cleaned_data['day']
-
-        if data < datetime.date.today():
-            raise ValidationError('Invalid date - date in past')
-
-        if data > datetime.date.today() + datetime.timedelta(weeks=4):
-            raise ValidationError('Invalid date - date more than 4 weeks into the future')
-
-        holidays_calendar = registry.get(Settings.load().iso_region)
-        if not holidays_calendar().is_working_day(data):
-            raise ValidationError('Invalid date - not a working day')
-
+        validate_reservation_day(data)
         return data 
+
+    def _get_validation_exclusions(self):
+        # The choice fields already checked employee and workplace, and
+        # book() handles violations of the unique constraints, so the
+        # model validation doesn't query them again.
+        exclude = super()._get_validation_exclusions()
+        exclude.update({'employee', 'workplace'})
+        return exclude
+
+
+class DayRangeForm(forms.Form):
+    """Days given by a date range of at most 5 weeks and the weekdays."""
+    WEEKDAYS = [(1, 'Monday'), (2, 'Tuesday'), (3, 'Wednesday'), (4, 'Thursday'), (5, 'Friday')]
+
+    start = forms.DateField()
+    end = forms.DateField()
+    weekdays = forms.TypedMultipleChoiceField(choices=WEEKDAYS, coerce=int, required=False,
+                                              help_text="Leave empty for all days.")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get('start')
+        end = cleaned_data.get('end')
+        if start and end and start > end:
+            raise ValidationError('Invalid date range - start after end')
+        if start and end and end - start > datetime.timedelta(weeks=5):
+            raise ValidationError('Invalid date range - more than 5 weeks')
+        return cleaned_data
+
+
+class BulkReservationForm(DayRangeForm):
+    """Reservation of one workplace on several days."""
+    field_order = ['employee', 'workplace']
+
+    employee = forms.ModelChoiceField(queryset=Employee.objects.filter(isactive=True))
+    workplace = forms.ModelChoiceField(queryset=Workplace.objects.select_related('floor__location'))
+
+
+class TeamReservationForm(DayRangeForm):
+    """Reservation of office desks for several employees on several days."""
+    TOGETHER = [('', 'Anywhere'), ('floor', 'Same floor'), ('location', 'Same location')]
+    field_order = ['employees']
+
+    employees = forms.ModelMultipleChoiceField(queryset=Employee.objects.filter(isactive=True))
+    together = forms.ChoiceField(choices=TOGETHER, required=False)
+    floor = forms.ModelChoiceField(queryset=Floor.objects.filter(location__isoffice=True), required=False,
+                                   help_text="Only desks on this floor.")
+    preferred = forms.ModelMultipleChoiceField(
+        queryset=Workplace.objects.filter(floor__location__isoffice=True), required=False,
+        help_text="Desks assigned first.")
+    dry_run = forms.BooleanField(required=False, help_text="Only return the plan.")
+
+    def clean_preferred(self):
+        # The field returns the desks in the order of the database.
+        order = {str(pk): index for index, pk in enumerate(self['preferred'].data)}
+        return sorted(self.cleaned_data['preferred'], key=lambda desk: order[str(desk.pk)])
+
+
+class ReportForm(forms.Form):
+    KINDS = [('person', 'Per person'), ('location', 'Per location')]
+
+    start = forms.DateField()
+    end = forms.DateField()
+    kind = forms.ChoiceField(choices=KINDS)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('start') and cleaned_data.get('end') and cleaned_data['start'] > cleaned_data['end']:
+            raise ValidationError('Invalid date range - start after end')
+        return cleaned_data
+
+
+class FloorMoveForm(forms.Form):
+    """All reservations of a floor in a date range, to be moved to another floor."""
+    source = forms.ModelChoiceField(queryset=Floor.objects.select_related('location'), label="From floor")
+    target = forms.ModelChoiceField(queryset=Floor.objects.filter(location__isoffice=True).select_related('location'),
+                                    label="To floor")
+    start = forms.DateField(help_text="YYYY-MM-DD")
+    end = forms.DateField(help_text="YYYY-MM-DD")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('start') and cleaned_data.get('end') and cleaned_data['start'] > cleaned_data['end']:
+            raise ValidationError('Invalid date range - start after end')
+        if cleaned_data.get('source') and cleaned_data.get('source') == cleaned_data.get('target'):
+            raise ValidationError('The floors must be different.')
+        return cleaned_data
@@ -0,0 +1,75 @@
+"""
+iCalendar (RFC 5545) feeds of the reservations of one employee, for the
+subscription in calendar clients like Outlook or Google Calendar.
+
+Each reservation is an all-day event, identified by the employee and the
+day, so a changed workplace updates the event in the client instead of
+adding another. Archived reservations are not included.
+"""
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Reservation
+
+
+def get_start():
+    """First day of the feeds, WORKWHERE_CALENDAR_PAST_DAYS (default 30) before today."""
+    return timezone.now().date() - datetime.timedelta(days=getattr(settings, 'WORKWHERE_CALENDAR_PAST_DAYS', 30))
+
+
+def _escape(text):
+    return str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+    """Splits lines longer than 75 octets into continuation lines."""
+    parts = []
+    limit = 75
+    while len(line.encode()) > limit:
+        cut = limit
+        while len(line[:cut].encode()) > limit:
+            cut -= 1
+        parts.append(line[:cut])
+        line = line[cut:]
+        limit = 74  # Continuation lines start with a space
+    parts.append(line)
+    return '\r\n '.join(parts)
+
+
+def build_calendar(employee, start, changed):
+    """
+    The reservations of the employee from the start day on as iCalendar
+    text. changed (the time of the last change) is used as time stamp of
+    the events, so the text only depends on the reservations.
+    """
+    reservations = Reservation.objects \
+        .filter(employee=employee, day__gte=start) \
+        .select_related('workplace__floor__location') \
+        .order_by('day')
+
+    stamp = changed.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//WorkWhere//Reservations//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_escape(f"WorkWhere: {employee.first_name} {employee.last_name}")}',
+    ]
+    for reservation in reservations:
+        floor = reservation.workplace.floor
+        lines.extend([
+            'BEGIN:VEVENT',
+            f'UID:{_escape(employee.pk)}-{reservation.day:%Y%m%d}@workwhere',
+            f'DTSTAMP:{stamp}',
+            f'DTSTART;VALUE=DATE:{reservation.day:%Y%m%d}',
+            f'DTEND;VALUE=DATE:{reservation.day + datetime.timedelta(days=1):%Y%m%d}',
+            f'SUMMARY:{_escape(reservation.workplace.name)}',
+            f'LOCATION:{_escape(floor)}',
+            'TRANSP:TRANSPARENT',
+            'END:VEVENT',
+        ])
+    lines.append('END:VCALENDAR')
+    return ''.join(_fold(line) + '\r\n' for line in lines)
@@ -0,0 +1,185 @@
+"""
+Optional timing of the workwhere views.
+
+Add 'workwhere.instrumentation.InstrumentationMiddleware' to MIDDLEWARE
+to get a Server-Timing header on the responses of the workwhere views
+with the number and time of the database queries, the time spent in
+holiday calendar lookups and in template rendering, and the total
+time. With the setting WORKWHERE_METRICS = True the measurements are
+also collected per view and served for Prometheus at the URL of the
+`metrics` view. The metrics are kept per process.
+
+Without the middleware, the only cost is one context variable lookup
+per function decorated with timed().
+"""
+import contextvars
+import functools
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse
+
+
+_recorder = contextvars.ContextVar('workwhere_recorder', default=None)
+
+
+class Recorder:
+    """Measurements of one request."""
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.queries = 0
+        self._active = set()
+
+    def measure(self, name, func, *args, **kwargs):
+        # Nested calls, e.g. a calendar lookup building the calendar,
+        # are only counted once.
+        if name in self._active:
+            return func(*args, **kwargs)
+        self._active.add(name)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.durations[name] += time.perf_counter() - start
+            self._active.discard(name)
+
+    def execute(self, execute, sql, params, many, context):
+        """Database execute wrapper."""
+        self.queries += 1
+        return self.measure('db', execute, sql, params, many, context)
+
+    def server_timing(self, total):
+        entries = [f'db;dur={1000*self.durations["db"]:.1f};desc="{self.queries} queries"']
+        entries.extend(f'{name};dur={1000*duration:.1f}' for name, duration in self.durations.items()
+                       if name != 'db')
+        entries.append(f'total;dur={1000*total:.1f}')
+        return ', '.join(entries)
+
+
+def timed(name):
+    """
+    Decorator adding the time spent in the function to the given
+    measurement of the current request, e.g. 'calendar' or 'render'.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder.get()
+            if recorder is None:
+                return func(*args, **kwargs)
+            return recorder.measure(name, func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Histogram:
+    # Upper bounds in seconds
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class Metrics:
+    """Counters and histograms per view."""
+
+    histograms = {
+        'total': ('workwhere_request_duration_seconds', "Time of the requests."),
+        'db': ('workwhere_db_duration_seconds', "Time of the database queries per request."),
+        'calendar': ('workwhere_calendar_duration_seconds', "Time of the holiday calendar lookups per request."),
+        'render': ('workwhere_render_duration_seconds', "Time of the template rendering per request."),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = defaultdict(int)
+        self.queries = defaultdict(int)
+        self.durations = {key: defaultdict(Histogram) for key in self.histograms}
+
+    def observe(self, view, recorder, total):
+        with self._lock:
+            self.requests[view] += 1
+            self.queries[view] += recorder.queries
+            for key in self.histograms:
+                self.durations[key][view].observe(total if key == 'total' else recorder.durations[key])
+
+    def render(self):
+        with self._lock:
+            lines = [
+                "# HELP workwhere_requests_total Number of requests.",
+                "# TYPE workwhere_requests_total counter",
+                *(f'workwhere_requests_total{{view="{view}"}} {count}' for view, count in self.requests.items()),
+                "# HELP workwhere_db_queries_total Number of database queries.",
+                "# TYPE workwhere_db_queries_total counter",
+                *(f'workwhere_db_queries_total{{view="{view}"}} {count}' for view, count in self.queries.items()),
+            ]
+            for key, (name, description) in self.histograms.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} histogram")
+                for view, histogram in self.durations[key].items():
+                    lines.extend(histogram.lines(name, f'view="{view}"'))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def metrics_enabled():
+    return getattr(settings, 'WORKWHERE_METRICS', False)
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = Recorder()
+        token = _recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(recorder.execute):
+                response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        total = time.perf_counter() - start
+
+        match = request.resolver_match
+        if match is None or match.app_name != 'workwhere' or match.url_name == 'metrics':
+            return response
+        response['Server-Timing'] = recorder.server_timing(total)
+        if metrics_enabled():
+            metrics.observe(match.url_name, recorder, total)
+        return response
+
+
+def metrics_view(request):
+    """The collected metrics in the Prometheus text format, if enabled."""
+    if not metrics_enabled():
+        raise Http404("Metrics are not enabled.")
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
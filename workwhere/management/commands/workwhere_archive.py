@@ -0,0 +1,41 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from workwhere.archive import BATCH_SIZE, archive_reservations, get_horizon
+
+
+class Command(BaseCommand):
+    help = "Move reservations older than the retention horizon to the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=datetime.date.fromisoformat,
+                            help="Archive the reservations before this day (YYYY-MM-DD).")
+        parser.add_argument('--days', type=int,
+                            help="Archive the reservations older than this number of days, "
+                                 "default: setting WORKWHERE_ARCHIVE_AFTER_DAYS.")
+        parser.add_argument('--export', metavar='FILE',
+                            help="Also write the archived reservations to a gzip compressed JSON-lines file.")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['before'] and options['days'] is not None:
+            raise CommandError("Give either --before or --days.")
+        if options['before']:
+            before = options['before']
+        elif options['days'] is not None:
+            before = timezone.now().date() - datetime.timedelta(days=options['days'])
+        else:
+            before = get_horizon()
+            if before is None:
+                raise CommandError("Give --before or --days, or set WORKWHERE_ARCHIVE_AFTER_DAYS.")
+        if before > timezone.now().date():
+            raise CommandError("Only past reservations can be archived.")
+
+        if options['export']:
+            with open(options['export'], 'xb') as export:
+                count = archive_reservations(before, options['batch_size'], export)
+        else:
+            count = archive_reservations(before, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {count} reservations before {before}."))
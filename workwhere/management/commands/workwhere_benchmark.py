@@ -0,0 +1,59 @@
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+import workwhere
+from workwhere import benchmark
+from workwhere.models import Settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure queries, time and memory of the main pages with generated data and print the "
+        "results as JSON. The data is created in a transaction which is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--locations', type=int, default=2)
+        parser.add_argument('--floors', type=int, default=5, help="Floors per location.")
+        parser.add_argument('--desks', type=int, default=40, help="Desks per floor.")
+        parser.add_argument('--employees', type=int, default=500)
+        parser.add_argument('--months', type=int, default=3, help="Months of reservations.")
+        parser.add_argument('--repeat', type=int, default=5, help="Requests per page for the time measurement.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--polling', type=int, default=0, metavar='CLIENTS',
+                            help="Also compare the throughput of this many concurrent pollers "
+                                 "with the sync and the async views.")
+        parser.add_argument('--output', metavar='FILE', help="Write the JSON to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            data = benchmark.generate(
+                locations=options['locations'], floors=options['floors'], desks=options['desks'],
+                employees=options['employees'], months=options['months'], seed=options['seed'])
+            results = benchmark.run(repeat=options['repeat'])
+            polling = benchmark.run_polling(clients=options['polling']) if options['polling'] else None
+            transaction.set_rollback(True)
+        Settings.clear_cache()
+
+        report = {
+            'versions': {
+                'workwhere': workwhere.__version__,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+            },
+            'data': data,
+            'results': results,
+        }
+        if polling:
+            report['polling'] = polling
+        report = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(report + '\n')
+        else:
+            self.stdout.write(report)
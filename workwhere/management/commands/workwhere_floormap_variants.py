@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from workwhere.floormaps import create_variants
+from workwhere.models import Floor
+
+
+class Command(BaseCommand):
+    help = "Create the thumbnail and WebP variants of the floor maps."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Also recreate existing variants, e.g. after changing their sizes.")
+
+    def handle(self, *args, **options):
+        count = 0
+        for floor in Floor.objects.exclude(floormap=''):
+            if create_variants(floor, force=options['force']):
+                count += 1
+                if not floor.get_floormap_variant_urls():
+                    self.stderr.write(f"Can't read the floor map of {floor}.")
+        self.stdout.write(self.style.SUCCESS(f"Updated the variants of {count} floor maps."))
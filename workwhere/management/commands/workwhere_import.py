@@ -0,0 +1,209 @@
+import csv
+import json
+import pathlib
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from workwhere.models import Employee, Location, Floor, Workplace, DataVersion, validate_single_reservations
+from workwhere.rollups import employee_days, reservation_days, update_days, update_layout_days
+from workwhere.signals import sync_reservation_isoffice
+
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'x'}
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+def _read(path, file_format):
+    """Returns the rows of a CSV file (with header) or a JSON list of objects."""
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as file:
+            if file_format == 'json':
+                rows = json.load(file)
+            else:
+                rows = list(csv.DictReader(file))
+    except (OSError, ValueError) as e:
+        raise CommandError(f"Can't read {path}: {e}")
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise CommandError("JSON files must contain a list of objects.")
+    return rows
+
+
+def _column(row, line, name, default=None):
+    value = row.get(name, default)
+    if value is None or str(value).strip() == '':
+        raise CommandError(f"Row {line}: '{name}' is missing.")
+    return str(value).strip() if not isinstance(value, bool) else value
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update employees, locations, floors or workplaces from a CSV or JSON file. "
+        "Columns: employees: id, first_name, last_name[, isstudent, isactive]; "
+        "locations: name, isoffice; floors: location, name; workplaces: location, floor, name."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['employees', 'locations', 'floors', 'workplaces'])
+        parser.add_argument('path', help="CSV file with header row or JSON file with a list of objects.")
+        parser.add_argument('--format', choices=['csv', 'json'],
+                            help="File format, default: from the file extension.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only show the changes, don't write them.")
+        parser.add_argument('--deactivate-missing', action='store_true',
+                            help="Set employees not contained in the file inactive.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('json' if pathlib.Path(options['path']).suffix.lower() == '.json' else 'csv')
+        rows = _read(options['path'], file_format)
+        if options['deactivate_missing'] and options['kind'] != 'employees':
+            raise CommandError("--deactivate-missing is only possible for employees.")
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+
+        with transaction.atomic():
+            created, updated, deactivated = getattr(self, f"import_{options['kind']}")(rows, options)
+
+        for key, changes in updated.items():
+            self.stdout.write(f"~ {key}: " + ", ".join(f"{field} {old} -> {new}" for field, (old, new) in changes.items()))
+        if options['verbosity'] > 1 or self.dry_run:
+            for key in created:
+                self.stdout.write(f"+ {key}")
+            for key in deactivated:
+                self.stdout.write(f"- {key} (deactivated)")
+
+        summary = f"{options['kind'].capitalize()}: {len(created)} created, {len(updated)} updated"
+        if options['deactivate_missing']:
+            summary += f", {len(deactivated)} deactivated"
+        if self.dry_run:
+            self.stdout.write(summary + " (dry run, nothing written)")
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+
+    def _diff(self, existing, new, fields):
+        """Returns {field: (old, new)} for the changed fields."""
+        return {field: (getattr(existing, field), getattr(new, field)) for field in fields
+                if getattr(existing, field) != getattr(new, field)}
+
+    def _upsert(self, model, objects, unique_fields, update_fields):
+        if not self.dry_run and objects:
+            model.objects.bulk_create(objects, batch_size=self.batch_size, update_conflicts=True,
+                                      unique_fields=unique_fields, update_fields=update_fields)
+
+    def _validate_office(self, **filters):
+        """
+        Like the clean() methods of the layout models, checks that the
+        workplaces matching the filters can become office workplaces.
+        """
+        try:
+            validate_single_reservations(**filters)
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+
+    def _layout_changed(self):
+        if not self.dry_run:
+            sync_reservation_isoffice()
+            DataVersion.bump(DataVersion.LAYOUT)
+
+    def import_employees(self, rows, options):
+        fields = ['first_name', 'last_name', 'isstudent', 'isactive']
+        existing = Employee.objects.in_bulk()
+        employees = {}
+        for line, row in enumerate(rows, start=2):
+            employee = Employee(
+                id=_column(row, line, 'id'),
+                first_name=_column(row, line, 'first_name'),
+                last_name=_column(row, line, 'last_name'),
+                isstudent=_bool(row.get('isstudent', False)),
+                isactive=_bool(row.get('isactive', True)),
+            )
+            employees[employee.id] = employee
+
+        created = [key for key in employees if key not in existing]
+        updated = {key: self._diff(existing[key], employee, fields) for key, employee in employees.items()
+                   if key in existing and self._diff(existing[key], employee, fields)}
+        deactivated = []
+        if options['deactivate_missing']:
+            deactivated = [key for key, employee in existing.items() if key not in employees and employee.isactive]
+
+        self._upsert(Employee, [employees[key] for key in [*created, *updated]], ['id'], fields)
+        if not self.dry_run:
+            Employee.objects.filter(pk__in=deactivated).update(isactive=False)
+            DataVersion.bump(DataVersion.EMPLOYEES)
+            # The student flag is part of the occupancy rollups.
+            students_changed = [key for key, changes in updated.items() if 'isstudent' in changes]
+            if students_changed:
+                update_days(employee_days(students_changed))
+
+        return created, updated, deactivated
+
+    def import_locations(self, rows, options):
+        existing = {location.name: location for location in Location.objects.all()}
+        locations = {}
+        for line, row in enumerate(rows, start=2):
+            location = Location(name=_column(row, line, 'name'), isoffice=_bool(_column(row, line, 'isoffice')))
+            locations[location.name] = location
+
+        created = [key for key in locations if key not in existing]
+        updated = {key: self._diff(existing[key], location, ['isoffice']) for key, location in locations.items()
+                   if key in existing and self._diff(existing[key], location, ['isoffice'])}
+
+        to_office = [key for key in updated if locations[key].isoffice]
+        if to_office:
+            self._validate_office(workplace__floor__location__name__in=to_office)
+
+        self._upsert(Location, [locations[key] for key in [*created, *updated]], ['name'], ['isoffice'])
+        self._layout_changed()
+        return created, updated, []
+
+    def import_floors(self, rows, options):
+        # Floor names are only unique within a location, there is no
+        # constraint for an upsert. Existing floors are left unchanged.
+        locations = {location.name: location for location in Location.objects.all()}
+        existing = {(floor.location.name, floor.name) for floor in Floor.objects.select_related('location')}
+        floors = {}
+        for line, row in enumerate(rows, start=2):
+            location_name = _column(row, line, 'location')
+            if location_name not in locations:
+                raise CommandError(f"Row {line}: location '{location_name}' does not exist.")
+            floors[(location_name, _column(row, line, 'name'))] = Floor(
+                location=locations[location_name], name=_column(row, line, 'name'))
+
+        created = [key for key in floors if key not in existing]
+        if not self.dry_run:
+            Floor.objects.bulk_create([floors[key] for key in created], batch_size=self.batch_size)
+        self._layout_changed()
+        return [f"{location} - {name}" for location, name in created], {}, []
+
+    def import_workplaces(self, rows, options):
+        floors = {(floor.location.name, floor.name): floor for floor in Floor.objects.select_related('location')}
+        existing = Workplace.objects.select_related('floor__location').in_bulk(field_name='name')
+        workplaces = {}
+        for line, row in enumerate(rows, start=2):
+            floor_key = (_column(row, line, 'location'), _column(row, line, 'floor'))
+            if floor_key not in floors:
+                raise CommandError(f"Row {line}: floor '{floor_key[1]}' in location '{floor_key[0]}' does not exist.")
+            workplace = Workplace(name=_column(row, line, 'name'), floor=floors[floor_key])
+            workplaces[workplace.name] = workplace
+
+        created = [key for key in workplaces if key not in existing]
+        updated = {key: self._diff(existing[key], workplace, ['floor']) for key, workplace in workplaces.items()
+                   if key in existing and existing[key].floor_id != workplace.floor_id}
+
+        to_office = [key for key in updated if workplaces[key].floor.location.isoffice]
+        if to_office:
+            self._validate_office(workplace__name__in=to_office)
+
+        self._upsert(Workplace, [workplaces[key] for key in [*created, *updated]], ['name'], ['floor'])
+        self._layout_changed()
+        if updated and not self.dry_run:
+            # The occupancy rollups count the reservations per location.
+            update_layout_days(reservation_days(workplace__name__in=list(updated)))
+        return created, updated, []
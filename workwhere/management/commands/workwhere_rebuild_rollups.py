@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+
+from workwhere.models import Reservation
+from workwhere.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the occupancy rollups used by the monthly summary."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=datetime.date.fromisoformat,
+                            help="First day (YYYY-MM-DD), default: first reservation.")
+        parser.add_argument('--end', type=datetime.date.fromisoformat,
+                            help="Last day (YYYY-MM-DD), default: last reservation.")
+
+    def handle(self, *args, **options):
+        first_and_last = Reservation.objects.aggregate(first=Min('day'), last=Max('day'))
+        start = options['start'] or first_and_last['first']
+        end = options['end'] or first_and_last['last']
+        if start is None or end is None:
+            self.stdout.write("No reservations found.")
+            return
+        if start > end:
+            raise CommandError("--start must not be after --end.")
+
+        rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the rollups from {start} to {end}."))
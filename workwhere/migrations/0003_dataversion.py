@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:16
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workwhere', '0002_infotext_settings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('changed', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
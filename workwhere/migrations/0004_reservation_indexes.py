@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:18
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_reservations(apps, schema_editor):
+    """
+    Concurrent bookings could create more than one reservation per 
+    employee and day. Keep the latest one before adding the constraint.
+    """
+    Reservation = apps.get_model('workwhere', 'Reservation')
+    duplicates = Reservation.objects.values('day', 'employee') \
+        .annotate(latest=Max('id'), count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        Reservation.objects \
+            .filter(day=duplicate['day'], employee=duplicate['employee']) \
+            .exclude(id=duplicate['latest']) \
+            .delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workwhere', '0003_dataversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_reservations, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['day', 'workplace'], name='reservation_day_workplace_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(fields=('day', 'employee'), name='unique_employee_per_day'),
+        ),
+    ]
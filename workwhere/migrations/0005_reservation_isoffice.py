@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:19
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def set_isoffice(apps, schema_editor):
+    """
+    Copy isoffice from the locations and remove double bookings of 
+    office workplaces left by earlier races, keeping the latest one.
+    """
+    Reservation = apps.get_model('workwhere', 'Reservation')
+    Reservation.objects \
+        .filter(workplace__floor__location__isoffice=True) \
+        .update(isoffice=True)
+
+    duplicates = Reservation.objects.filter(isoffice=True).values('day', 'workplace') \
+        .annotate(latest=Max('id'), count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        Reservation.objects \
+            .filter(day=duplicate['day'], workplace=duplicate['workplace']) \
+            .exclude(id=duplicate['latest']) \
+            .delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workwhere', '0004_reservation_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='isoffice',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(set_isoffice, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(condition=models.Q(('isoffice', True)), fields=('day', 'workplace'), name='unique_office_workplace_per_day'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:25
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def build_rollups(apps, schema_editor):
+    Reservation = apps.get_model('workwhere', 'Reservation')
+    DailyOccupancy = apps.get_model('workwhere', 'DailyOccupancy')
+    MonthlyEmployeeStats = apps.get_model('workwhere', 'MonthlyEmployeeStats')
+
+    daily_counts = Reservation.objects \
+        .values('day', 'workplace__floor__location') \
+        .annotate(count_all=Count('id'), count_nonstudent=Count('id', filter=Q(employee__isstudent=False))) \
+        .order_by()
+    DailyOccupancy.objects.bulk_create(
+        (DailyOccupancy(day=count['day'], location_id=count['workplace__floor__location'],
+                        count_all=count['count_all'], count_nonstudent=count['count_nonstudent'])
+         for count in daily_counts.iterator()),
+        batch_size=1000)
+
+    monthly_counts = Reservation.objects \
+        .annotate(month=TruncMonth('day')) \
+        .values('month', 'employee', 'workplace__floor__location') \
+        .annotate(count=Count('id')) \
+        .order_by()
+    MonthlyEmployeeStats.objects.bulk_create(
+        (MonthlyEmployeeStats(month=count['month'], employee_id=count['employee'],
+                              location_id=count['workplace__floor__location'], count=count['count'])
+         for count in monthly_counts.iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workwhere', '0005_reservation_isoffice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyEmployeeStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month.')),
+                ('count', models.PositiveIntegerField()),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='workwhere.employee')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='workwhere.location')),
+            ],
+            options={
+                'verbose_name_plural': 'monthly employee stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count_all', models.PositiveIntegerField()),
+                ('count_nonstudent', models.PositiveIntegerField()),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='workwhere.location')),
+            ],
+            options={
+                'verbose_name_plural': 'daily occupancies',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyemployeestats',
+            constraint=models.UniqueConstraint(fields=('month', 'employee', 'location'), name='unique_stats_per_month_employee_and_location'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyoccupancy',
+            constraint=models.UniqueConstraint(fields=('day', 'location'), name='unique_occupancy_per_day_and_location'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
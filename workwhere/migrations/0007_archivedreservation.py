@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workwhere', '0006_occupancy_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True, verbose_name='date')),
+                ('isoffice', models.BooleanField(default=False)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='workwhere.employee')),
+                ('workplace', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='workwhere.workplace')),
+            ],
+        ),
+    ]
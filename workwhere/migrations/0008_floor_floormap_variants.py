@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workwhere', '0007_archivedreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='floor',
+            name='floormap_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:35
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workwhere', '0008_floor_floormap_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workplace',
+            name='x',
+            field=models.FloatField(blank=True, help_text='Position on the floor map in percent of its width, from the left.', null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)]),
+        ),
+        migrations.AddField(
+            model_name='workplace',
+            name='y',
+            field=models.FloatField(blank=True, help_text='Position on the floor map in percent of its height, from the top.', null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)]),
+        ),
+    ]
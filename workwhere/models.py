@@ -1,8 +1,17 @@
+import datetime
+import time
+
 from django.db import models
+from django.db.models import F
 from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator, MaxValueValidator
+from django.urls import reverse
+from django.utils import timezone
 
 from workalendar.registry import registry
 
+from . import workdays
+
 
 class Employee(models.Model):
     id = models.CharField(max_length=20, primary_key=True)
@@ -17,6 +26,13 @@ class Employee(models.Model):
         # larger projects, but here it should not be noticeable.
         ordering = ['last_name', 'first_name']    
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Changes of isstudent require updating the occupancy rollups.
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def __str__(self):
         return f"{self.last_name}, {self.first_name}"
 
@@ -33,6 +49,10 @@ class Location(models.Model):
     name = models.CharField(max_length=80, unique=True)
     isoffice = models.BooleanField()
 
+    def clean(self):
+        if self.isoffice and self.pk is not None:
+            validate_single_reservations(workplace__floor__location=self.pk)
+
     def __str__(self):
         return self.name
 
@@ -45,10 +65,33 @@ class Floor(models.Model):
     name = models.CharField(max_length=80)
     location = models.ForeignKey(Location, on_delete=models.CASCADE)
     floormap = models.ImageField(upload_to='floormaps', blank=True)
+    # File names of the smaller variants of the floor map, maintained by
+    # workwhere.floormaps.
+    floormap_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Moving the floor to another location requires updating the
+        # occupancy rollups.
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def clean(self):
+        if self.pk is not None and self.location_id is not None \
+                and Location.objects.filter(pk=self.location_id, isoffice=True).exists():
+            validate_single_reservations(workplace__floor=self.pk)
 
     def __str__(self):
         return f"{self.location} - {self.name}"
 
+    def get_floormap_variant_urls(self):
+        """URLs of the variants, if they belong to the current floor map."""
+        if not self.floormap or self.floormap_variants.get('source') != self.floormap.name:
+            return {}
+        return {variant: reverse('workwhere:floormap_variant', args=[name])
+                for variant, name in self.floormap_variants.items() if variant != 'source'}
+
 
 class Workplace(models.Model):
     """
@@ -58,23 +101,79 @@ class Workplace(models.Model):
 
     name = models.CharField(max_length=20, unique=True)
     floor = models.ForeignKey(Floor, on_delete=models.CASCADE)
+    # Optional position on the floor map, for the occupancy overlay.
+    x = models.FloatField(null=True, blank=True, validators=[MinValueValidator(0), MaxValueValidator(100)],
+                          help_text="Position on the floor map in percent of its width, from the left.")
+    y = models.FloatField(null=True, blank=True, validators=[MinValueValidator(0), MaxValueValidator(100)],
+                          help_text="Position on the floor map in percent of its height, from the top.")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Moving the workplace to another floor requires updating the
+        # occupancy rollups.
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def clean(self):
+        if self.pk is not None and self.floor_id is not None \
+                and Location.objects.filter(floor=self.floor_id, isoffice=True).exists():
+            validate_single_reservations(workplace=self.pk)
 
     def __str__(self):
         return self.name
 
 
+def validate_single_reservations(**filters):
+    """
+    Office workplaces can only be reserved once per day. Raises a
+    ValidationError listing the workplaces of the reservations matching
+    the filters which are reserved more than once on a day, so they
+    can't become office workplaces, e.g. by moving them to an office
+    location.
+    """
+    taken = list(Reservation.objects
+        .filter(isoffice=False, **filters)
+        .values('day', 'workplace__name')
+        .annotate(count=models.Count('pk'))
+        .filter(count__gt=1)
+        .order_by('day', 'workplace__name')[:11])
+    if taken:
+        conflicts = ", ".join(f"{row['workplace__name']} is reserved {row['count']} times on {row['day']}"
+                              for row in taken[:10])
+        if len(taken) > 10:
+            conflicts += " and more"
+        raise ValidationError(
+            f"{conflicts}, office workplaces only once per day. Cancel these reservations first.")
+
+
 class Reservation(models.Model):
     day = models.DateField('date')
     employee = models.ForeignKey(Employee, on_delete=models.CASCADE)
     workplace = models.ForeignKey(Workplace, on_delete=models.CASCADE)
+    # Copy of workplace.floor.location.isoffice, which allows the 
+    # database to enforce one reservation per office workplace and day.
+    isoffice = models.BooleanField(default=False, editable=False)
 
-    # class Meta:
-    #     constraints = [
-    #         models.UniqueConstraint(
-    #             fields=['day', 'employee'],
-    #             name='unique_employee_per_day',
-    #         ),
-    #     ]
+    class Meta:
+        constraints = [
+            # Also serves as index for lookups by (day, employee).
+            models.UniqueConstraint(
+                fields=['day', 'employee'],
+                name='unique_employee_per_day',
+            ),
+            # Partial index, not enforced by databases without support
+            # for conditional indexes (e.g. MySQL).
+            models.UniqueConstraint(
+                fields=['day', 'workplace'],
+                condition=models.Q(isoffice=True),
+                name='unique_office_workplace_per_day',
+            ),
+        ]
+        indexes = [
+            # Lookups by (day, workplace) and by day ranges.
+            models.Index(fields=['day', 'workplace'], name='reservation_day_workplace_idx'),
+        ]
 
     def validate_unique_office_place(self, exclude=None):
         """
@@ -87,20 +186,153 @@ class Reservation(models.Model):
         if qs1.filter(workplace__floor__location__isoffice=True).exclude(employee=self.employee).exists():
             raise ValidationError('Only one reservation per day and office workplace.')
 
-        # Instead of a unique_employee_per_day UniqueConstraint we do 
-        # this here. Then it is easier to change existing reservations.
+        # Also enforced by the unique_employee_per_day constraint, but
+        # checked here to raise a ValidationError instead of an 
+        # IntegrityError.
         qs2 = Reservation.objects.exclude(pk=self.pk).filter(employee=self.employee, day=self.day)
         if qs2.exists():
             raise ValidationError('Only one reservation per day and user.')
         #return super().clean(*args, **kwargs)
 
-    def save(self, *args, **kwargs):
-        self.validate_unique_office_place()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values, so changes of e.g. the day can 
+        # also be announced for the previous day.
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, validate=True, **kwargs):
+        """
+        Set validate=False if the database constraints are sufficient,
+        e.g. when the IntegrityError is handled by the caller.
+        """
+        if validate:
+            self.validate_unique_office_place()
+        self.isoffice = self.get_workplace_isoffice()
         super(Reservation, self).save(*args, **kwargs)
 
+    def get_workplace_isoffice(self):
+        """isoffice of the workplace, without queries if already loaded."""
+        if Reservation.workplace.is_cached(self) and Workplace.floor.is_cached(self.workplace) \
+                and Floor.location.is_cached(self.workplace.floor):
+            return self.workplace.floor.location.isoffice
+        if getattr(self, '_isoffice_of', (None,))[0] != self.workplace_id:
+            isoffice = Location.objects \
+                .filter(floor__workplace=self.workplace_id) \
+                .values_list('isoffice', flat=True) \
+                .get()
+            self._isoffice_of = (self.workplace_id, isoffice)
+        return self._isoffice_of[1]
+
     def __str__(self):
         return f"{self.workplace} by {self.employee} ({self.day})"
 
+
+class ArchivedReservation(models.Model):
+    """
+    Reservation older than the retention horizon, moved here by
+    workwhere.archive to keep the Reservation table small.
+    """
+    day = models.DateField('date', db_index=True)
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE)
+    workplace = models.ForeignKey(Workplace, on_delete=models.CASCADE)
+    isoffice = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.workplace} by {self.employee} ({self.day})"
+
+
+class DailyOccupancy(models.Model):
+    """
+    Rollup of the reservations per day and location, maintained by
+    workwhere.rollups.
+    """
+    day = models.DateField()
+    location = models.ForeignKey(Location, on_delete=models.CASCADE)
+    count_all = models.PositiveIntegerField()
+    count_nonstudent = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name_plural = "daily occupancies"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'location'], name='unique_occupancy_per_day_and_location'),
+        ]
+
+
+class MonthlyEmployeeStats(models.Model):
+    """
+    Rollup of the reservations per month, employee and location,
+    maintained by workwhere.rollups.
+    """
+    month = models.DateField(help_text="First day of the month.")
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE)
+    location = models.ForeignKey(Location, on_delete=models.CASCADE)
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name_plural = "monthly employee stats"
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'employee', 'location'], 
+                                    name='unique_stats_per_month_employee_and_location'),
+        ]
+
+
+class DataVersion(models.Model):
+    """
+    Change counter for data shown on the pages, e.g. the reservations of
+    one day or the office layout. The counters are increased whenever 
+    the data changes and allow cheap ETags and 304 responses.
+    """
+    key = models.CharField(max_length=40, unique=True)
+    version = models.PositiveIntegerField(default=0)
+    changed = models.DateTimeField(default=timezone.now)
+
+    LAYOUT = 'layout'
+    EMPLOYEES = 'employees'
+    SETTINGS = 'settings'
+
+    @staticmethod
+    def day_key(day):
+        return f"day:{day}"
+
+    @staticmethod
+    def employee_key(employee_id):
+        """Key of the reservations of one employee."""
+        return f"employee:{employee_id}"
+
+    @staticmethod
+    def month_key(day):
+        """Key of the occupancy rollups of the month of the day."""
+        return f"month:{day:%Y-%m}"
+
+    @classmethod
+    def bump(cls, *keys):
+        """Increase the counters of the given keys."""
+        keys = set(keys)
+        now = timezone.now()
+        if cls.objects.filter(key__in=keys).update(version=F('version') + 1, changed=now) < len(keys):
+            # Create the missing counters and increase all again, which
+            # is also safe if they are created concurrently.
+            cls.objects.bulk_create([cls(key=key, changed=now) for key in keys], ignore_conflicts=True)
+            cls.objects.filter(key__in=keys).update(version=F('version') + 1, changed=now)
+
+    @classmethod
+    def get_many(cls, *keys):
+        """Returns {key: (version, changed)} for the existing keys."""
+        return {key: (version, changed) for key, version, changed 
+                in cls.objects.filter(key__in=keys).values_list('key', 'version', 'changed')}
+
+    @classmethod
+    async def aget_many(cls, *keys):
+        """Async version of get_many()."""
+        return {key: (version, changed) async for key, version, changed
+                in cls.objects.filter(key__in=keys).values_list('key', 'version', 'changed')}
+
+    def __str__(self):
+        return f"{self.key} (v{self.version})"
+
+
 class Infotext(models.Model):
     """For information shown on the Info page"""
     title = models.CharField(max_length=80, default="HowTo")
@@ -112,9 +344,20 @@ class SingletonModel(models.Model):
     class Meta:
         abstract = True
 
+    # Instances loaded by load_cached(), per model class: (instance, expiry)
+    _cache = {}
+    # Other processes only see changes after this many seconds.
+    cache_timeout = 60
+
     def save(self, *args, **kwargs):
         self.__class__.objects.exclude(id=self.id).delete()
         super(SingletonModel, self).save(*args, **kwargs)
+        self.clear_cache()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.clear_cache()
+        return result
 
     @classmethod
     def load(cls):
@@ -123,6 +366,22 @@ class SingletonModel(models.Model):
         except cls.DoesNotExist:
             return cls()        
 
+    @classmethod
+    def load_cached(cls):
+        """
+        Like load(), but keeps the instance in memory of the current
+        process, so repeated calls don't hit the database.
+        """
+        instance, expiry = SingletonModel._cache.get(cls, (None, 0))
+        if time.monotonic() >= expiry:
+            instance = cls.load()
+            SingletonModel._cache[cls] = (instance, time.monotonic() + cls.cache_timeout)
+        return instance
+
+    @classmethod
+    def clear_cache(cls):
+        SingletonModel._cache.pop(cls, None)
+
 def validate_iso_region(value):
     """
     Using ISO 3166-1 and ISO 3166-2 countries or regions like e.g. "ES-AN"
@@ -151,3 +410,23 @@ class Settings(SingletonModel):
     min_office_percent = models.PositiveIntegerField(default=20, 
                                                      validators=[validate_min_office_percent], 
                                                      help_text="Threshold for background color in summary table.")
+
+    def get_calendar(self):
+        """The workalendar instance for the holidays of iso_region."""
+        return workdays.get_calendar(self.iso_region)
+
+    def get_working_days(self):
+        """The precomputed WorkingDayIndex for iso_region."""
+        return workdays.get_working_day_index(self.iso_region)
+
+
+def validate_reservation_day(value):
+    """Reservations are possible for working days in the next 4 weeks."""
+    if value < datetime.date.today():
+        raise ValidationError('Invalid date - date in past')
+
+    if value > datetime.date.today() + datetime.timedelta(weeks=4):
+        raise ValidationError('Invalid date - date more than 4 weeks into the future')
+
+    if not Settings.load_cached().get_working_days().is_working_day(value):
+        raise ValidationError('Invalid date - not a working day')
@@ -0,0 +1,144 @@
+"""
+Builders for the occupancy tables shown on the week and today pages and
+for the floor map overlay.
+
+The data is fetched with a fixed number of queries and pivoted in memory,
+so the number of database round trips does not depend on the number of
+workplaces.
+"""
+from django.db.models import FilteredRelation, Q
+
+from .models import Reservation, Workplace, Floor
+
+
+def build_week_grid(weekdays):
+    """
+    Returns the rows of the week table for the given days.
+
+    The first row holds the weekday names, each following row starts
+    with an office workplace followed by the employee who reserved it
+    on the respective day, or '-' if it is free.
+    """
+    workplaces = Workplace.objects \
+        .filter(floor__location__isoffice=True) \
+        .order_by('name')
+    reservations = Reservation.objects \
+        .filter(day__range=(weekdays[0], weekdays[-1]), workplace__floor__location__isoffice=True) \
+        .select_related('employee')
+
+    occupancy = {(reserved.workplace_id, reserved.day): reserved.employee for reserved in reservations}
+
+    data = [['', *(day.strftime("%A") for day in weekdays)]]
+    for workplace in workplaces:
+        row = [workplace]
+        row.extend(occupancy.get((workplace.pk, day), '-') for day in weekdays)
+        data.append(row)
+
+    return data
+
+
+def _today_querysets(day):
+    floors = Floor.objects \
+        .filter(location__isoffice=True) \
+        .select_related('location')
+    workplaces = Workplace.objects \
+        .filter(floor__location__isoffice=True) \
+        .order_by('name') \
+        .values_list('pk', 'name', 'floor_id')
+    reservations = Reservation.objects \
+        .filter(day=day, workplace__floor__location__isoffice=True) \
+        .select_related('employee')
+    return floors, workplaces, reservations
+
+
+def _today_status(floors, workplaces, reservations):
+    occupancy = {reserved.workplace_id: reserved.employee for reserved in reservations}
+
+    desks_per_floor = {floor.pk: {} for floor in floors}
+    for pk, name, floor_id in workplaces:
+        desks_per_floor[floor_id][name] = occupancy.get(pk, "")
+
+    return {floor: desks_per_floor[floor.pk] for floor in floors}
+
+
+def build_today_status(day):
+    """
+    Returns the status of all office desks on the given day, grouped by
+    floor: {floor: {workplace name: employee or ""}}.
+
+    Floors without desks are kept with an empty dict.
+    """
+    floors, workplaces, reservations = _today_querysets(day)
+    return _today_status(list(floors), workplaces, reservations)
+
+
+async def abuild_today_status(day):
+    """Async version of build_today_status()."""
+    floors, workplaces, reservations = _today_querysets(day)
+    return _today_status([floor async for floor in floors],
+                         [row async for row in workplaces],
+                         [reserved async for reserved in reservations])
+
+
+def _positioned_floors(floors):
+    return Workplace.objects \
+        .filter(floor__in=floors, x__isnull=False, y__isnull=False) \
+        .values_list('floor_id', flat=True) \
+        .distinct()
+
+
+def get_overlay_floors(floors):
+    """
+    The floors with a floor map and positioned workplaces, which are
+    shown with the occupancy overlay.
+    """
+    floors = [floor for floor in floors if floor.floormap]
+    positioned = set(_positioned_floors(floors)) if floors else set()
+    return [floor for floor in floors if floor.pk in positioned]
+
+
+async def aget_overlay_floors(floors):
+    """Async version of get_overlay_floors()."""
+    floors = [floor for floor in floors if floor.floormap]
+    positioned = {pk async for pk in _positioned_floors(floors)} if floors else set()
+    return [floor for floor in floors if floor.pk in positioned]
+
+
+def build_floors_occupancy(floor_ids, day):
+    """
+    Returns {floor id: workplaces} for the given floors: the workplaces
+    with their position on the floor map and the employee who reserved
+    it on the given day (or None), as dicts. One query, joining only the
+    reservations of that day.
+    """
+    workplaces = Workplace.objects \
+        .filter(floor__in=floor_ids) \
+        .annotate(reserved=FilteredRelation('reservation', condition=Q(reservation__day=day))) \
+        .order_by('name') \
+        .values('id', 'name', 'x', 'y', 'floor_id', 'reserved__employee_id',
+                'reserved__employee__first_name', 'reserved__employee__last_name')
+
+    floors = {floor_id: {} for floor_id in floor_ids}
+    for values in workplaces:
+        desks = floors[values['floor_id']]
+        # Non-office workplaces can have several reservations, the
+        # first is enough to show them as taken.
+        if values['id'] in desks:
+            continue
+        desks[values['id']] = {
+            'id': values['id'],
+            'name': values['name'],
+            'x': values['x'],
+            'y': values['y'],
+            'employee': {
+                'id': values['reserved__employee_id'],
+                'first_name': values['reserved__employee__first_name'],
+                'last_name': values['reserved__employee__last_name'],
+            } if values['reserved__employee_id'] is not None else None,
+        }
+    return {floor_id: list(desks.values()) for floor_id, desks in floors.items()}
+
+
+def build_floor_occupancy(floor_id, day):
+    """The workplaces of one floor, see build_floors_occupancy()."""
+    return build_floors_occupancy([floor_id], day)[floor_id]
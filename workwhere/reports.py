@@ -0,0 +1,107 @@
+"""
+Office attendance reports for arbitrary date ranges, written as CSV
+rows. The rows are generated while the database results are fetched in
+chunks, so the memory use doesn't depend on the number of reservations.
+Archived reservations are included.
+"""
+import csv
+import datetime
+
+from django.db.models import Count, Q, Sum
+
+from .models import Reservation, ArchivedReservation, Employee, Workplace, DailyOccupancy, Settings
+
+
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    """Pseudo-buffer for csv.writer, returning the rows instead of storing them."""
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    return (writer.writerow(row) for row in rows)
+
+
+def count_working_days(start, end):
+    """
+    Number of working days from start to end, both included. Also used
+    by the monthly summary, so reports of a month show the same numbers.
+    """
+    # get_working_days_delta() counts from the day after start, and
+    # returns 0 for equal days even with include_start.
+    return Settings.load_cached().get_working_days() \
+        .get_working_days_delta(start - datetime.timedelta(days=1), end)
+
+
+def per_person_rows(start, end):
+    """
+    Reservations per employee from start to end (both included), like
+    the per person table of the monthly summary.
+    """
+    min_office_percent = Settings.load_cached().min_office_percent
+    workdays_count = count_working_days(start, end)
+
+    yield ['employee', 'first_name', 'last_name', 'student', 'working_days',
+           'reservations', 'reservation_rate', 'office_reservations', 'office_rate', 'office_rate_reached']
+
+    # One entry per employee, summed over the current and the archive table
+    counts = {}
+    for model in (Reservation, ArchivedReservation):
+        model_counts = model.objects \
+            .filter(day__range=(start, end)) \
+            .values_list('employee') \
+            .annotate(total_count=Count('id'), office_count=Count('id', filter=Q(isoffice=True))) \
+            .order_by()
+        for employee, total_count, office_count in model_counts.iterator(chunk_size=CHUNK_SIZE):
+            previous = counts.get(employee, (0, 0))
+            counts[employee] = (previous[0] + total_count, previous[1] + office_count)
+
+    employees = Employee.objects \
+        .order_by('last_name', 'first_name', 'id') \
+        .values_list('id', 'first_name', 'last_name', 'isstudent')
+    for employee, first_name, last_name, isstudent in employees.iterator(chunk_size=CHUNK_SIZE):
+        if employee not in counts:
+            continue
+        total_count, office_count = counts[employee]
+        total_rate = 100*total_count/workdays_count if workdays_count else 0
+        office_rate = 100*office_count/workdays_count if workdays_count else 0
+        yield [
+            employee, first_name, last_name, 'yes' if isstudent else 'no', workdays_count,
+            total_count, f"{total_rate:.1f}",
+            office_count, f"{office_rate:.1f}",
+            'yes' if office_rate >= min_office_percent else 'no',
+        ]
+
+
+def per_location_rows(start, end):
+    """
+    Office utilization per location from start to end (both included),
+    like the per location table of the monthly summary.
+    """
+    workdays_count = count_working_days(start, end)
+
+    yield ['location', 'working_days', 'workplaces', 'reservations', 'utilization',
+           'reservations_nonstudent', 'utilization_nonstudent']
+
+    workplace_counts = dict(Workplace.objects
+        .filter(floor__location__isoffice=True)
+        .values_list('floor__location__name')
+        .annotate(Count('id'))
+        .order_by())
+    counts = DailyOccupancy.objects \
+        .filter(day__range=(start, end), location__isoffice=True) \
+        .values('location__name') \
+        .annotate(total=Sum('count_all'), total_nonstudent=Sum('count_nonstudent')) \
+        .order_by('location__name')
+
+    for count in counts.iterator(chunk_size=CHUNK_SIZE):
+        capacity = workdays_count * workplace_counts.get(count['location__name'], 0)
+        yield [
+            count['location__name'], workdays_count, workplace_counts.get(count['location__name'], 0),
+            count['total'], f"{100*count['total']/capacity:.1f}" if capacity else '',
+            count['total_nonstudent'], f"{100*count['total_nonstudent']/capacity:.1f}" if capacity else '',
+        ]
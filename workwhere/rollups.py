@@ -0,0 +1,174 @@
+"""
+Rollup tables for the monthly summary.
+
+DailyOccupancy and MonthlyEmployeeStats hold the reservation counts per
+location, so reading a summary doesn't depend on the number of
+reservations. The affected rows are recomputed after each reservation
+change, and then the DataVersion of the month is increased. Archived
+reservations (see workwhere.archive) are included. Moving workplaces or
+floors to another location recomputes the days of their reservations.
+The management command workwhere_rebuild_rollups recomputes everything,
+e.g. after changes bypassing the model signals.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncMonth
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Reservation, ArchivedReservation, Employee, Floor, Workplace, DailyOccupancy, \
+    MonthlyEmployeeStats, DataVersion
+from .signals import reservations_changed
+
+
+def _as_date(day):
+    if isinstance(day, datetime.date):
+        return day
+    return datetime.date.fromisoformat(str(day))
+
+
+def _next_month(month):
+    return (month + datetime.timedelta(days=31)).replace(day=1)
+
+
+def _counts(filters, group_by, aggregates, annotations=None):
+    """
+    Returns {group: {aggregate: value}} of the current and the archived
+    reservations matching the filters, grouped by the fields group_by.
+    """
+    totals = {}
+    for model in (Reservation, ArchivedReservation):
+        counts = model.objects \
+            .filter(filters) \
+            .annotate(**(annotations or {})) \
+            .values(*group_by) \
+            .annotate(**aggregates) \
+            .order_by()
+        for count in counts:
+            total = totals.setdefault(tuple(count[field] for field in group_by), dict.fromkeys(aggregates, 0))
+            for name in aggregates:
+                total[name] += count[name]
+    return totals
+
+
+def reservation_days(**filters):
+    """Days with current or archived reservations matching the filters."""
+    return {day for model in (Reservation, ArchivedReservation)
+            for day in model.objects.filter(**filters).values_list('day', flat=True).distinct()}
+
+
+def employee_days(employees):
+    """Days with current or archived reservations of the employees (ids)."""
+    return reservation_days(employee__in=employees)
+
+
+def update_layout_days(days):
+    """Recompute all rollups of the given days, after workplaces moved to another location."""
+    update_days(days)
+    update_months(days)
+
+
+def update_days(days):
+    """Recompute the DailyOccupancy of the given days."""
+    days = {_as_date(day) for day in days}
+    counts = _counts(Q(day__in=days), ['day', 'workplace__floor__location'], {
+        'count_all': Count('id'),
+        'count_nonstudent': Count('id', filter=Q(employee__isstudent=False)),
+    })
+    rows = [DailyOccupancy(day=day, location_id=location, **count) for (day, location), count in counts.items()]
+
+    with transaction.atomic():
+        _replace(DailyOccupancy.objects.filter(day__in=days), rows, ['day', 'location_id'],
+                 update_fields=['count_all', 'count_nonstudent'])
+        if days:
+            DataVersion.bump(*{DataVersion.month_key(day) for day in days})
+
+
+def update_months(months, employees=None):
+    """
+    Recompute the MonthlyEmployeeStats of the given months, for all or
+    only for the given employees (ids).
+    """
+    months = {_as_date(month).replace(day=1) for month in months}
+    if not months:
+        return
+    in_months = Q()
+    for month in months:
+        in_months |= Q(day__gte=month, day__lt=_next_month(month))
+
+    stats = MonthlyEmployeeStats.objects.filter(month__in=months)
+    if employees is not None:
+        in_months &= Q(employee__in=employees)
+        stats = stats.filter(employee__in=employees)
+
+    counts = _counts(in_months, ['month', 'employee', 'workplace__floor__location'], {'count': Count('id')},
+                     annotations={'month': TruncMonth('day')})
+    rows = [MonthlyEmployeeStats(month=month, employee_id=employee, location_id=location, **count)
+            for (month, employee, location), count in counts.items()]
+
+    with transaction.atomic():
+        _replace(stats, rows, ['month', 'employee_id', 'location_id'], update_fields=['count'])
+        DataVersion.bump(*{DataVersion.month_key(month) for month in months})
+
+
+def _replace(queryset, rows, key_fields, update_fields):
+    """
+    Make the rows of the queryset equal to the given rows, by inserting
+    or updating them and deleting those not given.
+    """
+    model = queryset.model
+    if rows:
+        model.objects.bulk_create(rows, update_conflicts=True, update_fields=update_fields,
+                                  unique_fields=key_fields)
+    keys = {tuple(getattr(row, field) for field in key_fields) for row in rows}
+    stale = [pk for pk, *key in queryset.values_list('pk', *key_fields) if tuple(key) not in keys]
+    if stale:
+        model.objects.filter(pk__in=stale).delete()
+
+
+def rebuild(start, end):
+    """Recompute all rollups of the months from start to end."""
+    month = _as_date(start).replace(day=1)
+    while month <= end:
+        next_month = _next_month(month)
+        update_days(month + datetime.timedelta(days=i) for i in range((next_month - month).days))
+        update_months([month])
+        month = next_month
+
+
+@receiver(reservations_changed)
+def update_rollups(sender, days, employees, **kwargs):
+    days = {_as_date(day) for day in days}
+
+    def update():
+        update_days(days)
+        update_months(days, employees)
+
+    # After the commit, so the changes are included in the counts.
+    transaction.on_commit(update)
+
+
+@receiver(post_save, sender=Employee)
+def employee_saved(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_values', {})
+    if not created and loaded.get('isstudent', instance.isstudent) != instance.isstudent:
+        update_days(employee_days([instance.pk]))
+    instance._loaded_values = {'isstudent': instance.isstudent}
+
+
+@receiver(post_save, sender=Workplace)
+def workplace_saved(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_values', {})
+    if not created and loaded.get('floor_id', instance.floor_id) != instance.floor_id:
+        update_layout_days(reservation_days(workplace=instance.pk))
+    instance._loaded_values = {'floor_id': instance.floor_id}
+
+
+@receiver(post_save, sender=Floor)
+def floor_saved(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_values', {})
+    if not created and loaded.get('location_id', instance.location_id) != instance.location_id:
+        update_layout_days(reservation_days(workplace__floor=instance.pk))
+    instance._loaded_values = {'location_id': instance.location_id}
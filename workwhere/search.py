@@ -0,0 +1,62 @@
+"""
+Prefix search over the active employees, used by the employee field of
+the reservation form while typing.
+
+The employees are held in memory as a sorted list of lowercase name and
+ID tokens, so a search is a binary search instead of a database query.
+The index is rebuilt when the DataVersion of the employees changed,
+which costs one small query per search.
+"""
+import bisect
+import threading
+
+from .models import Employee, DataVersion
+
+
+class EmployeeIndex:
+    """Sorted prefix index over last_name, first_name and id."""
+
+    def __init__(self, employees):
+        # (id, label) in the order of the results
+        self.employees = [(employee.pk, str(employee)) for employee in employees]
+        self.tokens = sorted(
+            (token.casefold(), position)
+            for position, employee in enumerate(employees)
+            for token in {employee.last_name, employee.first_name, employee.pk}
+        )
+
+    def _positions(self, prefix):
+        start = bisect.bisect_left(self.tokens, (prefix,))
+        positions = set()
+        for token, position in self.tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            positions.add(position)
+        return positions
+
+    def search(self, query, limit):
+        """
+        Returns up to limit (id, label) of the employees with a token
+        starting with each word of the query, e.g. "mil da".
+        """
+        words = query.casefold().split()
+        if not words:
+            return []
+        positions = set.intersection(*(self._positions(word) for word in words))
+        return [self.employees[position] for position in sorted(positions)[:limit]]
+
+
+_index = (None, None)
+_index_lock = threading.Lock()
+
+
+def get_employee_index():
+    """The EmployeeIndex of the active employees, rebuilt after changes."""
+    global _index
+    # (version, changed), as the version alone repeats after rollbacks
+    version = DataVersion.get_many(DataVersion.EMPLOYEES).get(DataVersion.EMPLOYEES)
+    with _index_lock:
+        if _index[1] is None or _index[0] != version:
+            employees = list(Employee.objects.filter(isactive=True).only('id', 'first_name', 'last_name'))
+            _index = (version, EmployeeIndex(employees))
+        return _index[1]
@@ -0,0 +1,123 @@
+"""
+Keep derived data up to date when reservations or the office layout
+change. Signals are used instead of overriding save/delete, so that
+admin bulk deletions and cascades are covered as well.
+"""
+import threading
+import weakref
+
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+
+from .models import Reservation, Employee, Workplace, Floor, Location, Settings, DataVersion
+
+
+# Sent with the sets `days` and `employees` (ids) whenever reservations
+# are created, changed or deleted. Write paths which bypass the model 
+# signals, like bulk operations, send it themselves.
+reservations_changed = Signal()
+
+
+# Models whose deletion deletes reservations in cascade
+CASCADE_SOURCES = (Employee, Workplace, Floor, Location)
+
+_cascades = threading.local()
+
+
+def _pending_cascades():
+    """{origin of a deletion: (days, employees)} of the current thread."""
+    if not hasattr(_cascades, 'pending'):
+        _cascades.pending = weakref.WeakKeyDictionary()
+    return _cascades.pending
+
+
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Reservation)
+def reservation_saved_or_deleted(sender, instance, origin=None, **kwargs):
+    loaded = getattr(instance, '_loaded_values', {})
+    days = {instance.day, loaded.get('day')} - {None}
+    employees = {instance.employee_id, loaded.get('employee_id')} - {None}
+    instance._loaded_values = {'day': instance.day, 'employee_id': instance.employee_id}
+
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model in CASCADE_SOURCES:
+        # Deleted in cascade, announced once for all reservations when
+        # the origin is deleted, see cascade_deleted().
+        pending_days, pending_employees = _pending_cascades().setdefault(origin, (set(), set()))
+        pending_days.update(days)
+        pending_employees.update(employees)
+    else:
+        reservations_changed.send(sender=Reservation, days=days, employees=employees)
+
+
+@receiver(post_delete, sender=Employee)
+@receiver(post_delete, sender=Workplace)
+@receiver(post_delete, sender=Floor)
+@receiver(post_delete, sender=Location)
+def cascade_deleted(sender, instance, origin=None, **kwargs):
+    # Reservations are deleted before the objects they refer to, so
+    # all reservations of the deletion are collected at this point.
+    if origin is None:
+        return
+    days, employees = _pending_cascades().pop(origin, ((), ()))
+    if days:
+        reservations_changed.send(sender=Reservation, days=days, employees=employees)
+
+
+@receiver(reservations_changed)
+def bump_reservation_versions(sender, days, employees=(), **kwargs):
+    DataVersion.bump(*(DataVersion.day_key(day) for day in days),
+                     *(DataVersion.employee_key(employee) for employee in employees))
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+@receiver(post_save, sender=Floor)
+@receiver(post_delete, sender=Floor)
+@receiver(post_save, sender=Workplace)
+@receiver(post_delete, sender=Workplace)
+def layout_changed(sender, instance, **kwargs):
+    DataVersion.bump(DataVersion.LAYOUT)
+
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def employee_changed(sender, instance, **kwargs):
+    DataVersion.bump(DataVersion.EMPLOYEES)
+
+
+@receiver(post_save, sender=Settings)
+def settings_changed(sender, instance, **kwargs):
+    DataVersion.bump(DataVersion.SETTINGS)
+
+
+@receiver(post_save, sender=Location)
+def location_saved(sender, instance, **kwargs):
+    sync_reservation_isoffice(workplace__floor__location=instance)
+
+
+@receiver(post_save, sender=Floor)
+def floor_saved(sender, instance, **kwargs):
+    sync_reservation_isoffice(workplace__floor=instance)
+
+
+@receiver(post_save, sender=Workplace)
+def workplace_saved(sender, instance, **kwargs):
+    sync_reservation_isoffice(workplace=instance)
+
+
+def sync_reservation_isoffice(**filters):
+    """
+    Update the copy of isoffice on the reservations matching the
+    filters (all if none are given). Raises an IntegrityError if a
+    workplace reserved several times on a day becomes an office
+    workplace, which the clean() methods of the models prevent in forms.
+    """
+    reservations = Reservation.objects.filter(**filters)
+    reservations \
+        .filter(isoffice=False, workplace__floor__location__isoffice=True) \
+        .update(isoffice=True)
+    reservations \
+        .filter(isoffice=True, workplace__floor__location__isoffice=False) \
+        .update(isoffice=False)
@@ -1,11 +1,52 @@
+import csv
 import datetime
+import asyncio
+import gzip
+import importlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
 
-from django.test import TestCase
-from django.urls import reverse
+from asgiref.sync import async_to_sync
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.contrib.auth.models import AnonymousUser, User
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.signals import request_started
+from django.db import close_old_connections
+from django.core.management import call_command, CommandError
+from django.utils import timezone
+from django.urls import clear_url_caches, reverse
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import parse_http_date
 from django.core.exceptions import ValidationError
+from django.db import connection, IntegrityError, OperationalError
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
 
-from workwhere.models import Workplace, Employee, Location, Reservation, Floor
+from workwhere.models import Workplace, Employee, Location, Reservation, Floor, Settings, DataVersion, \
+    DailyOccupancy, MonthlyEmployeeStats, ArchivedReservation
 from workwhere.forms import ReservationForm
+from workwhere import async_views, benchmark, urls, views
+from workwhere.allocation import allocate
+from workwhere.archive import archive_reservations
+from workwhere.availability import Availability
+from workwhere.booking import book, book_many, cancel_reservations, delete_reservations, get_days, \
+    move_reservations
+from workwhere.ical import _fold
+from workwhere.signals import reservations_changed
+from workwhere.instrumentation import metrics
+from workwhere.events import LocalBroadcaster, DataVersionBroadcaster, get_broadcaster, stream_events
+from workwhere.workdays import WorkingDayIndex, get_calendar, get_working_day_index
 
 
 def create_office_environment():
@@ -31,6 +72,17 @@ def create_office_environment():
     Employee.objects.create(first_name='James', last_name='Davis', id='jam_da', isstudent=True)
 
 
+def create_large_office_environment(floors, desks_per_floor):
+    """Fill a test database with many office desks for benchmarking"""
+
+    location = Location.objects.create(name=f'large_office_{floors}', isoffice=True)
+    new_floors = Floor.objects.bulk_create(
+        [Floor(name=f'floor_{i}', location=location) for i in range(floors)])
+    Workplace.objects.bulk_create(
+        [Workplace(name=f'd{floors}_{i}_{j}', floor=floor)
+         for i, floor in enumerate(new_floors) for j in range(desks_per_floor)])
+
+
 class ReservationModelTest(TestCase):
     def test_same_desk_different_employee_error(self):
         create_office_environment()
@@ -105,6 +157,13 @@ class ReservationFormTests(TestCase):
         expected = Employee.objects.exclude(pk='sar_br')
         self.assertQuerysetEqual(actual, expected)
 
+    def test_employee_widget_renders_selected_only(self):
+        create_office_environment()
+        html = ReservationForm({'employee': 'cla_sm'})['employee'].as_widget()
+        self.assertIn('value="cla_sm"', html)
+        self.assertNotIn('dav_mi', html)
+        self.assertNotIn('<option', ReservationForm()['employee'].as_widget())
+
     def test_correct_workplace_queryset(self):
         """
         Reserved office workplaces should not appear in the workplace 
@@ -129,7 +188,7 @@ class ReservationFormTests(TestCase):
         Reservation(day=today, employee=dave, workplace=workplace1).save()
 
         form = ReservationForm({'employee': clare, 'day': today})
-        expected = Workplace.objects.exclude(pk=workplace1.pk).order_by('-floor__location')
+        expected = Workplace.objects.exclude(pk=workplace1.pk).order_by('floor__location__isoffice', 'name')
 
         # 1. Only the today occupied workplace should be missing in the 
         # list.
@@ -152,6 +211,28 @@ class ReservationFormTests(TestCase):
         self.assertQuerysetEqual(actual, expected, None, None, "test3")
 
 
+    def test_change_existing_reservation(self):
+        """
+        A second reservation of the employee on the same day changes
+        the first one instead of failing the unique constraint.
+        """
+        create_office_environment()
+        workplace1 = Workplace.objects.get(name='w1_1')
+        workplace2 = Workplace.objects.get(name='w2_1')
+        dave = Employee.objects.get(pk='dav_mi')
+        day = datetime.date.today() + datetime.timedelta(days=1)
+        while day.isoweekday() > 5:
+            day += datetime.timedelta(days=1)
+        Reservation(day=day, employee=dave, workplace=workplace1).save()
+
+        form = ReservationForm({'employee': 'dav_mi', 'day': str(day), 'workplace': workplace2.pk})
+        # No checks of the existing reservation before book()
+        with self.assertNumQueries(3):  # employee, free workplaces, workplace
+            self.assertTrue(form.is_valid(), form.errors)
+        book(dave, day, form.cleaned_data['workplace'])
+        self.assertQuerysetEqual(Reservation.objects.values_list('workplace__name', flat=True), ['w2_1'])
+
+
 class TodayViewTests(TestCase):
     def test_no_workplaces(self):
         response = self.client.get(reverse('workwhere:today'))
@@ -159,6 +240,43 @@ class TodayViewTests(TestCase):
         self.assertContains(response, "No office desks are available.")
         self.assertQuerysetEqual(response.context['desks_today'], [])
 
+    def test_desks_today(self):
+        create_office_environment()
+        floor1 = Floor.objects.get(name='floor1')
+        floor2 = Floor.objects.get(name='floor2')
+        empty_floor = Floor.objects.create(name='empty', location=floor1.location)
+        dave = Employee.objects.get(pk='dav_mi')
+        Reservation(day=timezone.now().date(), employee=dave, 
+                    workplace=Workplace.objects.get(name='w1_1')).save()
+
+        response = self.client.get(reverse('workwhere:ajax_update_today'))
+        self.assertEqual(response.context['desks_today'], {
+            floor1: {'w1_1': dave},
+            floor2: {'w2_1': ''},
+            empty_floor: {},
+        })
+
+    def test_constant_query_count(self):
+        """
+        The number of queries must stay flat when the same number of
+        desks is spread over more floors.
+        """
+        def count_queries():
+            url = reverse('workwhere:ajax_update_today')
+            self.client.get(url)  # Fill the caches
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            return len(queries)
+
+        create_large_office_environment(floors=1, desks_per_floor=2000)
+        queries_few_floors = count_queries()
+
+        Location.objects.all().delete()
+        create_large_office_environment(floors=40, desks_per_floor=50)
+        queries_many_floors = count_queries()
+
+        self.assertEqual(queries_few_floors, queries_many_floors)
+
 class WeekViewTests(TestCase):
     def test_week_redirect(self):
         response = self.client.get(reverse('workwhere:week_redirect'))
@@ -171,3 +289,1513 @@ class WeekViewTests(TestCase):
         self.assertContains(response, "Monday")
         self.assertQuerysetEqual(response.context['data'], \
             [['', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']])
+
+    def test_week_data(self):
+        create_office_environment()
+        workplace1 = Workplace.objects.get(name='w1_1')
+        dave = Employee.objects.get(pk='dav_mi')
+        monday = datetime.date.fromisocalendar(2023, 15, 1)
+        Reservation(day=monday, employee=dave, workplace=workplace1).save()
+
+        response = self.client.get( \
+            reverse('workwhere:week', kwargs={'year':2023, 'week': 15}))
+        self.assertEqual(response.context['data'][1], \
+            [workplace1, dave, '-', '-', '-', '-'])
+        self.assertEqual(len(response.context['data']), 3)
+
+    def test_constant_query_count(self):
+        """The number of queries must not depend on the number of desks"""
+        create_office_environment()
+        floor1 = Floor.objects.get(name='floor1')
+        dave = Employee.objects.get(pk='dav_mi')
+        monday = datetime.date.fromisocalendar(2023, 15, 1)
+        url = reverse('workwhere:week', kwargs={'year':2023, 'week': 15})
+
+        with CaptureQueriesContext(connection) as few_desks:
+            self.client.get(url)
+
+        for i in range(50):
+            workplace = Workplace.objects.create(name=f'extra_{i}', floor=floor1)
+        Reservation(day=monday, employee=dave, workplace=workplace).save()
+
+        with CaptureQueriesContext(connection) as many_desks:
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['data']), 53)
+        self.assertEqual(len(many_desks), len(few_desks))
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        Settings.clear_cache()
+        cache.clear()
+        self.workplace1 = Workplace.objects.get(name='w1_1')
+        self.dave = Employee.objects.get(pk='dav_mi')
+
+    def test_week(self):
+        url = reverse('workwhere:week', kwargs={'year': 2023, 'week': 15})
+        with CaptureQueriesContext(connection) as uncached:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as cached:
+            response = self.client.get(url)
+        self.assertLess(len(cached), len(uncached))
+        self.assertNotContains(response, 'Miller')
+
+        # Changes of the reservations, the layout and the employees
+        Reservation(day=datetime.date(2023, 4, 12), employee=self.dave, workplace=self.workplace1).save()
+        self.assertContains(self.client.get(url), 'Miller, Dave')
+        self.dave.last_name = 'Smith'
+        self.dave.save()
+        self.assertContains(self.client.get(url), 'Smith, Dave')
+        Workplace.objects.create(name='w1_2', floor=self.workplace1.floor)
+        self.assertContains(self.client.get(url), 'w1_2')
+
+    def test_summary(self):
+        self.client.force_login(User.objects.create_user('admin'))
+        url = reverse('workwhere:summary', kwargs={'year': 2023, 'month': 4})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as cached:
+            response = self.client.get(url)
+        self.assertFalse([query for query in cached if 'dailyoccupancy' in query['sql'].lower()])
+        self.assertNotContains(response, 'location_office')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book(self.dave, datetime.date(2023, 4, 12), self.workplace1)
+        response = self.client.get(url)
+        self.assertContains(response, 'location_office')
+        self.assertNotContains(response, 'table-success')
+
+        settings = Settings.load()
+        settings.min_office_percent = 5
+        settings.save()
+        Settings.clear_cache()
+        self.assertContains(self.client.get(url), 'table-success')
+
+    def test_closed_periods_without_timeout(self):
+        with self.settings(WORKWHERE_FRAGMENT_CACHE_TIMEOUT=0):
+            url = reverse('workwhere:week', kwargs={'year': 2023, 'week': 15})
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as past_week:
+                self.client.get(url)
+            monday = timezone.now().date() + datetime.timedelta(weeks=1)
+            url = reverse('workwhere:week', args=monday.isocalendar()[:2])
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as future_week:
+                self.client.get(url)
+        self.assertLess(len(past_week), len(future_week))
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        self.factory = AsyncRequestFactory()
+        self.today = timezone.now().date()
+        Reservation.objects.create(day=self.today, employee_id='dav_mi',
+                                   workplace=Workplace.objects.get(name='w1_1'))
+
+    def get_request(self, path, data=None, **extra):
+        request = self.factory.get(path, data, **extra)
+        request.user = AnonymousUser()
+        return request
+
+    async def test_load_workplaces(self):
+        request = self.get_request('/', {'day': str(self.today), 'employee': 'cla_sm'})
+        response = await async_views.load_workplaces(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'w1_1')
+        self.assertContains(response, 'w2_1')
+        self.assertContains(response, 'home_office')
+
+        request = self.get_request('/', {'day': str(self.today), 'employee': 'dav_mi'})
+        response = await async_views.load_workplaces(request)
+        self.assertContains(response, 'selected value="{}">w1_1'.format(
+            (await Workplace.objects.aget(name='w1_1')).pk))
+
+        response = await async_views.load_workplaces(self.get_request('/', {'day': 'x', 'employee': 'dav_mi'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'w2_1')
+
+    async def test_user_resolved(self):
+        # The lazy user of the middleware can't be loaded in the event loop.
+        user = await User.objects.acreate(username='someone')
+        request = self.get_request('/', {'day': str(self.today), 'employee': 'cla_sm'})
+        request.user = SimpleLazyObject(lambda: User.objects.get(pk=user.pk))
+        await async_views.load_workplaces(request)
+        self.assertEqual(request.user._wrapped, user)
+
+    async def test_today(self):
+        view = async_views.Today.as_view(template_name='workwhere/today_list.html')
+        response = await view(self.get_request('/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Miller, Dave')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        response = await view(self.get_request('/', headers={'If-None-Match': response['ETag']}))
+        self.assertEqual(response.status_code, 304)
+
+    def test_same_etag_as_sync_view(self):
+        response = self.client.get(reverse('workwhere:today'))
+        async_response = async_to_sync(async_views.Today.as_view())(self.get_request('/'))
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response['ETag'], response['ETag'])
+        self.assertEqual(async_response['Last-Modified'], response['Last-Modified'])
+
+    def test_routing(self):
+        def reload():
+            importlib.reload(urls)
+            clear_url_caches()
+            return {pattern.name: pattern.callback for pattern in urls.urlpatterns}
+
+        self.addCleanup(reload)
+        with self.settings(WORKWHERE_ASYNC_VIEWS=True):
+            callbacks = reload()
+        self.assertIs(callbacks['ajax_load_workplaces'], async_views.load_workplaces)
+        self.assertIs(callbacks['today'].view_class, async_views.Today)
+        self.assertIs(callbacks['ajax_update_today'].view_class, async_views.Today)
+        self.assertIs(reload()['today'].view_class, views.Today)
+
+
+class ConditionalGetTests(TestCase):
+    def test_today_not_modified(self):
+        create_office_environment()
+        url = reverse('workwhere:ajax_update_today')
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_today_modified_by_reservation(self):
+        create_office_environment()
+        url = reverse('workwhere:ajax_update_today')
+        etag = self.client.get(url)['ETag']
+
+        reservation = Reservation(day=timezone.now().date(), workplace=Workplace.objects.get(name='w1_1'),
+                                  employee=Employee.objects.get(pk='dav_mi'))
+        reservation.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        reservation.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_future_week_last_modified(self):
+        create_office_environment()
+        year, week, _ = (timezone.now().date() + datetime.timedelta(weeks=3)).isocalendar()
+        response = self.client.get(reverse('workwhere:week', kwargs={'year': year, 'week': week}))
+        self.assertLessEqual(parse_http_date(response['Last-Modified']), time.time())
+
+    def test_week_modified(self):
+        create_office_environment()
+        url = reverse('workwhere:week', kwargs={'year':2023, 'week': 15})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Reservations in other weeks don't change the page
+        reservation = Reservation.objects.create(day=datetime.date(2023, 4, 17), 
+            workplace=Workplace.objects.get(name='w1_1'), employee=Employee.objects.get(pk='dav_mi'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Moving a reservation into the week does
+        reservation = Reservation.objects.get(pk=reservation.pk)
+        reservation.day = datetime.date(2023, 4, 14)
+        reservation.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # And so does moving it out again
+        etag = response['ETag']
+        reservation.day = datetime.date(2023, 4, 17)
+        reservation.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_week_modified_by_layout(self):
+        create_office_environment()
+        url = reverse('workwhere:week', kwargs={'year':2023, 'week': 15})
+        etag = self.client.get(url)['ETag']
+        Workplace.objects.create(name='w1_2', floor=Floor.objects.get(name='floor1'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class SettingsCacheTests(TestCase):
+    def setUp(self):
+        Settings.clear_cache()
+
+    def tearDown(self):
+        Settings.clear_cache()
+
+    def test_load_cached(self):
+        Settings.objects.create(iso_region='DE-BE', min_office_percent=30)
+        Settings.load_cached()
+        with self.assertNumQueries(0):
+            self.assertEqual(Settings.load_cached().min_office_percent, 30)
+
+    def test_save_invalidates_cache(self):
+        settings = Settings.objects.create(iso_region='DE-BE', min_office_percent=30)
+        self.assertEqual(Settings.load_cached().min_office_percent, 30)
+        settings.min_office_percent = 50
+        settings.save()
+        self.assertEqual(Settings.load_cached().min_office_percent, 50)
+
+    def test_calendar_reused(self):
+        settings = Settings.objects.create(iso_region='DE-BE')
+        self.assertIs(settings.get_calendar(), Settings.load_cached().get_calendar())
+        settings.iso_region = 'ES-AN'
+        settings.save()
+        self.assertEqual(Settings.load_cached().get_calendar().__class__.__name__, 'Andalusia')
+
+
+class WorkingDayIndexTests(TestCase):
+    def setUp(self):
+        self.calendar = get_calendar('ES-AN')
+        self.index = WorkingDayIndex(self.calendar, 2022, 2024)
+
+    def test_is_working_day(self):
+        day = datetime.date(2022, 1, 1)
+        while day <= datetime.date(2024, 12, 31):
+            self.assertEqual(self.index.is_working_day(day), self.calendar.is_working_day(day), day)
+            day += datetime.timedelta(days=1)
+
+    def test_working_days_delta(self):
+        days = [datetime.date(2022, 1, 1), datetime.date(2022, 1, 6), datetime.date(2023, 2, 28),
+                datetime.date(2023, 4, 7), datetime.date(2023, 4, 30), datetime.date(2024, 12, 31)]
+        for start in days:
+            for end in days:
+                for include_start in [False, True]:
+                    self.assertEqual(
+                        self.index.get_working_days_delta(start, end, include_start),
+                        self.calendar.get_working_days_delta(start, end, include_start),
+                        (start, end, include_start))
+
+    def test_outside_of_range(self):
+        start = datetime.date(2021, 12, 1)
+        end = datetime.date(2022, 1, 31)
+        self.assertEqual(self.index.get_working_days_delta(start, end),
+                         self.calendar.get_working_days_delta(start, end))
+        self.assertFalse(self.index.is_working_day(datetime.date(2021, 12, 25)))
+
+    def test_rebuilt_for_region_and_year(self):
+        today = datetime.date(2023, 6, 1)
+        self.assertIs(get_working_day_index('ES-AN', today), get_working_day_index('ES-AN', today))
+        self.assertIsNot(get_working_day_index('ES-AN', today), get_working_day_index('DE-BE', today))
+        self.assertIsNot(get_working_day_index('ES-AN', today), 
+                         get_working_day_index('ES-AN', datetime.date(2024, 1, 1)))
+
+
+@skipUnlessDBFeature('supports_explaining_query_execution')
+class ReservationIndexTests(TestCase):
+    """
+    The hot reservation queries should search an index instead of 
+    scanning the whole reservation table.
+    """
+    def setUp(self):
+        create_office_environment()
+        self.day = datetime.date(2023, 4, 21)
+        self.workplace = Workplace.objects.get(name='w1_1')
+
+    def assertIndexUsed(self, queryset):
+        plan = queryset.explain()
+        if connection.vendor == 'sqlite':
+            self.assertIn('workwhere_reservation', plan)
+            self.assertNotRegex(plan, r'SCAN (TABLE )?workwhere_reservation\b')
+        else:
+            self.assertNotRegex(plan, r'Seq Scan on workwhere_reservation\b')
+
+    def test_day_and_workplace(self):
+        self.assertIndexUsed(Reservation.objects.filter(day=self.day, workplace=self.workplace))
+
+    def test_day_and_employee(self):
+        self.assertIndexUsed(Reservation.objects.filter(day=self.day, employee='dav_mi'))
+
+    def test_day_office(self):
+        self.assertIndexUsed(Reservation.objects \
+            .filter(day=self.day, workplace__floor__location__isoffice=True) \
+            .exclude(employee='dav_mi'))
+
+    def test_day_range(self):
+        self.assertIndexUsed(Reservation.objects \
+            .filter(day__range=(self.day, self.day + datetime.timedelta(days=4)), 
+                    workplace__floor__location__isoffice=True) \
+            .select_related('employee'))
+
+    def test_month(self):
+        self.assertIndexUsed(Reservation.objects \
+            .filter(day__year=2023, day__month=4) \
+            .values('employee__id') \
+            .annotate(Count('id')))
+
+
+class BookingTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        self.workplace1 = Workplace.objects.get(name='w1_1')
+        self.workplace2 = Workplace.objects.get(name='w2_1')
+        self.dave = Employee.objects.get(pk='dav_mi')
+        self.clare = Employee.objects.get(pk='cla_sm')
+        self.day = datetime.date(2023, 4, 21)
+
+    def test_book_and_change(self):
+        book(self.dave, self.day, self.workplace1)
+        book(self.dave, self.day, self.workplace2)
+        self.assertQuerysetEqual(Reservation.objects.values_list('workplace__name', 'isoffice'), 
+                                 [('w2_1', True)])
+
+    def test_office_workplace_taken(self):
+        book(self.dave, self.day, self.workplace1)
+        with self.assertRaisesMessage(ValidationError, 'Only one reservation per day and office workplace.'):
+            book(self.clare, self.day, self.workplace1)
+
+        # Also when changing an existing reservation
+        book(self.clare, self.day, self.workplace2)
+        with self.assertRaisesMessage(ValidationError, 'Only one reservation per day and office workplace.'):
+            book(self.clare, self.day, self.workplace1)
+        self.assertEqual(Reservation.objects.get(employee=self.clare).workplace, self.workplace2)
+
+    def test_database_constraint(self):
+        """Office workplaces are unique per day, even without validation."""
+        Reservation(day=self.day, employee=self.dave, workplace=self.workplace1).save()
+        with self.assertRaises(IntegrityError):
+            Reservation(day=self.day, employee=self.clare, workplace=self.workplace1).save(validate=False)
+
+    def test_isoffice_follows_location(self):
+        home_office = Workplace.objects.get(name='home_office')
+        book(self.dave, self.day, home_office)
+        location = home_office.floor.location
+        location.isoffice = True
+        location.save()
+        self.assertTrue(Reservation.objects.get().isoffice)
+
+    def test_office_switch_with_shared_workplace(self):
+        """Non-office workplaces reserved twice on a day can't become office workplaces."""
+        home_office = Workplace.objects.get(name='home_office')
+        book(self.dave, self.day, home_office)
+        book(self.clare, self.day, home_office)
+        message = 'home_office is reserved 2 times on 2023-04-21'
+
+        location = home_office.floor.location
+        location.isoffice = True
+        with self.assertRaisesMessage(ValidationError, message):
+            location.full_clean()
+        floor = home_office.floor
+        floor.location = self.workplace1.floor.location
+        with self.assertRaisesMessage(ValidationError, message):
+            floor.full_clean()
+        home_office.floor = self.workplace1.floor
+        with self.assertRaisesMessage(ValidationError, message):
+            home_office.full_clean()
+
+        Reservation.objects.filter(employee=self.clare).delete()
+        location.full_clean()
+        floor.full_clean()
+        home_office.full_clean()
+
+    def test_index_view(self):
+        day = datetime.date.today() + datetime.timedelta(days=1)
+        while day.isoweekday() > 5:
+            day += datetime.timedelta(days=1)
+        data = {'employee': 'dav_mi', 'day': str(day), 'workplace': self.workplace1.pk}
+        response = self.client.post(reverse('workwhere:index'), data)
+        self.assertEqual(response.context['alert'], 'success')
+        self.assertEqual(Reservation.objects.get().workplace, self.workplace1)
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        self.workplace1 = Workplace.objects.get(name='w1_1')
+        self.workplace2 = Workplace.objects.get(name='w2_1')
+        self.home_office = Workplace.objects.get(name='home_office')
+        self.monday = datetime.date(2023, 4, 17)
+        Reservation(day=self.monday, employee_id='dav_mi', workplace=self.workplace1).save()
+        Reservation(day=self.monday + datetime.timedelta(days=2), employee_id='cla_sm',
+                    workplace=self.workplace2).save()
+        Reservation(day=self.monday, employee_id='jam_da', workplace=self.home_office).save()
+
+    def test_several_days(self):
+        with self.assertNumQueries(1):
+            availability = Availability(self.monday + datetime.timedelta(days=i) for i in range(5))
+        self.assertEqual(availability.taken(), {self.workplace1.pk, self.workplace2.pk})
+        self.assertEqual(availability.taken('dav_mi'), {self.workplace2.pk})
+        self.assertNotIn(self.workplace1, availability.free_workplaces())
+        self.assertIn(self.home_office, availability.free_workplaces())
+        self.assertEqual(availability.reserved_workplace(self.monday, 'jam_da'), self.home_office.pk)
+        self.assertIsNone(availability.reserved_workplace(self.monday, 'cla_sm'))
+        with self.assertRaises(ValueError):
+            Availability(['2023-02-30'])
+
+    def test_load_workplaces(self):
+        url = reverse('workwhere:ajax_load_workplaces')
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'day': str(self.monday), 'employee': 'jam_da'})
+        self.assertNotContains(response, 'w1_1')
+        self.assertContains(response, f'<option selected value="{self.home_office.pk}">')
+        response = self.client.get(url, {'day': str(self.monday), 'employee': 'dav_mi'})
+        self.assertContains(response, f'<option selected value="{self.workplace1.pk}">')
+        response = self.client.get(url, {'day': 'yesterday', 'employee': 'dav_mi'})
+        self.assertNotContains(response, 'w1_1')
+
+    def test_api_several_days(self):
+        url = reverse('workwhere:api_free_workplaces')
+        data = self.client.get(url, {'day': str(self.monday), 'end': str(self.monday + datetime.timedelta(days=4))}).json()
+        self.assertEqual([workplace['name'] for workplace in data['results'] if workplace['isoffice']], [])
+        data = self.client.get(url, {'day': str(self.monday + datetime.timedelta(days=1))}).json()
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(self.client.get(url, {'day': str(self.monday), 'end': '2023-04-01'}).status_code, 400)
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    def test_no_double_bookings(self):
+        """Many employees booking the same desks at the same time."""
+        create_office_environment()
+        workplaces = list(Workplace.objects.filter(floor__location__isoffice=True))
+        employees = Employee.objects.bulk_create(
+            [Employee(id=f'e{i}', first_name='e', last_name=str(i)) for i in range(20)])
+        day = datetime.date(2023, 4, 21)
+        barrier = threading.Barrier(len(employees))
+        errors = []
+
+        def worker(employee):
+            barrier.wait()
+            try:
+                # Take the first free workplace
+                for workplace in workplaces:
+                    for _ in range(50):
+                        try:
+                            book(employee, day, workplace)
+                            return
+                        except ValidationError:
+                            break
+                        except OperationalError: # Database locked, try again
+                            time.sleep(0.01)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(employee,)) for employee in employees]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for workplace in workplaces:
+            self.assertEqual(Reservation.objects.filter(day=day, workplace=workplace).count(), 1)
+        self.assertEqual(Reservation.objects.filter(day=day).count(), len(workplaces))
+
+
+def next_weekday(weekday, weeks=0):
+    """The next ISO weekday after today, some weeks later."""
+    today = datetime.date.today()
+    return today + datetime.timedelta(days=(weekday - today.isoweekday() - 1) % 7 + 1, weeks=weeks)
+
+
+class BulkBookingTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        self.workplace1 = Workplace.objects.get(name='w1_1')
+        self.dave = Employee.objects.get(pk='dav_mi')
+        self.clare = Employee.objects.get(pk='cla_sm')
+
+    def test_get_days(self):
+        start = datetime.date(2023, 4, 17)
+        self.assertEqual(len(get_days(start, start + datetime.timedelta(days=13))), 14)
+        self.assertEqual(get_days(start, start + datetime.timedelta(days=13), [2]),
+                         [datetime.date(2023, 4, 18), datetime.date(2023, 4, 25)])
+
+    def test_book_many(self):
+        tuesdays = [next_weekday(2, weeks=i) for i in range(3)]
+        sunday = next_weekday(7)
+        Reservation(day=tuesdays[1], employee=self.clare, workplace=self.workplace1).save()
+
+        # Independent of the number of days
+        with self.assertNumQueries(9):
+            reserved, conflicts = book_many(self.dave, self.workplace1, [*tuesdays, sunday])
+        self.assertEqual(reserved, [tuesdays[0], tuesdays[2]])
+        self.assertEqual(conflicts, {
+            tuesdays[1]: 'Only one reservation per day and office workplace.',
+            sunday: 'Invalid date - not a working day',
+        })
+        self.assertEqual(Reservation.objects.filter(employee=self.dave, isoffice=True).count(), 2)
+
+    def test_own_reservations(self):
+        tuesday = next_weekday(2)
+        book(self.dave, tuesday, Workplace.objects.get(name='home_office'))
+        reserved, conflicts = book_many(self.dave, self.workplace1, [tuesday])
+        self.assertEqual(conflicts, {tuesday: 'Only one reservation per day and user.'})
+
+        # Already reserved days count as reserved
+        wednesday = next_weekday(3)
+        book(self.dave, wednesday, self.workplace1)
+        reserved, conflicts = book_many(self.dave, self.workplace1, [wednesday])
+        self.assertEqual(reserved, [wednesday])
+
+    def test_bulk_reservation_view(self):
+        monday = next_weekday(1)
+        response = self.client.post(reverse('workwhere:ajax_bulk_reservation'), {
+            'employee': 'dav_mi', 'workplace': self.workplace1.pk, 
+            'start': str(monday), 'end': str(monday + datetime.timedelta(days=13)), 
+            'weekdays': [1, 3],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['reserved']) + len(response.json()['conflicts']), 4)
+
+        response = self.client.post(reverse('workwhere:ajax_bulk_reservation'), {
+            'employee': 'dav_mi', 'workplace': self.workplace1.pk, 
+            'start': str(monday), 'end': str(monday - datetime.timedelta(days=1)),
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+class AllocationTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        floor1 = Floor.objects.get(name='floor1')
+        Workplace.objects.create(name='w1_2', floor=floor1)
+        Workplace.objects.create(name='w1_3', floor=floor1)
+        self.team = ['dav_mi', 'cla_sm', 'jam_da']
+        self.days = [next_weekday(2), next_weekday(3)]
+        self.other = Employee.objects.create(first_name='Olivia', last_name='Other', id='oli_ot')
+
+    def desks(self, plan):
+        return {(reservation.day, reservation.employee_id): reservation.workplace.name for reservation in plan}
+
+    def test_allocate(self):
+        Reservation(day=self.days[0], employee=self.other, workplace=Workplace.objects.get(name='w1_1')).save()
+        Settings.clear_cache()
+        # Independent of the number of employees and days
+        with self.assertNumQueries(9):
+            plan, conflicts = allocate(self.team, self.days)
+        self.assertEqual(conflicts, {})
+        desks = self.desks(plan)
+        self.assertEqual(len(desks), 6)
+        self.assertNotIn('w1_1', [desks[day, employee] for day, employee in desks if day == self.days[0]])
+        # Same desks on the following day
+        for employee in self.team:
+            self.assertEqual(desks[self.days[0], employee], desks[self.days[1], employee])
+        self.assertEqual(Reservation.objects.filter(employee__in=self.team, isoffice=True).count(), 6)
+
+    def test_together(self):
+        plan, conflicts = allocate(self.team, self.days, together='floor', preferred=['w2_1'])
+        self.assertEqual(conflicts, {})
+        self.assertEqual({reservation.workplace.floor.name for reservation in plan}, {'floor1'})
+
+        Reservation.objects.all().delete()
+        Reservation(day=self.days[1], employee=self.other, workplace=Workplace.objects.get(name='w1_2')).save()
+        plan, conflicts = allocate(self.team, self.days, together='floor')
+        self.assertEqual(plan, [])
+        self.assertEqual(conflicts[self.days[0]], ['No floor with 3 free desks on all days.'])
+        self.assertEqual(Reservation.objects.count(), 1)
+
+        plan, conflicts = allocate(self.team, self.days, together='location')
+        self.assertEqual(conflicts, {})
+
+    def test_preferred(self):
+        w2_1 = Workplace.objects.get(name='w2_1')
+        plan, conflicts = allocate(['cla_sm', 'dav_mi'], self.days[:1], preferred=[w2_1], commit=False)
+        self.assertEqual(self.desks(plan), {(self.days[0], 'cla_sm'): 'w2_1', (self.days[0], 'dav_mi'): 'w1_1'})
+        # Not saved
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_conflicts(self):
+        sunday = next_weekday(7)
+        book(Employee.objects.get(pk='dav_mi'), self.days[1], Workplace.objects.get(name='home_office'))
+        plan, conflicts = allocate([*self.team, 'oli_ot', 'sar_br'], [*self.days, sunday])
+        self.assertEqual(plan, [])
+        self.assertEqual(conflicts, {
+            self.days[0]: ['Not enough free desks: 4 for 5 employees.'],
+            self.days[1]: ['dav_mi: Only one reservation per day and user.',
+                           'Not enough free desks: 4 for 5 employees.'],
+            sunday: ['Invalid date - not a working day'],
+        })
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_team_reservation_view(self):
+        url = reverse('workwhere:ajax_team_reservation')
+        data = {'employees': self.team, 'start': str(self.days[0]), 'end': str(self.days[1]),
+                'together': 'floor', 'floor': Floor.objects.get(name='floor1').pk}
+        response = self.client.post(url, {**data, 'dry_run': 'on'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['reserved']), 6)
+        self.assertFalse(Reservation.objects.exists())
+
+        response = self.client.post(url, data)
+        self.assertEqual(len(response.json()['reserved']), 6)
+        self.assertEqual(Reservation.objects.count(), 6)
+
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(len(response.json()['conflicts']), 2)
+
+        response = self.client.post(url, {**data, 'together': 'building'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_team_reservation_preferred_order(self):
+        url = reverse('workwhere:ajax_team_reservation')
+        preferred = [Workplace.objects.get(name=name).pk for name in ('w1_3', 'w2_1', 'w1_1')]
+        response = self.client.post(url, {'employees': self.team[:2], 'start': str(self.days[0]),
+                                          'end': str(self.days[0]), 'preferred': preferred, 'dry_run': 'on'})
+        self.assertEqual([reservation['workplace'] for reservation in response.json()['reserved']],
+                         ['w1_3', 'w2_1'])
+
+
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        cache.clear()
+        self.dave = Employee.objects.get(pk='dav_mi')
+        self.day = next_weekday(2)
+        book(self.dave, self.day, Workplace.objects.get(name='w1_1'))
+        self.url = reverse('workwhere:employee_calendar', args=['dav_mi'])
+
+    def test_feed(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        content = response.content.decode()
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertIn(f'DTSTART;VALUE=DATE:{self.day:%Y%m%d}\r\n', content)
+        self.assertIn(f'UID:dav_mi-{self.day:%Y%m%d}@workwhere\r\n', content)
+        self.assertIn('SUMMARY:w1_1\r\n', content)
+        self.assertIn('LOCATION:location_office - floor1\r\n', content)
+        self.assertEqual(self.client.get(reverse('workwhere:employee_calendar', args=['nobody'])).status_code, 404)
+
+    def test_cache_and_etag(self):
+        response = self.client.get(self.url)
+        # Only the versions are read
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).content, response.content)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        # Reservations of others don't invalidate the feed
+        book(Employee.objects.get(pk='cla_sm'), self.day, Workplace.objects.get(name='w2_1'))
+        self.assertEqual(self.client.get(self.url)['ETag'], response['ETag'])
+
+        book(self.dave, self.day, Workplace.objects.get(name='home_office'))
+        changed = self.client.get(self.url)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertIn('SUMMARY:home_office\r\n', changed.content.decode())
+
+    def test_rename(self):
+        response = self.client.get(self.url)
+        self.dave.first_name = 'David'
+        self.dave.save()
+        renamed = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(renamed.status_code, 200)
+        self.assertIn('X-WR-CALNAME:WorkWhere: David Miller\r\n', renamed.content.decode())
+
+    def test_fold(self):
+        self.assertEqual(_fold('a' * 75), 'a' * 75)
+        folded = _fold('ä' * 50)
+        self.assertTrue(all(len(line.encode()) <= 75 for line in folded.split('\r\n')))
+        self.assertEqual(folded.replace('\r\n ', ''), 'ä' * 50)
+
+
+class ReservationAdminTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        self.day = next_weekday(2)
+        self.floor1 = Floor.objects.get(name='floor1')
+        self.floor2 = Floor.objects.get(name='floor2')
+        Workplace.objects.create(name='w2_2', floor=self.floor2)
+        book(Employee.objects.get(pk='dav_mi'), self.day, Workplace.objects.get(name='w1_1'))
+        book(Employee.objects.get(pk='cla_sm'), self.day, Workplace.objects.get(name='home_office'))
+        book(Employee.objects.get(pk='dav_mi'), next_weekday(3), Workplace.objects.get(name='w1_1'))
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.url = reverse('admin:workwhere_reservation_changelist')
+
+    def test_changelist_queries(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(self.url).status_code, 200)
+            return len(queries)
+
+        few = count_queries()
+        for i in range(10):
+            employee = Employee.objects.create(first_name='First', last_name=str(i), id=f'e{i}')
+            Reservation(day=self.day, employee=employee,
+                        workplace=Workplace.objects.create(name=f'x{i}', floor=self.floor1)).save()
+        self.assertEqual(count_queries(), few)
+
+    def test_autocomplete(self):
+        response = self.client.get(reverse('admin:workwhere_reservation_add'))
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertNotContains(response, 'Miller, Dave')
+
+    def test_cancel_days(self):
+        reservation = Reservation.objects.get(day=self.day, employee='dav_mi')
+        version = DataVersion.objects.get(key=DataVersion.employee_key('cla_sm')).version
+        response = self.client.post(self.url, {'action': 'cancel_days', '_selected_action': [reservation.pk]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(Reservation.objects.values_list('day', flat=True)), [next_weekday(3)])
+        # Also the reservations of others on that day
+        self.assertEqual(DataVersion.objects.get(key=DataVersion.employee_key('cla_sm')).version, version + 1)
+
+    def test_move_to_floor(self):
+        pks = list(Reservation.objects.values_list('pk', flat=True))
+        response = self.client.post(self.url, {'action': f'move_to_floor_{self.floor2.pk}',
+                                               '_selected_action': pks})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(Reservation.objects.values_list('workplace__name', flat=True)),
+                         {'w2_1', 'home_office'})
+
+    def test_move_floor_view(self):
+        url = reverse('admin:workwhere_reservation_move_floor')
+        self.assertContains(self.client.get(self.url), url)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.post(url, {'source': self.floor1.pk, 'target': self.floor2.pk,
+                                          'start': str(self.day), 'end': str(next_weekday(3))})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(Reservation.objects.values_list('workplace__name', flat=True)),
+                         {'w2_1', 'home_office'})
+
+        response = self.client.post(url, {'source': self.floor2.pk, 'target': self.floor2.pk,
+                                          'start': str(self.day), 'end': str(self.day)})
+        self.assertContains(response, 'The floors must be different.')
+
+    def test_move_reservations(self):
+        Reservation(day=self.day, employee=Employee.objects.get(pk='jam_da'),
+                    workplace=Workplace.objects.get(name='w2_1')).save()
+        Reservation(day=next_weekday(3), employee=Employee.objects.get(pk='jam_da'),
+                    workplace=Workplace.objects.get(name='w2_1')).save()
+        Reservation(day=next_weekday(3), employee=Employee.objects.get(pk='cla_sm'),
+                    workplace=Workplace.objects.get(name='w2_2')).save()
+        moved, conflicts = move_reservations(Reservation.objects.filter(employee='dav_mi'), self.floor2)
+        self.assertEqual(moved, 1)
+        self.assertEqual(conflicts,
+                         {next_weekday(3): 'Not enough free desks on location_office - floor2: 0 for 1 reservations.'})
+        self.assertEqual(Reservation.objects.get(day=self.day, employee='dav_mi').workplace.name, 'w2_2')
+
+    def test_cancel_reservations(self):
+        with self.assertNumQueries(5):
+            self.assertEqual(cancel_reservations(Reservation.objects.filter(employee='dav_mi')), 2)
+        self.assertEqual(cancel_reservations(Reservation.objects.filter(employee='dav_mi')), 0)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_delete_selected(self):
+        pks = list(Reservation.objects.values_list('pk', flat=True))
+        response = self.client.post(self.url, {'action': 'delete_selected', '_selected_action': pks, 'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Reservation.objects.exists())
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        self.workplace1 = Workplace.objects.get(name='w1_1')
+        self.dave = Employee.objects.get(pk='dav_mi')
+
+    def test_free_workplaces(self):
+        day = datetime.date(2023, 4, 21)
+        book(self.dave, day, self.workplace1)
+        url = reverse('workwhere:api_free_workplaces')
+
+        response = self.client.get(url, {'day': str(day), 'employee': 'cla_sm'})
+        self.assertEqual(response.json()['count'], 4)
+        self.assertNotIn('w1_1', [workplace['name'] for workplace in response.json()['results']])
+
+        response = self.client.get(url, {'day': str(day), 'employee': 'dav_mi'})
+        self.assertEqual(response.json()['count'], 5)
+
+        self.assertEqual(self.client.get(url, {'day': 'tomorrow'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'day': '2023-02-30'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'day': str(day), 'end': '2023-04-31'}).status_code, 400)
+
+    def test_today(self):
+        book(self.dave, timezone.now().date(), self.workplace1)
+        response = self.client.get(reverse('workwhere:api_today'), {'limit': 1})
+        data = response.json()
+        self.assertEqual((data['count'], data['num_pages']), (2, 2))
+        self.assertEqual(data['results'], [{
+            'id': self.workplace1.pk, 'name': 'w1_1', 'floor': 'floor1', 'location': 'location_office',
+            'employee': {'id': 'dav_mi', 'first_name': 'Dave', 'last_name': 'Miller'},
+        }])
+
+        data = self.client.get(reverse('workwhere:api_today'), {'limit': 1, 'page': 2}).json()
+        self.assertEqual(data['results'][0]['employee'], None)
+        self.assertEqual(self.client.get(reverse('workwhere:api_today'), {'limit': 0}).status_code, 400)
+
+    def test_week(self):
+        book(self.dave, datetime.date(2023, 4, 12), self.workplace1)
+        url = reverse('workwhere:api_week', kwargs={'year': 2023, 'week': 15})
+        with self.assertNumQueries(3):
+            data = self.client.get(url).json()
+        self.assertEqual(data['days'][0], '2023-04-10')
+        self.assertEqual([employee and employee['id'] for employee in data['results'][0]['employees']],
+                         [None, None, 'dav_mi', None, None])
+        self.assertEqual(self.client.get(reverse('workwhere:api_week', 
+            kwargs={'year': 2023, 'week': 60})).status_code, 404)
+
+
+    def test_floor_occupancy(self):
+        day = datetime.date(2023, 4, 12)
+        floor = self.workplace1.floor
+        Workplace.objects.filter(pk=self.workplace1.pk).update(x=25.0, y=50.5)
+        Workplace.objects.create(name='w1_2', floor=floor)
+        book(self.dave, day, self.workplace1)
+        book(self.dave, day + datetime.timedelta(days=1), Workplace.objects.get(name='w1_2'))
+        url = reverse('workwhere:api_floor_occupancy', kwargs={'floor_id': floor.pk})
+        with self.assertNumQueries(1):
+            data = self.client.get(url, {'day': str(day)}).json()
+        self.assertEqual(data['results'], [
+            {'id': self.workplace1.pk, 'name': 'w1_1', 'x': 25.0, 'y': 50.5,
+             'employee': {'id': 'dav_mi', 'first_name': 'Dave', 'last_name': 'Miller'}},
+            {'id': Workplace.objects.get(name='w1_2').pk, 'name': 'w1_2', 'x': None, 'y': None, 'employee': None},
+        ])
+        # Several reservations of a non-office workplace
+        home_office = Workplace.objects.get(name='home_office')
+        book(Employee.objects.get(pk='cla_sm'), day, home_office)
+        book(Employee.objects.get(pk='jam_da'), day, home_office)
+        data = self.client.get(reverse('workwhere:api_floor_occupancy', kwargs={'floor_id': home_office.floor_id}),
+                               {'day': str(day)}).json()
+        self.assertEqual([desk['name'] for desk in data['results']], ['business_trip', 'home_office', 'not_working'])
+
+        self.assertEqual(self.client.get(url, {'day': 'today'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'day': '2023-02-30'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('workwhere:api_floor_occupancy', 
+                                                 kwargs={'floor_id': 999})).status_code, 404)
+
+    def test_floors_occupancy(self):
+        day = datetime.date(2023, 4, 12)
+        home_office = Workplace.objects.get(name='home_office')
+        book(self.dave, day, self.workplace1)
+        url = reverse('workwhere:api_floors_occupancy')
+        params = {'floors': f'{self.workplace1.floor_id},{home_office.floor_id}', 'day': str(day)}
+        with self.assertNumQueries(2):  # versions for the ETag, occupancy
+            response = self.client.get(url, params)
+        data = response.json()
+        self.assertEqual(set(data['results']), {str(self.workplace1.floor_id), str(home_office.floor_id)})
+        self.assertEqual(data['results'][str(self.workplace1.floor_id)],
+                         self.client.get(reverse('workwhere:api_floor_occupancy',
+                                                 kwargs={'floor_id': self.workplace1.floor_id}),
+                                         {'day': str(day)}).json()['results'])
+
+        # Unchanged until the next reservation of that day
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        book(Employee.objects.get(pk='cla_sm'), day, home_office)
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.assertEqual(self.client.get(url, {'floors': 'a,b'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'floors': '1', 'day': '2023-02-30'}).status_code, 400)
+
+
+class EventTests(TestCase):
+    def test_broadcaster(self):
+        broadcaster = LocalBroadcaster()
+        subscriber = broadcaster.subscribe()
+        broadcaster.publish({'days': ['2023-04-21']})
+        self.assertEqual(subscriber.get_nowait(), {'days': ['2023-04-21']})
+        broadcaster.unsubscribe(subscriber)
+        self.assertFalse(broadcaster.has_subscribers())
+
+    def test_published_on_commit(self):
+        create_office_environment()
+        subscriber = get_broadcaster().subscribe()
+        self.addCleanup(get_broadcaster().unsubscribe, subscriber)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book(Employee.objects.get(pk='dav_mi'), datetime.date(2023, 4, 21), 
+                 Workplace.objects.get(name='w1_1'))
+        self.assertEqual(subscriber.get_nowait(), {'days': ['2023-04-21']})
+
+    def test_stream_events(self):
+        day = datetime.date(2023, 4, 21)
+        stream = stream_events(day, timeout=1, keepalive=0.1)
+        self.assertTrue(next(stream).startswith('retry:'))
+        get_broadcaster().publish({'days': ['2023-04-20']}) # other day, ignored
+        get_broadcaster().publish({'days': ['2023-04-21']})
+        self.assertEqual(next(stream), 'event: reservations\ndata: {"days": ["2023-04-21"]}\n\n')
+        self.assertEqual(next(stream), ': keepalive\n\n')
+        stream.close()
+        self.assertFalse(get_broadcaster().has_subscribers())
+
+    def test_today_events_view(self):
+        with self.settings(WORKWHERE_EVENTS=True, WORKWHERE_EVENTS_STREAM_TIMEOUT=0):
+            response = self.client.get(reverse('workwhere:ajax_today_events'))
+            self.assertContains(self.client.get(reverse('workwhere:today')), 'data-events-url="')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(b''.join(response.streaming_content), b'retry: 10000\n\n')
+
+    def test_disabled_by_default(self):
+        # The pages poll, streams would keep sync workers busy.
+        self.assertEqual(self.client.get(reverse('workwhere:ajax_today_events')).status_code, 404)
+        self.assertNotContains(self.client.get(reverse('workwhere:today')), 'data-events-url="')
+
+
+class AsgiEventStreamTests(SimpleTestCase):
+    def setUp(self):
+        # Like the test client, keep the connections of the test.
+        request_started.disconnect(close_old_connections)
+        self.addCleanup(request_started.connect, close_old_connections)
+
+        def reload():
+            importlib.reload(urls)
+            # The project URLconf keeps the resolved patterns of its includes.
+            importlib.reload(sys.modules[django_settings.ROOT_URLCONF])
+            clear_url_caches()
+
+        self.addCleanup(reload)
+        with self.settings(WORKWHERE_ASYNC_VIEWS=True):
+            reload()
+
+    async def test_events_sent_before_timeout(self):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': reverse('workwhere:ajax_today_events'), 'raw_path': b'',
+            'query_string': b'', 'headers': [], 'client': ('127.0.0.1', 1234), 'server': ('testserver', 80),
+        }
+        received = asyncio.Queue()
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            await received.put(message)
+
+        async def next_body():
+            while True:
+                message = await received.get()
+                if message['type'] == 'http.response.body':
+                    return message['body']
+
+        start = time.monotonic()
+        with self.settings(WORKWHERE_EVENTS=True, WORKWHERE_EVENTS_STREAM_TIMEOUT=5):
+            handler = asyncio.ensure_future(ASGIHandler()(scope, receive, send))
+            try:
+                self.assertEqual(await asyncio.wait_for(next_body(), 4), b'retry: 10000\n\n')
+                get_broadcaster().publish({'days': [str(timezone.now().date())]})
+                self.assertTrue((await asyncio.wait_for(next_body(), 4)).startswith(b'event: reservations\n'))
+            finally:
+                handler.cancel()
+        self.assertLess(time.monotonic() - start, 4)
+
+
+class DataVersionBroadcasterTests(TransactionTestCase):
+    def test_changes_of_other_processes(self):
+        broadcaster = DataVersionBroadcaster()
+        broadcaster.interval = 0.05
+        subscriber = broadcaster.subscribe()
+        time.sleep(0.2)
+
+        # Like a reservation saved by another process
+        DataVersion.bump(DataVersion.day_key(timezone.now().date()))
+        self.assertEqual(subscriber.get(timeout=2), {'days': [str(timezone.now().date())]})
+
+        broadcaster.unsubscribe(subscriber)
+        time.sleep(0.2)
+        self.assertIsNone(broadcaster._watcher)
+
+    def test_own_changes_published_once(self):
+        broadcaster = DataVersionBroadcaster()
+        broadcaster.interval = 0.05
+        subscriber = broadcaster.subscribe()
+        self.addCleanup(broadcaster.unsubscribe, subscriber)
+        time.sleep(0.2)
+
+        # Like a reservation saved by this process
+        DataVersion.bump(DataVersion.day_key(timezone.now().date()))
+        broadcaster.publish({'days': [str(timezone.now().date())]})
+        self.assertEqual(subscriber.get(timeout=2), {'days': [str(timezone.now().date())]})
+        time.sleep(0.3)
+        self.assertTrue(subscriber.empty())
+
+    def test_watcher_restarted(self):
+        broadcaster = DataVersionBroadcaster()
+        broadcaster.interval = 0.05
+        with mock.patch.object(DataVersion, 'get_many', side_effect=OperationalError), \
+                self.assertLogs('workwhere.events', 'ERROR'):
+            subscriber = broadcaster.subscribe()
+            self.addCleanup(broadcaster.unsubscribe, subscriber)
+            broadcaster._watcher.join(timeout=2)
+        self.assertFalse(broadcaster._watcher.is_alive())
+
+        other = broadcaster.subscribe()
+        self.addCleanup(broadcaster.unsubscribe, other)
+        self.assertTrue(broadcaster._watcher.is_alive())
+
+
+class SummaryTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        Settings.clear_cache()
+        self.client.force_login(User.objects.create_user('admin'))
+        self.workplace1 = Workplace.objects.get(name='w1_1')
+        self.workplace2 = Workplace.objects.get(name='w2_1')
+        self.home_office = Workplace.objects.get(name='home_office')
+
+    def book(self, employee_id, day, workplace):
+        with self.captureOnCommitCallbacks(execute=True):
+            book(Employee.objects.get(pk=employee_id), day, workplace)
+
+    def test_rollups(self):
+        self.book('dav_mi', datetime.date(2023, 4, 20), self.workplace1)
+        self.book('jam_da', datetime.date(2023, 4, 20), self.workplace2)
+        self.book('dav_mi', datetime.date(2023, 4, 21), self.home_office)
+        self.assertQuerysetEqual(
+            DailyOccupancy.objects.order_by('day', 'location__name')
+                .values_list('day', 'location__name', 'count_all', 'count_nonstudent'),
+            [(datetime.date(2023, 4, 20), 'location_office', 2, 1),
+             (datetime.date(2023, 4, 21), 'location_no_office', 1, 1)])
+        self.assertEqual(MonthlyEmployeeStats.objects.filter(employee='dav_mi').count(), 2)
+
+        # Moving a reservation to the next month
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation = Reservation.objects.get(employee='dav_mi', day=datetime.date(2023, 4, 21))
+            reservation.day = datetime.date(2023, 5, 2)
+            reservation.save()
+        self.assertFalse(DailyOccupancy.objects.filter(day=datetime.date(2023, 4, 21)).exists())
+        self.assertQuerysetEqual(
+            MonthlyEmployeeStats.objects.filter(employee='dav_mi').order_by('month')
+                .values_list('month', 'count'),
+            [(datetime.date(2023, 4, 1), 1), (datetime.date(2023, 5, 1), 1)])
+
+        # Deleting
+        with self.captureOnCommitCallbacks(execute=True):
+            Reservation.objects.filter(employee='jam_da').delete()
+        self.assertEqual(DailyOccupancy.objects.get(day=datetime.date(2023, 4, 20)).count_all, 1)
+
+    def test_cascade_delete(self):
+        """Reservations deleted in cascade are announced once per deletion."""
+        days = [datetime.date(2023, 4, day) for day in (17, 18, 19)]
+        for day in days:
+            self.book('dav_mi', day, self.workplace1)
+        self.book('jam_da', days[0], self.workplace2)
+        self.book('jam_da', days[1], self.home_office)
+        changes = []
+        def receiver(sender, days, employees, **kwargs):
+            changes.append((set(days), set(employees)))
+        reservations_changed.connect(receiver)
+        self.addCleanup(reservations_changed.disconnect, receiver)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Floor.objects.filter(location__isoffice=True).delete()
+        self.assertEqual(changes, [(set(days), {'dav_mi', 'jam_da'})])
+        self.assertQuerysetEqual(DailyOccupancy.objects.values_list('day', 'count_all'), [(days[1], 1)])
+
+        changes.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            Employee.objects.get(pk='jam_da').delete()
+        self.assertEqual(changes, [({days[1]}, {'jam_da'})])
+        self.assertFalse(DailyOccupancy.objects.exists())
+
+    def test_layout_moves(self):
+        self.book('dav_mi', datetime.date(2023, 4, 20), self.workplace1)
+        self.book('jam_da', datetime.date(2023, 4, 20), self.workplace2)
+        annex = Location.objects.create(name='annex', isoffice=True)
+        floor1 = self.workplace1.floor
+        floor1.location = annex
+        floor1.save()
+        self.assertQuerysetEqual(
+            DailyOccupancy.objects.order_by('location__name').values_list('location__name', 'count_all'),
+            [('annex', 1), ('location_office', 1)])
+        self.assertQuerysetEqual(
+            MonthlyEmployeeStats.objects.order_by('location__name').values_list('location__name', 'employee'),
+            [('annex', 'dav_mi'), ('location_office', 'jam_da')])
+
+        workplace2 = Workplace.objects.get(pk=self.workplace2.pk)
+        workplace2.floor = floor1
+        workplace2.save()
+        self.assertQuerysetEqual(DailyOccupancy.objects.values_list('location__name', 'count_all'), [('annex', 2)])
+
+    def test_location_without_workplaces(self):
+        """Stale rollups of a location without workplaces don't break the summary."""
+        self.book('dav_mi', datetime.date(2023, 4, 20), self.workplace1)
+        # Without updating the rollups
+        Workplace.objects.filter(floor__location__name='location_office').update(floor=self.home_office.floor)
+        response = self.client.get(reverse('workwhere:summary', kwargs={'year': 2023, 'month': 4}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['data_per_day']['location_office']['total_rate'], 0)
+
+    def test_student_flag(self):
+        self.book('dav_mi', datetime.date(2023, 4, 20), self.workplace1)
+        dave = Employee.objects.get(pk='dav_mi')
+        dave.isstudent = True
+        dave.save()
+        self.assertEqual(DailyOccupancy.objects.get().count_nonstudent, 0)
+
+    def test_summary(self):
+        self.book('dav_mi', datetime.date(2023, 4, 20), self.workplace1)
+        self.book('dav_mi', datetime.date(2023, 4, 21), self.home_office)
+        self.book('jam_da', datetime.date(2023, 4, 20), self.workplace2)
+        url = reverse('workwhere:summary', kwargs={'year': 2023, 'month': 4})
+        response = self.client.get(url)
+        workdays = response.context['workdays_count']
+        self.assertEqual(response.context['data_per_person']['dav_mi']['total_count'], 2)
+        self.assertEqual(response.context['data_per_person']['dav_mi']['office_count'], 1)
+        self.assertEqual(response.context['data_per_person']['jam_da']['office_rate'], 100/workdays)
+        self.assertEqual(response.context['data_per_day']['location_office']['total'], 2)
+        self.assertEqual(response.context['data_per_day']['location_office']['total_nonstudent_rate'],
+                         100/(2*workdays))
+        self.assertNotIn('location_no_office', response.context['data_per_day'])
+
+    def test_constant_query_count(self):
+        url = reverse('workwhere:summary', kwargs={'year': 2023, 'month': 4})
+        self.book('dav_mi', datetime.date(2023, 4, 3), self.workplace1)
+        self.client.get(url) # Load the settings into the cache
+        cache.clear() # Without the cached tables
+        with CaptureQueriesContext(connection) as few_reservations:
+            self.client.get(url)
+
+        for i in range(4, 20):
+            self.book('dav_mi', datetime.date(2023, 4, i), self.workplace1)
+            self.book('cla_sm', datetime.date(2023, 4, i), self.workplace2)
+        cache.clear()
+        with CaptureQueriesContext(connection) as many_reservations:
+            self.client.get(url)
+        self.assertEqual(len(many_reservations), len(few_reservations))
+
+    def test_rebuild_command(self):
+        Reservation(day=datetime.date(2023, 3, 31), employee=Employee.objects.get(pk='dav_mi'), 
+                    workplace=self.workplace1).save()
+        Reservation(day=datetime.date(2023, 4, 3), employee=Employee.objects.get(pk='cla_sm'), 
+                    workplace=self.workplace1).save()
+        DailyOccupancy.objects.all().delete()
+        MonthlyEmployeeStats.objects.all().delete()
+        call_command('workwhere_rebuild_rollups', stdout=open(os.devnull, 'w'))
+        self.assertEqual(DailyOccupancy.objects.count(), 2)
+        self.assertEqual(MonthlyEmployeeStats.objects.count(), 2)
+
+    def test_report_per_person(self):
+        self.book('dav_mi', datetime.date(2023, 4, 20), self.workplace1)
+        self.book('dav_mi', datetime.date(2023, 5, 2), self.home_office)
+        self.book('jam_da', datetime.date(2023, 4, 20), self.workplace2)
+        response = self.client.get(reverse('workwhere:report'), 
+                                   {'kind': 'person', 'start': '2023-04-01', 'end': '2023-05-31'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][0], 'employee')
+        self.assertEqual([row[:6] for row in rows[1:]], [
+            ['jam_da', 'James', 'Davis', 'yes', rows[1][4], '1'],
+            ['dav_mi', 'Dave', 'Miller', 'no', rows[1][4], '2'],
+        ])
+        self.assertEqual(rows[2][7], '1')
+
+    def test_report_per_location(self):
+        self.book('dav_mi', datetime.date(2023, 4, 20), self.workplace1)
+        self.book('jam_da', datetime.date(2023, 4, 20), self.workplace2)
+        response = self.client.get(reverse('workwhere:report'), 
+                                   {'kind': 'location', 'start': '2023-04-20', 'end': '2023-04-20'})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[1], ['location_office', '1', '2', '2', '100.0', '1', '50.0'])
+
+    def test_working_days_as_summary(self):
+        """Reports and the summary count the first day of the range."""
+        # 2023-03-01 is a Wednesday
+        self.book('dav_mi', datetime.date(2023, 3, 1), self.workplace1)
+        workdays = self.client.get(reverse('workwhere:summary', kwargs={'year': 2023, 'month': 3})) \
+            .context['workdays_count']
+        calendar = Settings.load_cached().get_working_days()
+        self.assertEqual(workdays, sum(calendar.is_working_day(datetime.date(2023, 3, day)) for day in range(1, 32)))
+        response = self.client.get(reverse('workwhere:report'),
+                                   {'kind': 'person', 'start': '2023-03-01', 'end': '2023-03-31'})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[1][4], str(workdays))
+
+    def test_report_invalid(self):
+        response = self.client.get(reverse('workwhere:report'), 
+                                   {'kind': 'location', 'start': '2023-04-20', 'end': '2023-04-19'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ImportCommandTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+
+    def run_import(self, kind, content, suffix='.csv', *args):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        out = io.StringIO()
+        call_command('workwhere_import', kind, file.name, *args, stdout=out)
+        return out.getvalue()
+
+    def test_employees(self):
+        content = "id,first_name,last_name,isstudent\n" \
+                  "dav_mi,David,Miller,no\n" \
+                  "cla_sm,Clare,Smith,no\n" \
+                  "new_em,New,Employee,yes\n"
+        out = self.run_import('employees', content, '.csv', '--deactivate-missing')
+        self.assertIn("~ dav_mi: first_name Dave -> David", out)
+        self.assertIn("1 created, 1 updated, 1 deactivated", out)
+        self.assertEqual(Employee.objects.get(pk='dav_mi').first_name, 'David')
+        self.assertTrue(Employee.objects.get(pk='new_em').isstudent)
+        self.assertFalse(Employee.objects.get(pk='jam_da').isactive)
+        self.assertTrue(Employee.objects.get(pk='cla_sm').isactive)
+
+    def test_dry_run(self):
+        content = json.dumps([{'id': 'dav_mi', 'first_name': 'David', 'last_name': 'Miller'},
+                              {'id': 'new_em', 'first_name': 'New', 'last_name': 'Employee'}])
+        out = self.run_import('employees', content, '.json', '--dry-run')
+        self.assertIn("+ new_em", out)
+        self.assertIn("dry run", out)
+        self.assertEqual(Employee.objects.get(pk='dav_mi').first_name, 'Dave')
+        self.assertFalse(Employee.objects.filter(pk='new_em').exists())
+
+    def test_layout(self):
+        self.run_import('locations', "name,isoffice\nlocation_office,true\nannex,true\n")
+        self.run_import('floors', "location,name\nannex,ground\nlocation_office,floor1\n")
+        self.assertEqual(Floor.objects.filter(location__name='location_office').count(), 2)
+
+        reservation = Reservation.objects.create(day=datetime.date(2023, 4, 20), employee_id='dav_mi',
+                                                 workplace=Workplace.objects.get(name='home_office'))
+        self.assertFalse(reservation.isoffice)
+        layout_version = DataVersion.get_many(DataVersion.LAYOUT).get(DataVersion.LAYOUT)
+        out = self.run_import('workplaces', "location,floor,name\nannex,ground,a1\nannex,ground,home_office\n")
+        self.assertIn("1 created, 1 updated", out)
+        self.assertEqual(Workplace.objects.get(name='home_office').floor.location.name, 'annex')
+        reservation.refresh_from_db()
+        self.assertTrue(reservation.isoffice)
+        self.assertNotEqual(DataVersion.get_many(DataVersion.LAYOUT).get(DataVersion.LAYOUT), layout_version)
+        # The rollups count the reservation for the new location
+        self.assertQuerysetEqual(DailyOccupancy.objects.values_list('day', 'location__name', 'count_all'),
+                                 [(datetime.date(2023, 4, 20), 'annex', 1)])
+
+    def test_office_switch_with_shared_workplace(self):
+        home_office = Workplace.objects.get(name='home_office')
+        for employee in ('dav_mi', 'cla_sm'):
+            Reservation.objects.create(day=datetime.date(2023, 4, 20), employee_id=employee, workplace=home_office)
+        message = "home_office is reserved 2 times on 2023-04-20"
+        with self.assertRaisesMessage(CommandError, message):
+            self.run_import('locations', "name,isoffice\nlocation_no_office,true\n")
+        self.assertFalse(Location.objects.get(name='location_no_office').isoffice)
+        with self.assertRaisesMessage(CommandError, message):
+            self.run_import('workplaces', "location,floor,name\nlocation_office,floor1,home_office\n")
+        self.assertEqual(Workplace.objects.get(name='home_office').floor.name, 'floor_other')
+
+    def test_invalid_rows(self):
+        with self.assertRaisesMessage(CommandError, "Row 3: location 'unknown' does not exist."):
+            self.run_import('floors', "location,name\nlocation_office,floor3\nunknown,floor4\n")
+        # Nothing is written if a row is invalid
+        self.assertFalse(Floor.objects.filter(name='floor3').exists())
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        Settings.clear_cache()
+        self.workplace1 = Workplace.objects.get(name='w1_1')
+        self.home_office = Workplace.objects.get(name='home_office')
+        with self.captureOnCommitCallbacks(execute=True):
+            for day in range(3, 8):
+                Reservation(day=datetime.date(2023, 4, day), employee_id='dav_mi', workplace=self.workplace1).save()
+            Reservation(day=datetime.date(2023, 4, 3), employee_id='cla_sm', workplace=self.home_office).save()
+
+    def test_archive(self):
+        key = DataVersion.day_key(datetime.date(2023, 4, 3))
+        version = DataVersion.get_many(key)[key]
+        export = io.BytesIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            count = archive_reservations(datetime.date(2023, 4, 6), batch_size=2, export=export)
+        self.assertEqual(count, 4)
+        self.assertEqual(Reservation.objects.count(), 2)
+        self.assertEqual(ArchivedReservation.objects.filter(isoffice=True).count(), 3)
+        lines = gzip.decompress(export.getvalue()).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(json.loads(lines[1]),
+                         {'day': '2023-04-03', 'employee': 'cla_sm', 'workplace': self.home_office.pk,
+                          'isoffice': False})
+        # The day versions of the archived days changed
+        self.assertNotEqual(DataVersion.get_many(key)[key], version)
+
+    def test_delete_in_batches(self):
+        rows = list(Reservation.objects.values_list('pk', 'day', 'employee_id'))
+        with mock.patch.object(connection.ops, 'bulk_batch_size', return_value=4), \
+                CaptureQueriesContext(connection) as queries:
+            delete_reservations(rows)
+        self.assertFalse(Reservation.objects.exists())
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('DELETE')]), 2)
+
+    def test_rollups_and_reports(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            archive_reservations(datetime.date(2023, 4, 6))
+        call_command('workwhere_rebuild_rollups', '--start', '2023-04-01', '--end', '2023-04-30',
+                     stdout=open(os.devnull, 'w'))
+        self.assertEqual(MonthlyEmployeeStats.objects.get(employee='dav_mi').count, 5)
+        self.assertEqual(DailyOccupancy.objects.get(day=datetime.date(2023, 4, 3),
+                                                    location__isoffice=True).count_all, 1)
+
+        self.client.force_login(User.objects.create_user('admin'))
+        response = self.client.get(reverse('workwhere:report'),
+                                   {'kind': 'person', 'start': '2023-04-01', 'end': '2023-04-30'})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual([row[:6] for row in rows[1:]], [
+            ['dav_mi', 'Dave', 'Miller', 'no', rows[1][4], '5'],
+            ['cla_sm', 'Clare', 'Smith', 'no', rows[1][4], '1'],
+        ])
+
+    def test_command(self):
+        with self.settings(WORKWHERE_ARCHIVE_AFTER_DAYS=None):
+            with self.assertRaises(CommandError):
+                call_command('workwhere_archive', stdout=open(os.devnull, 'w'))
+        call_command('workwhere_archive', '--before', '2023-04-05', stdout=open(os.devnull, 'w'))
+        self.assertEqual(ArchivedReservation.objects.count(), 3)
+
+
+class EmployeeSearchTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        self.url = reverse('workwhere:ajax_search_employees')
+
+    def search(self, query, **params):
+        return [employee['id'] for employee in self.client.get(self.url, {'q': query, **params}).json()['results']]
+
+    def test_prefixes(self):
+        self.assertEqual(self.search('mil'), ['dav_mi'])
+        self.assertEqual(self.search('D'), ['jam_da', 'dav_mi'])
+        self.assertEqual(self.search('dave m'), ['dav_mi'])
+        self.assertEqual(self.search('cla_'), ['cla_sm'])
+        self.assertEqual(self.search('d', limit=1), ['jam_da'])
+        self.assertEqual(self.search(''), [])
+        # Inactive employees are not found
+        self.assertEqual(self.search('sarah'), [])
+
+    def test_refresh_after_change(self):
+        self.assertEqual(self.search('mil'), ['dav_mi'])
+        Employee.objects.create(first_name='Mila', last_name='Jones', id='mil_jo')
+        self.assertEqual(self.search('mil'), ['mil_jo', 'dav_mi'])
+        Employee.objects.filter(pk='mil_jo').delete()
+        self.assertEqual(self.search('mil'), ['dav_mi'])
+
+    def test_one_query(self):
+        self.search('mil')
+        with self.assertNumQueries(1):
+            self.search('mil')
+
+
+class FloormapVariantTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = self.settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        create_office_environment()
+        self.floor = Floor.objects.get(name='floor1')
+
+    def upload(self, size=(1200, 800)):
+        content = io.BytesIO()
+        Image.new('RGB', size, 'white').save(content, 'PNG')
+        self.floor.floormap = SimpleUploadedFile('map.png', content.getvalue())
+        self.floor.save()
+
+    def test_variants_on_upload(self):
+        self.upload()
+        urls = self.floor.get_floormap_variant_urls()
+        self.assertEqual(set(urls), {'thumb', 'thumb_webp', 'webp'})
+        self.assertTrue(urls['thumb'].endswith('.jpg'))
+
+        response = self.client.get(urls['thumb_webp'])
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        image = Image.open(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual((image.format, image.size), ('WEBP', (480, 320)))
+
+        self.assertContains(self.client.get(reverse('workwhere:index')), urls['thumb_webp'])
+        self.assertEqual(self.client.get(reverse('workwhere:floormap_variant', args=['0123abcd-thumb.jpg'])).status_code, 404)
+        for name in ['..', '.', 'missing.jpg', 'map.png.bak']:
+            self.assertEqual(self.client.get(reverse('workwhere:floormap_variant', args=[name])).status_code, 404)
+
+    def test_backfill(self):
+        self.upload()
+        Floor.objects.update(floormap_variants={})
+        self.floor.refresh_from_db()
+        self.assertEqual(self.floor.get_floormap_variant_urls(), {})
+        # Pages only link the original
+        response = self.client.get(reverse('workwhere:index'))
+        self.assertContains(response, self.floor.floormap.url)
+        self.assertEqual(Floor.objects.get(pk=self.floor.pk).floormap_variants, {})
+        call_command('workwhere_floormap_variants', stdout=open(os.devnull, 'w'))
+        self.floor.refresh_from_db()
+        self.assertEqual(len(self.floor.get_floormap_variant_urls()), 3)
+
+    def test_today_overlay(self):
+        self.upload()
+        url = f"{reverse('workwhere:api_floors_occupancy')}?floors={self.floor.pk}"
+        self.assertNotContains(self.client.get(reverse('workwhere:today')), url)
+        Workplace.objects.filter(name='w1_1').update(x=10, y=20)
+        self.assertContains(self.client.get(reverse('workwhere:today')), url)
+
+    def test_invalid_image(self):
+        self.floor.floormap = SimpleUploadedFile('map.png', b'no image')
+        with self.assertLogs('workwhere.floormaps', 'WARNING'):
+            self.floor.save()
+        self.assertEqual(self.floor.get_floormap_variant_urls(), {})
+        self.assertEqual(self.client.get(reverse('workwhere:index')).status_code, 200)
+
+
+class BenchmarkTests(TestCase):
+    def test_command(self):
+        out = io.StringIO()
+        call_command('workwhere_benchmark', '--locations', '1', '--floors', '2', '--desks', '3',
+                     '--employees', '10', '--months', '1', '--repeat', '1', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['data']['desks'], 6)
+        self.assertEqual(set(report['results']), {'index', 'load_workplaces', 'today', 'week', 'summary'})
+        for result in report['results'].values():
+            self.assertEqual(result['status'], 200)
+            self.assertGreater(result['queries'], 0)
+            self.assertEqual(set(result['uncached_time_ms']), {'min', 'median'})
+        # The generated data is removed again
+        self.assertFalse(Employee.objects.exists())
+
+    def test_uncached_timings(self):
+        create_office_environment()
+        cache.clear()
+        tables = []
+        def render_table(template_name, context):
+            tables.append(template_name)
+            return ''
+        with mock.patch.object(views, 'render_to_string', side_effect=render_table):
+            results = benchmark.run(repeat=2, cases={'week': (reverse('workwhere:week', args=[2023, 16]), {})})
+        self.assertEqual(set(results['week']['uncached_time_ms']), {'min', 'median'})
+        # Built for the warm-up and each uncached request only
+        self.assertEqual(tables, ['workwhere/week_table.html'] * 3)
+
+    def test_polling(self):
+        out = io.StringIO()
+        call_command('workwhere_benchmark', '--locations', '1', '--floors', '1', '--desks', '3',
+                     '--employees', '5', '--months', '1', '--repeat', '1', '--polling', '3', stdout=out)
+        polling = json.loads(out.getvalue())['polling']
+        self.assertEqual(set(polling), {'update_today', 'load_workplaces'})
+        for result in polling.values():
+            self.assertEqual(result['requests'], 9)
+            self.assertGreater(result['async_per_second'], 0)
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        create_office_environment()
+        Settings.clear_cache()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        middleware = self.modify_settings(
+            MIDDLEWARE={'append': 'workwhere.instrumentation.InstrumentationMiddleware'})
+        middleware.enable()
+        self.addCleanup(middleware.disable)
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('workwhere:index'))
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[0-9.]+;desc="[1-9][0-9]* queries", .*render;dur=[0-9.]+, total;dur=[0-9.]+$')
+        response = self.client.get(reverse('workwhere:week', kwargs={'year': 2023, 'week': 15}))
+        self.assertIn('render;dur=', response['Server-Timing'])
+        # Disabled by default
+        self.assertEqual(self.client.get(reverse('workwhere:metrics')).status_code, 404)
+
+    def test_metrics(self):
+        with self.settings(WORKWHERE_METRICS=True):
+            self.client.get(reverse('workwhere:today'))
+            self.client.get(reverse('workwhere:today'))
+            response = self.client.get(reverse('workwhere:metrics'))
+        self.assertNotIn('Server-Timing', response)
+        text = response.content.decode()
+        self.assertIn('workwhere_requests_total{view="today"} 2', text)
+        self.assertIn('workwhere_request_duration_seconds_count{view="today"} 2', text)
+        self.assertIn('workwhere_calendar_duration_seconds_bucket{view="today",le="+Inf"} 2', text)
+        self.assertNotIn('view="metrics"', text)
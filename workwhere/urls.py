@@ -1,18 +1,36 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import views, api, instrumentation, async_views
+
+# The polled views, async for ASGI deployments
+polled = async_views if getattr(settings, 'WORKWHERE_ASYNC_VIEWS', False) else views
 
 app_name = 'workwhere' # Set application namespace
 urlpatterns = [
     path('', views.index, name='index'),
     path('week/', views.WeekRedirect.as_view(), name='week_redirect'),
     path('week/<int:year>/<int:week>/', views.week, name='week'),
-    path('today/', views.Today.as_view(), name='today'),
+    path('today/', polled.Today.as_view(), name='today'),
     path('info/', views.Info.as_view(), name='info'),
+    path('calendar/<str:employee_id>.ics', views.employee_calendar, name='employee_calendar'),
+    path('floormaps/<str:name>', views.floormap_variant, name='floormap_variant'),
 
-    path('ajax/update-today', views.Today.as_view(template_name='workwhere/today_list.html'), name='ajax_update_today'),
-    path('ajax/load-workplaces/', views.load_workplaces, name='ajax_load_workplaces'),
+    path('ajax/update-today', polled.Today.as_view(template_name='workwhere/today_list.html'), name='ajax_update_today'),
+    path('ajax/today-events', polled.today_events, name='ajax_today_events'),
+    path('ajax/load-workplaces/', polled.load_workplaces, name='ajax_load_workplaces'),
+    path('ajax/search-employees/', views.search_employees, name='ajax_search_employees'),
+    path('ajax/bulk-reservation/', views.bulk_reservation, name='ajax_bulk_reservation'),
+    path('ajax/team-reservation/', views.team_reservation, name='ajax_team_reservation'),
 
     path('summary/', views.SummaryRedirect.as_view(), name='summary_redirect'),
     path('summary/<int:year>/<int:month>/', views.summary, name='summary'),    
+    path('report/', views.report, name='report'),
+    path('metrics/', instrumentation.metrics_view, name='metrics'),
+
+    path('api/free-workplaces/', api.free_workplaces, name='api_free_workplaces'),
+    path('api/today/', api.today, name='api_today'),
+    path('api/week/<int:year>/<int:week>/', api.week, name='api_week'),
+    path('api/floors/occupancy/', api.floors_occupancy, name='api_floors_occupancy'),
+    path('api/floors/<int:floor_id>/occupancy/', api.floor_occupancy, name='api_floor_occupancy'),
 ]
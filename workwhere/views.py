@@ -1,17 +1,37 @@
 import datetime
 import calendar
+import hashlib
 
+from django.conf import settings
 from django.utils import timezone
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render as _render
+from django.template.loader import render_to_string
+from django.core.cache import cache
+from django.utils.safestring import mark_safe
 from django.urls import reverse
 from django.views import generic
-from django.http import Http404
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.exceptions import ValidationError
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count, Q
-from workalendar.registry import registry
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition, require_POST
+from django.db.models import Count, Q, Sum
 
-from .models import Reservation, Workplace, Floor, Infotext, Settings
-from .forms import ReservationForm
+from .models import Workplace, Floor, Employee, Infotext, Settings, DataVersion, DailyOccupancy, MonthlyEmployeeStats
+from .forms import ReservationForm, BulkReservationForm, TeamReservationForm, ReportForm
+from .booking import book, book_many, get_days
+from .occupancy import build_week_grid, build_today_status, get_overlay_floors
+from .events import events_enabled, stream_events
+from .search import get_employee_index
+from .availability import Availability
+from .allocation import allocate
+from .instrumentation import timed
+from . import floormaps, ical, reports
+
+
+# Rendering is measured separately by the optional instrumentation.
+render = timed('render')(_render)
+render_to_string = timed('render')(render_to_string)
 
 
 def index(request):
@@ -20,27 +40,28 @@ def index(request):
     """
     if request.method == 'POST':
         form = ReservationForm(request.POST)
-        print(request.POST)
+        alert = "error"
+        message = "Reservation failed"
         if form.is_valid():
             selected_employee = form.cleaned_data['employee']
             selected_day = form.cleaned_data['day']
             selected_workplace = form.cleaned_data['workplace']
 
-            _, _ = Reservation.objects.update_or_create(
-                day=selected_day, 
-                employee=selected_employee,
-                defaults={'workplace': selected_workplace})         
-            alert = "success"
-            message = f"Reserved: {selected_employee.first_name}, {selected_day: %d.%m.}, {selected_workplace}"
-        else:
-            alert = "error"
-            message = "Reservation failed"
+            try:
+                book(selected_employee, selected_day, selected_workplace)
+            except ValidationError as e:
+                form.add_error(None, e)
+            else:
+                alert = "success"
+                message = f"Reserved: {selected_employee.first_name}, {selected_day: %d.%m.}, {selected_workplace}"
     else:
         form = ReservationForm(initial={'day': timezone.now().date()})
         alert = None
         message = None
 
-    maps = Floor.objects.all()
+    # The variants of the floor maps are created when they are saved,
+    # see workwhere.floormaps.
+    maps = Floor.objects.select_related('location')
 
     context = {
         'form': form,
@@ -61,20 +82,15 @@ def load_workplaces(request):
     day = request.GET.get('day')
     employee = request.GET.get('employee')
     reserved_pk = None
+    choice_workplaces = Workplace.objects.none()
     if day and employee:
-        other_desk_reservations_today = Reservation.objects \
-            .filter(day=day, workplace__floor__location__isoffice=True) \
-            .exclude(employee=employee)
-        choice_workplaces = Workplace.objects \
-            .exclude(reservation__in=other_desk_reservations_today) \
-            .order_by('floor__location__isoffice', 'name')
-
-        already_reserved_workplace = Workplace.objects \
-            .filter(reservation__employee=employee, reservation__day=day)
-        if already_reserved_workplace.exists():
-            reserved_pk = already_reserved_workplace.first().pk
-    else:
-        choice_workplaces = Workplace.objects.none()
+        try:
+            availability = Availability([day])
+        except ValueError:
+            pass  # invalid day, no options
+        else:
+            choice_workplaces = availability.free_workplaces(employee)
+            reserved_pk = availability.reserved_workplace(day, employee)
 
     context = {
         'workplaces': choice_workplaces, 
@@ -84,6 +100,172 @@ def load_workplaces(request):
     return render(request, 'workwhere/workplace_dropdown_list_options.html', context)
 
 
+def floormap_variant(request, name):
+    """
+    A floor map variant. The file names contain a hash of the content,
+    so they can be cached for a year.
+    """
+    try:
+        file = floormaps.open_variant(name)
+    except (FileNotFoundError, ValueError):
+        raise Http404("Floor map not found.")
+    response = FileResponse(file)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+def search_employees(request):
+    """
+    Active employees matching the GET parameter `q` by prefixes of the
+    names or the ID, as JSON. Used for the employee field of the
+    reservation form.
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+    except ValueError:
+        limit = 20
+    matches = get_employee_index().search(request.GET.get('q', ''), limit)
+    return JsonResponse({'results': [{'id': pk, 'label': label} for pk, label in matches]})
+
+
+@require_POST
+def bulk_reservation(request):
+    """
+    Reserve one workplace for an employee on several days, given by a
+    date range and optionally the weekdays. Returns the reserved days
+    and the days that could not be reserved as JSON.
+    """
+    form = BulkReservationForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    days = get_days(form.cleaned_data['start'], form.cleaned_data['end'], form.cleaned_data['weekdays'])
+    reserved, conflicts = book_many(form.cleaned_data['employee'], form.cleaned_data['workplace'], days)
+
+    return JsonResponse({
+        'reserved': reserved,
+        'conflicts': {str(day): message for day, message in conflicts.items()},
+    })
+
+
+@require_POST
+def team_reservation(request):
+    """
+    Reserve office desks for several employees on several days, assigned
+    automatically. Returns the reservations as JSON, or with status 409
+    the days on which not all employees could get a desk; then nothing
+    is reserved.
+    """
+    form = TeamReservationForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    floor = form.cleaned_data['floor']
+    days = get_days(form.cleaned_data['start'], form.cleaned_data['end'], form.cleaned_data['weekdays'])
+    plan, conflicts = allocate(
+        form.cleaned_data['employees'], days,
+        together=form.cleaned_data['together'] or None,
+        preferred=form.cleaned_data['preferred'],
+        workplaces=Workplace.objects.filter(floor=floor) if floor else None,
+        commit=not form.cleaned_data['dry_run'])
+
+    if conflicts:
+        return JsonResponse({'conflicts': {str(day): messages for day, messages in conflicts.items()}}, status=409)
+    return JsonResponse({
+        'reserved': [{'day': reservation.day, 'employee': reservation.employee_id,
+                      'workplace': reservation.workplace.name} for reservation in plan],
+    })
+
+
+def _version_stamp(keys, versions):
+    """
+    Identifies the state of the data of the given DataVersion keys, for
+    cache keys. Includes the change times, as versions can repeat after
+    rollbacks.
+    """
+    stamp = ';'.join(f"{key}.{versions[key][0]}.{versions[key][1].timestamp()}" if key in versions else key
+                     for key in keys)
+    return hashlib.md5(stamp.encode()).hexdigest()
+
+
+def _version_keys(days):
+    return [DataVersion.LAYOUT, DataVersion.EMPLOYEES, *(DataVersion.day_key(day) for day in days)]
+
+
+def _versions_result(request, keys, versions, days):
+    # Pages also differ in the header depending on the logged in user.
+    etag = '-'.join([str(request.user.pk), *(f"{key}.{versions.get(key, (0,))[0]}" for key in keys)])
+    # Never older than the start of the first day, so switching
+    # to a new day is always detected, but not in the future for
+    # future weeks.
+    start = timezone.make_aware(datetime.datetime.combine(days[0], datetime.time()))
+    last_modified = min(max([start, *(changed for _, changed in versions.values())]), timezone.now())
+    return etag, last_modified, _version_stamp(keys, versions)
+
+
+def _data_versions(request, days):
+    """
+    Returns the ETag, the last modification time and the version stamp
+    of the reservations on the given days, the office layout and the
+    employees. The result is stored on the request, so ETag,
+    Last-Modified and the view share one query.
+    """
+    keys = _version_keys(days)
+    cache_key = tuple(keys)
+    if getattr(request, '_workwhere_versions', (None,))[0] != cache_key:
+        versions = DataVersion.get_many(*keys)
+        request._workwhere_versions = (cache_key, *_versions_result(request, keys, versions, days))
+    return request._workwhere_versions[1:]
+
+
+def _cached_fragment(name, stamp, closed, build):
+    """
+    Returns the HTML fragment built by build(), cached by name and the
+    version stamp of its data. Fragments of closed periods are kept
+    until evicted, others for WORKWHERE_FRAGMENT_CACHE_TIMEOUT seconds.
+    """
+    key = f"workwhere:fragment:{name}:{stamp}"
+    html = cache.get(key)
+    if html is None:
+        html = build()
+        timeout = None if closed else getattr(settings, 'WORKWHERE_FRAGMENT_CACHE_TIMEOUT', 600)
+        cache.set(key, html, timeout)
+    return mark_safe(html)
+
+
+def _today_etag(request, *args, **kwargs):
+    return _data_versions(request, [timezone.now().date()])[0]
+
+
+def _today_last_modified(request, *args, **kwargs):
+    return _data_versions(request, [timezone.now().date()])[1]
+
+
+def _week_days(year, week):
+    try:
+        monday = datetime.date.fromisocalendar(year, week, 1)
+    except ValueError:
+        raise Http404('Year or week not valid.')
+    return [monday + datetime.timedelta(days=i) for i in range(5)]
+
+
+def _week_etag(request, year, week):
+    return _data_versions(request, _week_days(year, week))[0]
+
+
+def _week_last_modified(request, year, week):
+    return _data_versions(request, _week_days(year, week))[1]
+
+
+def _today_context(status):
+    return {
+        'desks_today': status,
+        'title': f"Reservations on {timezone.now():%A, %B %d (%Y)}",
+        'events': events_enabled(),
+    }
+
+
+@method_decorator(condition(etag_func=_today_etag, last_modified_func=_today_last_modified), name='get')
 class Today(generic.View):
     """
     Gets reservation data on office workplaces for current day.
@@ -92,54 +274,47 @@ class Today(generic.View):
     template_name = 'workwhere/today.html'
 
     def get(self, request):
-        reservations_today = Reservation.objects \
-            .filter(day=timezone.now().date()) \
-            .select_related('employee')
-        
-        status = {}
-        for floor in Floor.objects.filter(location__isoffice=True):
-            if floor not in status:
-                status[floor] = {}
-
-            workplaces = Workplace.objects.filter(floor=floor, floor__location__isoffice=True).order_by('name')
-            for workplace in workplaces:
-                try:
-                    status[floor][workplace.name] = reservations_today.get(workplace=workplace).employee
-                except Reservation.DoesNotExist: 
-                    status[floor][workplace.name] = ""
-
-        context = {
-            'desks_today': status,
-            'title': f"Reservations on {timezone.now():%A, %B %d (%Y)}"
-        }
+        status = build_today_status(timezone.now().date())
+
+        context = _today_context(status)
+        if self.template_name == Today.template_name:
+            # The overlay is updated by the page itself.
+            context['overlay_floors'] = get_overlay_floors(status)
 
         return render(request, self.template_name, context)
 
+def _event_stream_response(stream_events):
+    """The response of the events of today from stream_events (sync or async)."""
+    if not events_enabled():
+        raise Http404("Events are not enabled.")
+    timeout = getattr(settings, 'WORKWHERE_EVENTS_STREAM_TIMEOUT', 300)
+    response = StreamingHttpResponse(stream_events(timezone.now().date(), timeout=timeout), 
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Disable buffering in nginx
+    return response
+
+
+def today_events(request):
+    """
+    Server-Sent Events announcing changes of today's reservations, so 
+    open today pages only reload the list when needed.
+    """
+    return _event_stream_response(stream_events)
+
+@condition(etag_func=_week_etag, last_modified_func=_week_last_modified)
 def week(request, year, week):
     """
     Gets reservation data for office workplaces in a given week.
     """
-    try:
-        monday = datetime.date.fromisocalendar(year, week, 1)
-        friday = datetime.date.fromisocalendar(year, week, 5)
-    except ValueError:
-        raise Http404('Year or week not valid.')
-
-    weekdays = [monday + datetime.timedelta(days=i) for i in range(5)]
-    weekday_names = [day.strftime("%A") for day in weekdays]
-    data = [['', *weekday_names]]
-    for workplace in Workplace.objects.filter(floor__location__isoffice=True).order_by('name'):
-        row = [workplace]
-        for day in weekdays:
-            try:
-                reserved = Reservation.objects.get(day=day, workplace=workplace)
-            except Reservation.DoesNotExist:
-                reserved = False
-            row.append('-' if not reserved else reserved.employee)  
-        data.append(row)
+    weekdays = _week_days(year, week)
+    monday, friday = weekdays[0], weekdays[-1]
+    table = _cached_fragment(
+        f"week:{year}-{week}", _data_versions(request, weekdays)[2], closed=friday < timezone.now().date(),
+        build=lambda: render_to_string('workwhere/week_table.html', {'data': build_week_grid(weekdays)}))
 
     context = {
-        'data': data,
+        'table': table,
         'title': 'Workplace availability',
         'date': monday.isocalendar(),
         'prev': (monday - datetime.timedelta(weeks=1)).isocalendar(),
@@ -175,18 +350,22 @@ def summary(request, year, month):
     except ValueError:
         raise Http404('Year or month not valid.')
 
-    holidays_calendar = registry.get(Settings.load().iso_region)
-    workdays_count = holidays_calendar().get_working_days_delta(first, last)
-    
-    report_per_person = _get_per_person_summary(year, month, workdays_count)
+    def build():
+        workdays_count = reports.count_working_days(first, last)
+        return render_to_string('workwhere/summary_tables.html', {
+            'data_per_person': _get_per_person_summary(year, month, workdays_count),
+            'workdays_count': workdays_count,
+            'data_per_day': _get_per_day_summary(year, month, workdays_count),
+        })
 
-    report_per_day = _get_per_day_summary(year, month, workdays_count)
+    keys = [DataVersion.month_key(first), DataVersion.LAYOUT, DataVersion.EMPLOYEES, DataVersion.SETTINGS]
+    stamp = _version_stamp(keys, DataVersion.get_many(*keys))
+    tables = _cached_fragment(f"summary:{year}-{month}", stamp, closed=last < timezone.now().date(), build=build)
 
     context = {
-        'data_per_person': report_per_person,
-        'workdays_count': workdays_count,
-        'data_per_day': report_per_day,
+        'tables': tables,
         'date': first,
+        'last': last,
         'prev': (first - datetime.timedelta(days=1)).replace(day=1),
         'next': (first + datetime.timedelta(days=31)).replace(day=1),        
     }
@@ -194,18 +373,15 @@ def summary(request, year, month):
     return render(request, 'workwhere/summary.html', context)
 
 def _get_per_day_summary(year, month, workdays_count):
-    reservations = Reservation.objects \
-        .filter(day__year=year, day__month=month, workplace__floor__location__isoffice=True) \
-        .select_related('workplace__floor__location')
-
-    reservation_counts = reservations.values('day', 'workplace__floor__location__name') \
-        .annotate(count_all=Count('id'), count_nonstudent=Count('id', filter=Q(employee__isstudent=False)))
+    reservation_counts = DailyOccupancy.objects \
+        .filter(day__year=year, day__month=month, location__isoffice=True) \
+        .values('day', 'location__name', 'count_all', 'count_nonstudent')
 
     result = {}
 
     for count in reservation_counts:
         day = count['day']
-        location_name = count['workplace__floor__location__name']
+        location_name = count['location__name']
         reservation_count = count['count_all']
         nonstudent_count = count['count_nonstudent']
 
@@ -222,21 +398,33 @@ def _get_per_day_summary(year, month, workdays_count):
         result[location_name]['total'] += reservation_count
         result[location_name]['total_nonstudent'] += nonstudent_count
 
+    workplace_counts = dict(Workplace.objects \
+        .filter(floor__location__name__in=result.keys()) \
+        .values_list('floor__location__name') \
+        .annotate(Count('id')) \
+        .order_by())
+
     for location in result.keys():
-        total_workplaces_this_month = workdays_count * Workplace.objects.filter(floor__location__name=location).count()
-        result[location]['total_rate'] = 100*result[location]['total']/total_workplaces_this_month
-        result[location]['total_nonstudent_rate'] = 100*result[location]['total_nonstudent']/total_workplaces_this_month
+        total_workplaces_this_month = workdays_count * workplace_counts.get(location, 0)
+        # Locations without workplaces any more still have reservations
+        # of the month.
+        if total_workplaces_this_month:
+            result[location]['total_rate'] = 100*result[location]['total']/total_workplaces_this_month
+            result[location]['total_nonstudent_rate'] = \
+                100*result[location]['total_nonstudent']/total_workplaces_this_month
+        else:
+            result[location]['total_rate'] = 0
+            result[location]['total_nonstudent_rate'] = 0
         
     return result
 
 def _get_per_person_summary(year, month, workdays_count):
-    reservations = Reservation.objects \
-        .filter(day__year=year, day__month=month) \
-        .select_related('employee')
-
-    reservation_counts = reservations.values('employee__id', 'employee__first_name', 'employee__last_name') \
-        .annotate(total_count=Count('id'), office_count=Count('id', filter=Q(workplace__floor__location__isoffice=True)))
+    reservation_counts = MonthlyEmployeeStats.objects \
+        .filter(month=datetime.date(year, month, 1)) \
+        .values('employee__id', 'employee__first_name', 'employee__last_name') \
+        .annotate(total_count=Sum('count'), office_count=Sum('count', filter=Q(location__isoffice=True), default=0))
 
+    office_rate_minimum = Settings.load_cached().min_office_percent
     result = {}
 
     for count in reservation_counts:
@@ -247,11 +435,62 @@ def _get_per_person_summary(year, month, workdays_count):
             'total_rate': count['total_count']/workdays_count*100,
             'office_count': count['office_count'],
             'office_rate': count['office_count']/workdays_count*100,
-            'office_rate_minimum': Settings.load().min_office_percent,
+            'office_rate_minimum': office_rate_minimum,
         }
 
     return result
 
+@login_required
+def report(request):
+    """
+    Reservation report as CSV for a date range (GET parameters start
+    and end), per person or per location (kind).
+    """
+    form = ReportForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    start, end, kind = form.cleaned_data['start'], form.cleaned_data['end'], form.cleaned_data['kind']
+
+    rows = reports.per_person_rows(start, end) if kind == 'person' else reports.per_location_rows(start, end)
+    response = StreamingHttpResponse(reports.stream_csv(rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="workwhere_{kind}_{start}_{end}.csv"'
+    return response
+
+def _calendar_versions(request, employee_id):
+    """
+    Returns the ETag of the calendar feed of the employee, its first day
+    and the time of the last change, stored on the request like
+    _data_versions().
+    """
+    if getattr(request, '_workwhere_calendar', (None,))[0] != employee_id:
+        # The feed name contains the name of the employee.
+        keys = [DataVersion.employee_key(employee_id), DataVersion.LAYOUT, DataVersion.EMPLOYEES]
+        versions = DataVersion.get_many(*keys)
+        # The feed starts at a day relative to today.
+        start = ical.get_start()
+        changed = max([datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc),
+                       *(changed for _, changed in versions.values())])
+        request._workwhere_calendar = (employee_id, f"{_version_stamp(keys, versions)}-{start}", start, changed)
+    return request._workwhere_calendar[1:]
+
+
+def _calendar_etag(request, employee_id):
+    return _calendar_versions(request, employee_id)[0]
+
+
+@condition(etag_func=_calendar_etag)
+def employee_calendar(request, employee_id):
+    """
+    The reservations of an employee as iCalendar feed for calendar
+    clients. Polls of unchanged feeds are answered from the cache, or
+    with 304 if the client sends the ETag.
+    """
+    etag, start, changed = _calendar_versions(request, employee_id)
+    content = _cached_fragment(
+        f"calendar:{employee_id}", etag, closed=False,
+        build=lambda: ical.build_calendar(get_object_or_404(Employee, pk=employee_id), start, changed))
+    return HttpResponse(content, content_type='text/calendar; charset=utf-8')
+
 class SummaryRedirect(generic.RedirectView):
     def get_redirect_url(self):
         first_of_this_month = timezone.now().replace(day=1)
@@ -0,0 +1,101 @@
+"""
+Precomputed working days for the holiday calendars of workalendar.
+
+Workalendar computes holidays year by year in pure Python. The
+WorkingDayIndex materializes the working days of a range of years once
+into a bitmap with cumulative counts, so that single days and day
+ranges are answered in constant time.
+"""
+import datetime
+import functools
+from array import array
+
+from workalendar.registry import registry
+
+from .instrumentation import timed
+
+
+# Years around the current year covered by the index. Dates outside
+# are passed on to the workalendar calendar.
+YEARS_BEFORE = 2
+YEARS_AFTER = 2
+
+
+@functools.lru_cache(maxsize=None)
+@timed('calendar')
+def get_calendar(iso_region):
+    """
+    Returns the workalendar instance for the given ISO region.
+
+    Calendar instances keep their computed holidays, so reusing them
+    saves recomputing the holiday tables on every request.
+    """
+    return registry.get(iso_region)()
+
+
+def get_working_day_index(iso_region, today=None):
+    """
+    Returns the WorkingDayIndex for the given ISO region covering the
+    years around today. A new index is built when the region or the
+    current year changes.
+    """
+    year = (today or datetime.date.today()).year
+    return _get_working_day_index(iso_region, year)
+
+
+@functools.lru_cache(maxsize=4)
+@timed('calendar')
+def _get_working_day_index(iso_region, year):
+    return WorkingDayIndex(get_calendar(iso_region), year - YEARS_BEFORE, year + YEARS_AFTER)
+
+
+class WorkingDayIndex:
+    """
+    Working days of a calendar between the first and the last year
+    (both included).
+
+    The methods mirror the ones of the workalendar calendar.
+    """
+
+    def __init__(self, calendar, first_year, last_year):
+        self.calendar = calendar
+        self.first = datetime.date(first_year, 1, 1).toordinal()
+        self.last = datetime.date(last_year, 12, 31).toordinal()
+
+        # _working[i] is 1 if the day first+i is a working day and
+        # _cumulative[i] is the number of working days before first+i.
+        self._working = bytearray(self.last - self.first + 1)
+        self._cumulative = array('L', [0])
+        count = 0
+        for i in range(len(self._working)):
+            if calendar.is_working_day(datetime.date.fromordinal(self.first + i)):
+                self._working[i] = 1
+                count += 1
+            self._cumulative.append(count)
+
+    def _covers(self, *days):
+        return all(self.first <= day.toordinal() <= self.last for day in days)
+
+    @timed('calendar')
+    def is_working_day(self, day):
+        if not self._covers(day):
+            return self.calendar.is_working_day(day)
+        return bool(self._working[day.toordinal() - self.first])
+
+    @timed('calendar')
+    def get_working_days_delta(self, start, end, include_start=False):
+        """
+        Returns the number of working days after start up to and
+        including end. The order of the dates doesn't matter.
+        Same as the method of workalendar calendars.
+        """
+        if not self._covers(start, end):
+            return self.calendar.get_working_days_delta(start, end, include_start=include_start)
+
+        start, end = sorted([start.toordinal() - self.first, end.toordinal() - self.first])
+        if start == end:
+            return 0
+        count = self._cumulative[end + 1] - self._cumulative[start + 1]
+        if include_start:
+            count += self._working[start]
+        return count